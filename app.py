@@ -2,7 +2,9 @@
 """
 Main app entry (dep_tool pattern): check Python, pip install -r requirements.txt, run main app.
 """
-from dep_highlighter_server import app
+from dep_highlighter_server import app, start_warm_up
+
+start_warm_up()  # gunicorn imports this module in each worker: warm before /health reports ready
 
 if __name__ == "__main__":
     import os
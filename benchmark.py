@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite: synthetic RDM workbooks, per-stage timings, peak RSS, JSON output.
+Generates RDM-shaped workbooks (rows, columns, header offset, DEP density, run lengths, optional
+.xlsm with a VBA part and stray formatting far to the right), then times each stage of the
+pipeline in a fresh process: header probe, streaming read, lean pandas read (parcel/notes columns
+only, before the full read so its peak RSS is its own), full pd.read_excel, highlight_logic,
+load_workbook, fill loop, wb.save, zip patch and process_excel_file end to end.
+Usage: python benchmark.py [--rows 20000 100000] [--xlsm] [--json out.json] [--compare base.json]
+       python benchmark.py --suite fill-modes [--rows 5000] [--stray-col 200]
+       python benchmark.py --suite startup [--rows 20000] [--repeat 3]
+       python benchmark.py --suite workers [--rows 20000] [--workers 1 2 4] [--requests 24] [--clients 4]
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+DEPLOY_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(DEPLOY_DIR))
+
+import openpyxl
+from openpyxl.styles import Font
+
+from dep_highlighter_server import FILL_MODES, WRITERS, process_excel_file
+
+HEADER = ["Tax ID", "Bill ID", "Owner", "Parcel Number", "Address", "Amount", "Status", "Parcel Notes"]
+STAGES = ("header_probe", "stream_read", "pd_read_lean", "pd_read_excel", "highlight_logic",
+          "load_workbook", "fill_loop", "wb_save", "zip_patch")
+
+
+def make_workbook(path, rows, cols=12, stray_col=0, dep_every=3, header_offset=0, dep_density=None,
+                  run_lengths=(2,), seed=0, xlsm=False):
+    """Write a synthetic RDM sheet and return the number of rows the highlighter must flag.
+    Parcels come in runs whose lengths are drawn from run_lengths; a run is noted DEP with
+    probability dep_density (default: every dep_every-th run). header_offset puts a title and
+    blank rows above the header. stray_col > cols adds a formatted empty cell there to inflate
+    max_column. xlsm=True adds a VBA project part (path should end in .xlsm)."""
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("RDM")
+    for i in range(header_offset):
+        ws.append(["NY New York City RDM report"] if i == 0 else [])
+    header = HEADER + [f"Extra {c}" for c in range(len(HEADER) + 1, cols + 1)]
+    if stray_col > cols:
+        stray = openpyxl.cell.WriteOnlyCell(ws)
+        stray.font = Font(italic=True)
+        header = header + [None] * (stray_col - cols - 1) + [stray]
+    ws.append(header)
+    extra = [f"x{c}" for c in range(len(HEADER) + 1, cols + 1)]
+    expected = 0
+    i = run = 0
+    while i < rows:
+        length = min(rng.choice(run_lengths), rows - i)
+        dep = rng.random() < dep_density if dep_density is not None else run % dep_every == 0
+        if dep and length >= 2:
+            expected += length
+        for _ in range(length):
+            ws.append([i, f"B{i}", "Owner", f"100-{run:07d}", "1 Main St", 12.5, "Open", "DEP" if dep else ""] + extra)
+            i += 1
+        run += 1
+    wb.save(path)
+    if xlsm:
+        _add_vba_part(path)
+    return expected
+
+
+def _add_vba_part(path):
+    """Turn a saved .xlsx package into a macro-enabled one with an (opaque) xl/vbaProject.bin."""
+    with zipfile.ZipFile(path) as zin:
+        members = [(info, zin.read(info.filename)) for info in zin.infolist()]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zout:
+        for info, data in members:
+            if info.filename == "[Content_Types].xml":
+                data = data.replace(b"application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml",
+                                    b"application/vnd.ms-excel.sheet.macroEnabled.main+xml", 1).replace(
+                    b"</Types>", b'<Override PartName="/xl/vbaProject.bin" '
+                                 b'ContentType="application/vnd.ms-office.vbaProject"/></Types>')
+            elif info.filename == "xl/_rels/workbook.xml.rels":
+                data = data.replace(b"</Relationships>", b'<Relationship Id="rIdVBA" '
+                                    b'Type="http://schemas.microsoft.com/office/2006/relationships/vbaProject" '
+                                    b'Target="vbaProject.bin"/></Relationships>')
+            zout.writestr(info, data)
+        zout.writestr("xl/vbaProject.bin", b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" + os.urandom(4096))
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _run_stages(path, fill_mode):
+    """Child process: time every stage once. Returns {stage: {seconds, peak_rss_mb[, output_bytes]}}."""
+    import pandas as pd
+    from dep_highlighter_server import (_fill_rows, _highlight_mask_vectorized, _read_sheet_pandas, _RowRuns,
+                                        detect_header_row, highlight_logic, patch_workbook, read_sheet_columns)
+    stages = {}
+
+    def timed(stage, fn):
+        t0 = time.perf_counter()
+        result = fn()
+        stages[stage] = {"seconds": round(time.perf_counter() - t0, 4), "peak_rss_mb": _peak_rss_mb()}
+        return result
+
+    header_row, _ = timed("header_probe", lambda: detect_header_row(path))
+    _, parcels, dep_flags, _ = timed("stream_read", lambda: read_sheet_columns(path))
+    timed("pd_read_lean", lambda: _read_sheet_pandas(path))
+    df = timed("pd_read_excel", lambda: pd.read_excel(path, engine="openpyxl", sheet_name=0, header=header_row))
+    timed("highlight_logic", lambda: highlight_logic(df))
+    mask = _highlight_mask_vectorized(parcels, dep_flags)
+    excel_rows = _RowRuns.from_mask(mask, header_row + 2)
+    del df
+
+    keep_vba = path.endswith(".xlsm")
+    wb = timed("load_workbook", lambda: openpyxl.load_workbook(path, keep_vba=keep_vba, data_only=False))
+    timed("fill_loop", lambda: _fill_rows(wb.worksheets[0], excel_rows, fill_mode))
+    out = io.BytesIO()
+    timed("wb_save", lambda: wb.save(out))
+    stages["wb_save"]["output_bytes"] = out.getbuffer().nbytes
+    del wb
+    out = io.BytesIO()
+    timed("zip_patch", lambda: patch_workbook(path, out, excel_rows, fill_mode))
+    stages["zip_patch"]["output_bytes"] = out.getbuffer().nbytes
+    return stages
+
+
+def _run_end_to_end(path, fill_mode):
+    """Child process: the default pipeline (stream reader + zip patch), as /process runs it."""
+    t0 = time.perf_counter()
+    _, _, highlighted, total, size = process_excel_file(path, Path(path).name, fill_mode=fill_mode)
+    return {"seconds": round(time.perf_counter() - t0, 4), "peak_rss_mb": _peak_rss_mb(),
+            "output_bytes": size, "rows": total, "highlighted": highlighted}
+
+
+def _in_fresh_process(fn, *args):
+    """Run fn in a new interpreter so peak RSS belongs to that run alone."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def bench_case(case, work_dir, fill_mode="cells", repeat=1):
+    """Generate one synthetic workbook and benchmark it. Returns the case result dict."""
+    path = os.path.join(work_dir, f"{case['name']}.{'xlsm' if case['xlsm'] else 'xlsx'}")
+    params = {k: v for k, v in case.items() if k != "name"}
+    expected = make_workbook(path, **params)
+    result = {"case": case["name"], "params": case, "input_bytes": os.path.getsize(path),
+              "expected_highlighted": expected}
+    runs = [_in_fresh_process(_run_end_to_end, path, fill_mode) for _ in range(repeat)]
+    result["end_to_end"] = min(runs, key=lambda r: r["seconds"])
+    if result["end_to_end"]["highlighted"] != expected:
+        result["error"] = f"highlighted {result['end_to_end']['highlighted']} rows, expected {expected}"
+    stage_runs = [_in_fresh_process(_run_stages, path, fill_mode) for _ in range(repeat)]
+    result["stages"] = {s: min((r[s] for r in stage_runs), key=lambda x: x["seconds"]) for s in STAGES}
+    os.unlink(path)
+    return result
+
+
+def bench_fill_modes(path, repeat=1):
+    """Time every writer x fill mode on one file. Returns list of result dicts."""
+    data = Path(path).read_bytes()
+    results = []
+    for writer in WRITERS:
+        for fill_mode in FILL_MODES:
+            best = None
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                _, _, highlighted, total, size = process_excel_file(
+                    data, Path(path).name, writer=writer, fill_mode=fill_mode
+                )
+                elapsed = time.perf_counter() - t0
+                best = elapsed if best is None else min(best, elapsed)
+            results.append({
+                "writer": writer,
+                "fill_mode": fill_mode,
+                "seconds": round(best, 3),
+                "output_bytes": size,
+                "rows": total,
+                "highlighted": highlighted,
+            })
+    return results
+
+
+# Runs with python -c in a new interpreter: this module imports the server at the top, so a
+# spawn child would already have paid for the import being measured
+_STARTUP_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import dep_highlighter_server as d
+out = {"import_s": time.perf_counter() - t0, "pandas_loaded": "pandas" in sys.modules}
+if sys.argv[2] == "warm":
+    t = time.perf_counter()
+    d.start_warm_up(background=False)
+    out["warm_up_s"] = time.perf_counter() - t
+data = open(sys.argv[1], "rb").read()
+client = d.app.test_client()
+for key in ("first_request_s", "second_request_s"):
+    t = time.perf_counter()
+    r = client.post("/process", data={"file": (__import__("io").BytesIO(data), "bench.xlsx")})
+    out[key] = time.perf_counter() - t
+    assert r.status_code == 200, r.status_code
+out["peak_rss_mb"] = __import__("resource").getrusage(__import__("resource").RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps(out))
+"""
+
+
+def bench_startup(path, repeat=1):
+    """Cold vs pre-warmed server process: import time, warm-up, first and second /process latency.
+    Each run is a new interpreter with the result cache off, so every request does the full work."""
+    env = dict(os.environ, DEP_CACHE_MAX_MB="0")
+    results = {}
+    for mode in ("cold", "warm"):
+        runs = []
+        for _ in range(repeat):
+            proc = subprocess.run([sys.executable, "-c", _STARTUP_PROBE, path, mode], cwd=DEPLOY_DIR, env=env,
+                                  capture_output=True, text=True, check=True)
+            runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        results[mode] = min(runs, key=lambda r: r["first_request_s"])
+    return results
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _post_workbook(url, data, filename):
+    """POST one workbook as multipart form data. Returns the response latency in seconds."""
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=300) as response:
+        response.read()
+    return time.perf_counter() - t0
+
+
+def bench_workers(path, worker_counts, requests=24, clients=4):
+    """Throughput of gunicorn (gunicorn.conf.py) at each worker count: `requests` uploads of the same
+    workbook from `clients` concurrent clients, result cache off. Returns list of result dicts."""
+    data = Path(path).read_bytes()
+    results = []
+    for n in worker_counts:
+        port = _free_port()
+        env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(n), DEP_CACHE_MAX_MB="0")
+        server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"], cwd=DEPLOY_DIR, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.time() + 60
+            while True:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=2) as response:
+                        if response.status == 200:
+                            break
+                except (urllib.error.URLError, OSError):
+                    pass
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError(f"gunicorn with {n} worker(s) did not become healthy")
+                time.sleep(0.2)
+            url = f"http://127.0.0.1:{port}/process"
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                latencies = sorted(pool.map(lambda _: _post_workbook(url, data, Path(path).name), range(requests)))
+            elapsed = time.perf_counter() - t0
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        results.append({"workers": n, "requests": requests, "clients": clients, "seconds": round(elapsed, 3),
+                        "files_per_s": round(requests / elapsed, 2),
+                        "p50_s": round(latencies[len(latencies) // 2], 3),
+                        "p95_s": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)})
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Stages (and end_to_end) slower than baseline by more than tolerance. Returns list of messages."""
+    base = {r["case"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        b = base.get(r["case"])
+        if not b:
+            continue
+        pairs = [("end_to_end", r["end_to_end"], b.get("end_to_end"))]
+        pairs += [(s, r["stages"][s], b.get("stages", {}).get(s)) for s in STAGES]
+        for name, now, then in pairs:
+            # ignore sub-10 ms stages: timer noise dominates
+            if then and then["seconds"] >= 0.01 and now["seconds"] > then["seconds"] * (1 + tolerance):
+                regressions.append(f"{r['case']} {name}: {then['seconds']:.3f}s -> {now['seconds']:.3f}s")
+    return regressions
+
+
+def print_case(r):
+    e = r["end_to_end"]
+    print(f"\n{r['case']}: {e['rows']} rows, {r['input_bytes'] / 1024 / 1024:.2f} MB in, "
+          f"{e['highlighted']} highlighted" + (f"  ERROR: {r['error']}" if "error" in r else ""))
+    print(f"  {'stage':<16} {'seconds':>9} {'peak RSS MB':>12} {'output MB':>10}")
+    for name, s in list(r["stages"].items()) + [("end_to_end", e)]:
+        out = f"{s['output_bytes'] / 1024 / 1024:>10.2f}" if "output_bytes" in s else ""
+        print(f"  {name:<16} {s['seconds']:>9.3f} {s['peak_rss_mb']:>12.1f} {out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--suite", choices=("stages", "fill-modes", "startup", "workers"), default="stages")
+    parser.add_argument("--rows", type=int, nargs="+", default=[20000])
+    parser.add_argument("--cols", type=int, default=12)
+    parser.add_argument("--header-offset", type=int, default=5, help="rows above the header (NY RDM: 5)")
+    parser.add_argument("--dep-density", type=float, default=0.3, help="share of parcel runs noted DEP")
+    parser.add_argument("--run-lengths", default="1,1,2,2,3,5", help="run lengths to draw from, comma separated")
+    parser.add_argument("--xlsm", action="store_true", help="macro-enabled workbook with a VBA part")
+    parser.add_argument("--stray-col", type=int, default=0, help="formatted empty cell column (0 = none)")
+    parser.add_argument("--fill-mode", choices=FILL_MODES, default="cells")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="workers suite: gunicorn workers")
+    parser.add_argument("--requests", type=int, default=24, help="workers suite: uploads per worker count")
+    parser.add_argument("--clients", type=int, default=4, help="workers suite: concurrent clients")
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    if args.suite == "fill-modes":
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        try:
+            make_workbook(path, args.rows[0], args.cols, args.stray_col or 200)
+            print(f"Input: {args.rows[0]} rows, {args.cols} columns, stray formatting at column "
+                  f"{args.stray_col or 200}, {os.path.getsize(path) / 1024 / 1024:.2f} MB")
+            print(f"{'writer':<10} {'fill mode':<10} {'seconds':>9} {'output MB':>10} {'highlighted':>12}")
+            for r in bench_fill_modes(path, args.repeat):
+                print(f"{r['writer']:<10} {r['fill_mode']:<10} {r['seconds']:>9.3f} "
+                      f"{r['output_bytes'] / 1024 / 1024:>10.2f} {r['highlighted']:>12}")
+        finally:
+            os.unlink(path)
+        return 0
+
+    if args.suite == "startup":
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        try:
+            make_workbook(path, args.rows[0], args.cols, header_offset=args.header_offset)
+            results = bench_startup(path, args.repeat)
+        finally:
+            os.unlink(path)
+        print(f"Input: {args.rows[0]} rows; best of {args.repeat} fresh interpreter(s) per mode")
+        print(f"{'mode':<6} {'import s':>9} {'pandas':>7} {'warm-up s':>10} {'1st req s':>10} {'2nd req s':>10} "
+              f"{'peak RSS MB':>12}")
+        for mode, r in results.items():
+            warm = f"{r['warm_up_s']:>10.3f}" if "warm_up_s" in r else f"{'-':>10}"
+            print(f"{mode:<6} {r['import_s']:>9.3f} {str(r['pandas_loaded']):>7} {warm} "
+                  f"{r['first_request_s']:>10.3f} {r['second_request_s']:>10.3f} {r['peak_rss_mb']:>12.1f}")
+        if args.json:
+            text = json.dumps({"created": datetime.now().isoformat(timespec="seconds"), "startup": results}, indent=2)
+            print(text) if args.json == "-" else Path(args.json).write_text(text)
+        return 0
+
+    if args.suite == "workers":
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        try:
+            make_workbook(path, args.rows[0], args.cols, header_offset=args.header_offset)
+            print(f"Input: {args.rows[0]} rows, {os.path.getsize(path) / 1024 / 1024:.2f} MB; {args.requests} "
+                  f"uploads from {args.clients} clients; {os.cpu_count()} CPU(s)")
+            results = bench_workers(path, args.workers, args.requests, args.clients)
+        finally:
+            os.unlink(path)
+        print(f"{'workers':>7} {'seconds':>9} {'files/s':>8} {'p50 s':>7} {'p95 s':>7}")
+        for r in results:
+            print(f"{r['workers']:>7} {r['seconds']:>9.2f} {r['files_per_s']:>8.2f} {r['p50_s']:>7.3f} {r['p95_s']:>7.3f}")
+        if args.json:
+            text = json.dumps({"created": datetime.now().isoformat(timespec="seconds"), "cpu_count": os.cpu_count(),
+                               "workers": results}, indent=2)
+            print(text) if args.json == "-" else Path(args.json).write_text(text)
+        return 0
+
+    run_lengths = tuple(int(x) for x in re.split(r"[,\s]+", args.run_lengths.strip()) if x)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="dep_bench_") as work_dir:
+        for rows in args.rows:
+            case = {"name": f"rdm_{rows}r_{args.cols}c{'_xlsm' if args.xlsm else ''}", "rows": rows,
+                    "cols": args.cols, "header_offset": args.header_offset, "dep_density": args.dep_density,
+                    "run_lengths": run_lengths, "stray_col": args.stray_col, "seed": args.seed, "xlsm": args.xlsm}
+            r = bench_case(case, work_dir, args.fill_mode, args.repeat)
+            results.append(r)
+            print_case(r)
+
+    report = {"created": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+              "platform": platform.platform(), "cpu_count": os.cpu_count(), "fill_mode": args.fill_mode,
+              "results": results}
+    if args.json == "-":
+        print(json.dumps(report, indent=2))
+    elif args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+        print(f"\nResults written to {args.json}")
+
+    status = 1 if any("error" in r for r in results) else 0
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.tolerance)
+        for msg in regressions:
+            print(f"REGRESSION {msg}")
+        if regressions:
+            status = 1
+        else:
+            print(f"No regressions beyond {args.tolerance:.0%} vs {args.compare}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Highlight DEP rows in every workbook of a directory or glob, in parallel.
+Outputs are written as <name>_Highlighted<ext> next to each input or into --output-dir.
+Usage: python dep_highlighter_cli.py INPUT [INPUT ...] [--output-dir DIR] [--workers N] [--incremental]
+  INPUT is a .xlsx/.xlsm file, a directory (searched for .xlsx/.xlsm, --recursive for subfolders)
+  or a glob such as "downloads/*RDM*.xlsx".
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+DEPLOY_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(DEPLOY_DIR))
+
+from dep_highlighter_server import DEFAULT_COLUMNS, FILL_MODES, column_specs, process_excel_file
+
+EXTENSIONS = (".xlsx", ".xlsm")
+
+
+def _is_input(path):
+    name = path.name
+    return (path.is_file() and path.suffix.lower() in EXTENSIONS
+            and not name.startswith(("~$", ".")) and not path.stem.endswith("_Highlighted"))
+
+
+def collect_inputs(patterns, recursive=False):
+    """Expand files, directories and globs into a sorted, de-duplicated list of workbook paths.
+    Lock files (~$...), hidden files and existing *_Highlighted outputs are skipped."""
+    found = set()
+    for pattern in map(os.path.expanduser, patterns):
+        path = Path(pattern)
+        if path.is_dir():
+            candidates = path.rglob("*") if recursive else path.iterdir()
+        elif path.exists():
+            candidates = [path]
+        else:
+            candidates = (Path(p) for p in glob.glob(pattern, recursive=recursive))
+        found.update(p.resolve() for p in candidates if _is_input(p))
+    return sorted(found)
+
+
+def output_path_for(input_path, output_dir=None):
+    name = f"{input_path.stem}_Highlighted{input_path.suffix}"
+    return (Path(output_dir) if output_dir else input_path.parent) / name
+
+
+def is_up_to_date(input_path, output_path):
+    """Incremental mode: the output exists and is newer than its input."""
+    return output_path.exists() and output_path.stat().st_mtime >= input_path.stat().st_mtime
+
+
+def highlight_file(input_path, output_path, fill_mode="cells", sheets=None, columns=None, verify=False):
+    """Worker: highlight one workbook. Writes to a temp name and renames, so an interrupted run
+    never leaves a half-written output that incremental mode would treat as current."""
+    t0 = time.perf_counter()
+    tmp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+    try:
+        _, _, highlighted, total_rows, size = process_excel_file(
+            str(input_path), input_path.name, fill_mode=fill_mode, output_path=str(tmp_path), sheets=sheets,
+            columns=columns, verify=verify,
+        )
+        os.replace(tmp_path, output_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return {"rows": total_rows, "highlighted": highlighted, "output_bytes": size,
+            "seconds": time.perf_counter() - t0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", help="write outputs here instead of next to each input")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("-r", "--recursive", action="store_true", help="search directories / ** globs recursively")
+    parser.add_argument("-i", "--incremental", action="store_true", help="skip inputs whose output is newer")
+    parser.add_argument("--fill-mode", choices=FILL_MODES, default="cells")
+    parser.add_argument("--sheets", help='"all" or comma-separated sheet names / numbers (default: first sheet)')
+    parser.add_argument("--parcel-column", default=DEFAULT_COLUMNS["parcel"],
+                        help='letter, 1-based number or header name, e.g. "name:Parcel Number" (default: %(default)s)')
+    parser.add_argument("--notes-column", default=DEFAULT_COLUMNS["notes"], help="same forms (default: %(default)s)")
+    parser.add_argument("--verify", action="store_true", help="check each output is the input plus highlight styles only")
+    args = parser.parse_args()
+    columns = {"parcel": args.parcel_column, "notes": args.notes_column}
+    try:
+        column_specs(columns)
+    except ValueError as e:
+        parser.error(str(e))
+    sheets = args.sheets
+    if sheets and sheets.strip().lower() != "all":
+        sheets = [s.strip() for s in sheets.split(",") if s.strip()]
+
+    inputs = collect_inputs(args.inputs, args.recursive)
+    if not inputs:
+        print("No .xlsx or .xlsm files found.", file=sys.stderr)
+        return 1
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    todo = []
+    skipped = 0
+    for input_path in inputs:
+        output_path = output_path_for(input_path, args.output_dir)
+        if args.incremental and is_up_to_date(input_path, output_path):
+            skipped += 1
+            continue
+        todo.append((input_path, output_path))
+    print(f"{len(inputs)} workbooks, {len(todo)} to process, {skipped} up to date; {args.workers} workers", flush=True)
+
+    t0 = time.perf_counter()
+    done = failed = rows = highlighted = in_bytes = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(todo) or 1))) as pool:
+        futures = {pool.submit(highlight_file, i, o, args.fill_mode, sheets, columns, args.verify): (i, o) for i, o in todo}
+        for future in as_completed(futures):
+            input_path, output_path = futures[future]
+            try:
+                r = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"FAILED {input_path}: {e}", file=sys.stderr, flush=True)
+                continue
+            done += 1
+            rows += r["rows"]
+            highlighted += r["highlighted"]
+            in_bytes += input_path.stat().st_size
+            print(f"ok  {input_path.name}: {r['highlighted']}/{r['rows']} rows highlighted, "
+                  f"{r['seconds']:.2f} s -> {output_path}", flush=True)
+    elapsed = time.perf_counter() - t0
+
+    rate = (lambda n: n / elapsed) if elapsed > 0 else (lambda n: 0.0)
+    print(f"\n{done} processed, {failed} failed, {skipped} skipped in {elapsed:.2f} s")
+    print(f"Throughput: {rate(done):.2f} files/s, {rate(rows):,.0f} rows/s, "
+          f"{rate(in_bytes) / 1024 / 1024:.2f} MB/s (input); {highlighted:,} rows highlighted")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
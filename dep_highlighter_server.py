@@ -7,19 +7,48 @@ User device (Mac, Windows, etc.) does not affect processing — only the server
 Deploy: push -> GitHub Action -> Render deploy hook -> live.
 """
 
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, g, request, send_file, jsonify
 from flask_cors import CORS
-import pandas as pd
+import numpy as np
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.cell.text import Text
+from openpyxl.reader.strings import read_string_table
 from openpyxl.styles import PatternFill
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_ISO8601, from_excel
+from openpyxl.utils import column_index_from_string, get_column_letter
+import bisect
+import codecs
+import contextlib
+import csv
+import fnmatch
+import hashlib
+import html
 import io
+import json
+import multiprocessing
 import os
+import posixpath
+import re
+import shutil
+import signal
+import sqlite3
 import sys
 import platform
 import tempfile
+import threading
 from pathlib import Path
+import time
 import traceback
+import uuid
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from decimal import Decimal
 
 # Max upload size (50MB) - helps avoid Render memory/timeout issues
 MAX_FILE_SIZE = 50 * 1024 * 1024
@@ -34,160 +63,2794 @@ CORS_ORIGINS = [
     "http://127.0.0.1:5000",
     "http://127.0.0.1:5001",
 ]
-CORS(app, origins=CORS_ORIGINS, supports_credentials=False)
+# Response metadata headers the frontend may read
+EXPOSED_HEADERS = [
+    "X-DEP-Header-Row", "X-DEP-Header-Reason", "X-DEP-Cache", "X-DEP-Rows", "X-DEP-Highlighted",
+    "X-DEP-Peak-RSS-MB", "X-DEP-Memory-Estimate-MB", "X-DEP-Sheets", "X-DEP-Verify", "X-DEP-Repeat-DEP", "X-DEP-Batch-Files", "X-DEP-Batch-Failed", "Server-Timing",
+]
+CORS(app, origins=CORS_ORIGINS, supports_credentials=False, expose_headers=EXPOSED_HEADERS)
 
 _BASE = Path(__file__).resolve().parent
 _FRONTEND_HTML = _BASE / "static" / "dep_highlighter.html"
 if not _FRONTEND_HTML.exists():
     _FRONTEND_HTML = _BASE.parent / "frontend" / "dep_highlighter.html"
 
-YELLOW_FILL = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+YELLOW_FILL = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+
+# Default columns per spec: Column D = Parcel Number, Column H = Parcel Notes
+COL_D_PARCEL = 3   # 0-based index (Excel column D = 4th column)
+COL_H_NOTES = 7    # 0-based index (Excel column H = 8th column)
+# Column specs (parse_column_spec) used when a request does not name its own columns
+DEFAULT_COLUMNS = {
+    "parcel": os.environ.get("DEP_PARCEL_COLUMN", "D"),
+    "notes": os.environ.get("DEP_NOTES_COLUMN", "H"),
+}
+COLUMN_LABELS = {"parcel": "Parcel Number", "notes": "Parcel Notes"}
+
+# Header detection looks only at the first rows of sheet 0 (NY RDM docs have the header on row 6)
+HEADER_SAMPLE_ROWS = int(os.environ.get("DEP_HEADER_SAMPLE_ROWS", "25"))
+# Header texts seen in RDM exports; a cell containing one of these counts as a header token
+HEADER_TOKENS = ("tax id", "bill id", "parcel", "notes", "dep", "owner", "address", "account", "swis", "status")
+MIN_HEADER_CELLS = 2   # a title/banner row usually has a single filled cell
+
+# Cell texts pandas' Excel reader turns into NaN, plus Excel error values; treated as blank
+_NA_STRINGS = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+    "#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!",
+})
+
+
+def _parcel_val(val):
+    """Normalize parcel value for comparison."""
+    if val is None or (isinstance(val, float) and val != val):  # NaN
+        return ""
+    s = str(val).strip()
+    return "" if s.upper() == "NAN" else s
+
+
+def _notes_has_dep(val):
+    """True if cell value contains the note 'DEP' (Parcel Notes column H)."""
+    if val is None or (isinstance(val, float) and val != val):  # NaN
+        return False
+    return "DEP" in str(val).strip().upper()
+
+
+def _cell_text(val):
+    """Raw cell value (openpyxl values_only) as the stripped text pandas' Excel reader would give.
+    Blank, NA markers and error values -> ""; whole-number floats read as ints."""
+    if val is None:
+        return ""
+    if isinstance(val, float):
+        if val != val:
+            return ""
+        if val.is_integer():
+            val = int(val)
+    s = str(val)
+    if s in _NA_STRINGS:
+        return ""
+    s = s.strip()
+    return "" if s.upper() == "NAN" else s
+
+
+def _find_runs_loop(parcel, dep_mask):
+    """Reference run finder (original row-by-row loop). Returns list of (start, end) positions, inclusive.
+    Kept so the vectorized engine can be checked against it."""
+    runs = []
+    n = len(parcel)
+    i = 0
+    while i < n:
+        if not dep_mask[i]:
+            i += 1
+            continue
+        p = _parcel_val(parcel[i])
+        if not p:
+            i += 1
+            continue
+        j = i
+        while j < n and dep_mask[j] and _parcel_val(parcel[j]) == p:
+            j += 1
+        if j - i >= 2:
+            runs.append((i, j - 1))
+        i = j
+    return runs
+
+
+def _highlight_mask_loop(parcel, dep_mask):
+    """Boolean highlight mask from the reference loop."""
+    flags = np.zeros(len(parcel), dtype=bool)
+    for start, end in _find_runs_loop(parcel, dep_mask):
+        flags[start:end + 1] = True
+    return flags
+
+
+def _highlight_mask_vectorized(parcel, dep_mask):
+    """Boolean highlight mask without a Python loop.
+    parcel: normalized parcel strings ("" = no parcel); dep_mask: True where column H has DEP.
+    A row starts a new group unless it and the row above are both DEP rows with the same parcel;
+    group sizes are counted with bincount and broadcast back, runs of 2+ are highlighted."""
+    parcel = np.asarray(parcel, dtype=object)
+    dep_mask = np.asarray(dep_mask, dtype=bool)
+    n = len(parcel)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    valid = dep_mask & (parcel != "")
+    starts = np.ones(n, dtype=bool)
+    starts[1:] = ~(valid[1:] & valid[:-1] & (parcel[1:] == parcel[:-1]))
+    group = np.cumsum(starts) - 1
+    sizes = np.bincount(group)
+    return valid & (sizes[group] >= 2)
+
+
+def _highlight_runs(parcel, mask):
+    """(starts, ends) inclusive positions of the highlighted runs in a highlight mask.
+    Adjacent highlighted rows belong to the same run when their parcels match."""
+    parcel = np.asarray(parcel, dtype=object)
+    mask = np.asarray(mask, dtype=bool)
+    if not mask.any():
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    same = np.zeros(len(mask), dtype=bool)
+    same[1:] = mask[1:] & mask[:-1] & (parcel[1:] == parcel[:-1])
+    starts = np.flatnonzero(mask & ~same)
+    ends = np.flatnonzero(mask & ~np.append(same[1:], False))
+    return starts, ends
+
+
+class _RowRuns:
+    """Highlighted rows of one worksheet as sorted, non-overlapping (first, last) inclusive ranges:
+    the writers fill run by run and test membership with a binary search, so no per-row set or
+    list of every highlighted row is built. Adjacent runs of different parcels share one range."""
+
+    __slots__ = ("firsts", "lasts")
+
+    def __init__(self, firsts=(), lasts=()):
+        self.firsts = [int(r) for r in firsts]
+        self.lasts = [int(r) for r in lasts]
+
+    @classmethod
+    def from_mask(cls, mask, offset=0):
+        """Ranges of the True blocks of a highlight mask; position i is row offset + i."""
+        edges = np.diff(np.concatenate(([0], np.asarray(mask, dtype=np.int8), [0])))
+        return cls(np.flatnonzero(edges == 1) + offset, np.flatnonzero(edges == -1) - 1 + offset)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Ranges covering any iterable of row numbers (a set, list or array); _RowRuns pass through."""
+        if isinstance(rows, cls):
+            return rows
+        rows = np.unique(np.fromiter(rows, dtype=np.int64))
+        breaks = np.flatnonzero(np.diff(rows) != 1)
+        return cls(np.concatenate((rows[:1], rows[breaks + 1])), np.concatenate((rows[breaks], rows[-1:])))
+
+    def __contains__(self, row):
+        i = bisect.bisect_right(self.firsts, row) - 1
+        return i >= 0 and row <= self.lasts[i]
+
+    def __iter__(self):
+        return zip(self.firsts, self.lasts)
+
+    def __len__(self):
+        return len(self.firsts)
+
+    def row_count(self):
+        return sum(last - first + 1 for first, last in self)
+
+
+RUN_ENGINES = {
+    "vectorized": _highlight_mask_vectorized,
+    "loop": _highlight_mask_loop,
+}
+
+
+def highlight_logic(df, engine="vectorized", parcel_col=COL_D_PARCEL, notes_col=COL_H_NOTES):
+    """
+    Core logic (exact spec):
+    - Column D = Parcel Number (same value).
+    - Column H = Parcel Notes (must contain the note "DEP").
+    Highlight a row ONLY when BOTH are true:
+    (1) Two or more consecutive rows have the same value in column D, and
+    (2) Column H has the note DEP on those rows.
+    No values added; only highlight existing rows that meet both rules.
+    engine: "vectorized" (default) or "loop" (reference implementation, same result).
+    parcel_col / notes_col: 0-based positions in df when the sheet uses other columns than D / H
+    (or df holds only the two columns, as from _read_sheet_pandas).
+    Returns a boolean NumPy array, one entry per row of df (True = highlight); df is not modified.
+    """
+    if engine not in RUN_ENGINES:
+        raise ValueError(f"Unknown run engine: {engine}. Use one of: {', '.join(RUN_ENGINES)}.")
+    # Maximal runs: consecutive rows with same column D value and column H contains DEP (length >= 2)
+    return RUN_ENGINES[engine](*_run_inputs(df, parcel_col, notes_col))
+
+
+def _run_inputs(df, parcel_col=COL_D_PARCEL, notes_col=COL_H_NOTES):
+    """(normalized parcel strings, DEP flags) of a DataFrame as NumPy arrays, like the streaming reader's lists."""
+    if df.shape[1] <= max(parcel_col, notes_col):
+        raise ValueError(f"{_too_few_columns(parcel_col, notes_col)} Found {df.shape[1]} columns.")
+    parcel = df.iloc[:, parcel_col].fillna("").astype(str).str.strip()
+    parcel = parcel.mask(parcel.str.upper() == "NAN", "")
+    notes = df.iloc[:, notes_col].fillna("").astype(str).str.strip().str.upper()
+    dep_mask = notes.str.contains("DEP", na=False)
+    return parcel.to_numpy(dtype=object), dep_mask.to_numpy(dtype=bool)
+
+
+def _dep_parcels(parcel, dep_mask):
+    """Distinct parcels that have a DEP note on at least one row (for the parcel index)."""
+    parcel = np.asarray(parcel, dtype=object)
+    dep_mask = np.asarray(dep_mask, dtype=bool)
+    if len(parcel) == 0:
+        return set()
+    return set(parcel[dep_mask & (parcel != "")].tolist())
+
+
+def _too_few_columns(parcel_col, notes_col):
+    return (f"Sheet must have at least {max(parcel_col, notes_col) + 1} columns. "
+            f"Column {get_column_letter(parcel_col + 1)} = Parcel Number, "
+            f"Column {get_column_letter(notes_col + 1)} = Parcel Notes.")
+
+
+def _excel_source(src):
+    """bytes -> BytesIO; paths and file-like objects are passed through to openpyxl/pandas."""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return io.BytesIO(src)
+    return src
+
+
+def _open_read_only(src):
+    """Open a workbook in openpyxl's streaming (read_only) mode; invalid files raise ValueError."""
+    src = _excel_source(src)
+    if hasattr(src, "seek"):
+        src.seek(0)
+    try:
+        return openpyxl.load_workbook(src, read_only=True, data_only=True, keep_links=False)
+    except Exception as e:
+        raise ValueError(f"Cannot read Excel file. Is it a valid .xlsx or .xlsm? Details: {e}")
+
+
+def score_header_rows(rows):
+    """
+    Pick the header row from a sample of raw rows (tuples of cell values).
+    Score = 10 per known RDM header token + filled cells + 5 x share of text cells. A token only
+    counts when its cell text is unique in its column within the sample ("DEP" repeated down
+    column H is data, not a label). Rows with fewer than MIN_HEADER_CELLS filled cells are
+    skipped, and so are rows less than half as wide as the widest sampled row (titles and notes
+    above the header). Ties go to the earlier row. When no row has a token, the score says nothing
+    about labels (a wide text-heavy data row beats a narrower header), so the first remaining row
+    is taken instead.
+    Returns (offset, info) where offset is 0-based and info explains the choice.
+    """
+    texts_by_row = [
+        [str(v).strip().lower() if isinstance(v, str) else None for v in row] for row in rows
+    ]
+    column_counts = {}
+    for texts in texts_by_row:
+        for col, t in enumerate(texts):
+            if t:
+                column_counts[(col, t)] = column_counts.get((col, t), 0) + 1
+
+    scored = []
+    for offset, row in enumerate(rows):
+        cells = [v for v in row if v is not None and str(v).strip() != ""]
+        if len(cells) < MIN_HEADER_CELLS:
+            continue
+        texts = texts_by_row[offset]
+        text_ratio = sum(1 for t in texts if t) / len(cells)
+        labels = [t for col, t in enumerate(texts) if t and column_counts[(col, t)] == 1]
+        tokens = sorted({tok for tok in HEADER_TOKENS for t in labels if tok in t})
+        scored.append((10 * len(tokens) + len(cells) + 5 * text_ratio, offset, len(cells), text_ratio, tokens))
+    if not scored:
+        return 0, {
+            "header_row": 1,
+            "sampled_rows": len(rows),
+            "reason": f"no row with {MIN_HEADER_CELLS}+ filled cells in first {len(rows)} rows; using row 1",
+        }
+    widest = max(candidate[2] for candidate in scored)
+    wide = [candidate for candidate in scored if 2 * candidate[2] >= widest]
+    best = max(wide, key=lambda candidate: (candidate[0], -candidate[1]))
+    if best[4]:
+        score, offset, filled, text_ratio, tokens = best
+        reason = f"row {offset + 1}: {filled} filled cells, {text_ratio:.0%} text, matched " + "/".join(tokens)
+    else:
+        score, offset, filled, text_ratio, tokens = wide[0]
+        reason = (f"row {offset + 1}: first row with {filled} of up to {widest} filled cells, "
+                  f"{text_ratio:.0%} text, no header tokens")
+    return offset, {
+        "header_row": offset + 1,
+        "sampled_rows": len(rows),
+        "score": round(score, 2),
+        "filled_cells": filled,
+        "text_ratio": round(text_ratio, 2),
+        "tokens": tokens,
+        "reason": reason,
+    }
+
+
+def _header_sample(src, sample_rows, sheet_index=0):
+    """First sample_rows rows of a worksheet (tuples of values) via openpyxl read_only."""
+    wb = _open_read_only(src)
+    try:
+        sheet = wb.worksheets[sheet_index]
+        sheet.reset_dimensions()
+        return list(sheet.iter_rows(max_row=sample_rows, values_only=True))
+    finally:
+        wb.close()
+
+
+def detect_header_row(src, sample_rows=None, sheet_index=0):
+    """Header offset (0-based) of a worksheet from its first sample_rows rows only, plus the reason.
+    Streams via openpyxl read_only, so cost does not grow with the number of rows."""
+    t0 = time.perf_counter()
+    offset, info = score_header_rows(_header_sample(src, sample_rows or HEADER_SAMPLE_ROWS, sheet_index))
+    info["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return offset, info
+
+
+_COLUMN_LETTERS = re.compile(r"[A-Za-z]{1,3}")
+MAX_COLUMN = 16384  # XFD
+
+
+def _header_text(value):
+    return " ".join(str(value).split()).lower()
+
+
+def parse_column_spec(spec):
+    """
+    Column spec -> ("index", 0-based column) or ("name", header pattern).
+    "D" or "col:D" = column letter, "4" or "col:4" = 1-based column number; "name:Parcel Number" or
+    any other text = header name, case-insensitive, whitespace-collapsed, * and ? as wildcards
+    ("*parcel*number*"). 1-3 bare letters always mean a column letter: write "name:DEP" for a DEP header.
+    """
+    text = str(spec).strip()
+    if text.lower().startswith("name:"):
+        pattern = _header_text(text[5:])
+        if pattern:
+            return ("name", pattern)
+    else:
+        column = text[4:].strip() if text.lower().startswith("col:") else text
+        if column.isdigit() and 1 <= int(column) <= MAX_COLUMN:
+            return ("index", int(column) - 1)
+        if _COLUMN_LETTERS.fullmatch(column):
+            try:
+                index = column_index_from_string(column.upper())
+            except ValueError:
+                index = 0
+            if 1 <= index <= MAX_COLUMN:
+                return ("index", index - 1)
+        elif column == text and text and not text.isdigit():
+            return ("name", _header_text(text))
+    raise ValueError(
+        f"Invalid column: {spec!r}. Use a letter (D), a 1-based number (4) or a header name (name:Parcel Number)."
+    )
+
+
+def column_specs(columns=None):
+    """{"parcel": parsed spec, "notes": parsed spec} from a {"parcel", "notes"} dict of column specs;
+    missing or blank roles use DEFAULT_COLUMNS. Invalid specs raise ValueError."""
+    columns = columns or {}
+    unknown = set(columns) - set(COLUMN_LABELS)
+    if unknown:
+        raise ValueError(f"Unknown column role: {', '.join(sorted(unknown))}. Use parcel or notes.")
+    specs = {role: parse_column_spec(columns.get(role) or DEFAULT_COLUMNS[role]) for role in COLUMN_LABELS}
+    if specs["parcel"] == specs["notes"] and specs["parcel"][0] == "index":
+        raise ValueError(_same_column(specs["parcel"][1]))
+    return specs
+
+
+def _same_column(col):
+    return (f"{COLUMN_LABELS['parcel']} and {COLUMN_LABELS['notes']} must be different columns "
+            f"(both are {get_column_letter(col + 1)}).")
+
+
+class _ColumnResolver:
+    """Parcel / notes column indexes of one worksheet. Header-name specs are looked up in the header row
+    scored from the sample rows; letters and numbers need no lookup. Called with the sample rows, returns
+    (parcel_col, notes_col), or None with the reason kept in .error."""
+
+    def __init__(self, columns=None):
+        self.specs = column_specs(columns)
+        self.by_name = any(kind == "name" for kind, _ in self.specs.values())
+        self.header_row = None
+        self.error = None
+
+    def __call__(self, sample):
+        return self.for_header(sample, score_header_rows(sample)[0] if self.by_name else None)
+
+    def for_header(self, sample, header_row):
+        self.header_row = header_row
+        row = sample[header_row] if self.by_name and header_row < len(sample) else ()
+        headers = [_header_text(v) if v is not None else "" for v in row]
+        indexes = []
+        for role, (kind, value) in self.specs.items():
+            if kind == "name":
+                matches = [col for col, text in enumerate(headers) if text and fnmatch.fnmatchcase(text, value)]
+                if not matches:
+                    self.error = ValueError(
+                        f"No {COLUMN_LABELS[role]} column: no header in row {header_row + 1} matches '{value}'. "
+                        f"Headers: {', '.join(text for text in headers if text) or '(none)'}."
+                    )
+                    return None
+                if len(matches) > 1:
+                    found = ", ".join(f"{headers[col]} ({get_column_letter(col + 1)})" for col in matches)
+                    self.error = ValueError(
+                        f"Ambiguous {COLUMN_LABELS[role]} column: '{value}' matches {len(matches)} headers in row "
+                        f"{header_row + 1}: {found}. Use a more specific name or a column letter."
+                    )
+                    return None
+                value = matches[0]
+            indexes.append(value)
+        if indexes[0] == indexes[1]:
+            self.error = ValueError(_same_column(indexes[0]))
+            return None
+        return tuple(indexes)
+
+
+def _sample_columns(sample, columns):
+    """parcels / dep_flags of the buffered sample rows once the columns are known."""
+    parcel_col, notes_col = columns
+    parcels = [_cell_text(row[parcel_col]) if parcel_col < len(row) else "" for row in sample]
+    dep_flags = [notes_col < len(row) and "DEP" in _cell_text(row[notes_col]).upper() for row in sample]
+    return parcels, dep_flags
+
+
+def read_sheet_columns(src, columns=None, sample_rows=None, sheet_index=0):
+    """
+    Single streaming pass over one worksheet (default the first), values only.
+    Keeps only the parcel text and whether the notes cell has DEP; no DataFrame is built.
+    columns: {"parcel": spec, "notes": spec} (parse_column_spec), default DEFAULT_COLUMNS (D and H).
+    The first sample_rows rows are buffered and scored by score_header_rows; header-name specs are
+    resolved against that header row before the rest of the sheet is read, so only the two resolved
+    columns are decoded per row.
+    Scans the worksheet XML directly (_scan_sheet_xml) and falls back to openpyxl read_only
+    (_scan_sheet_openpyxl) for packages it cannot handle; both give the same values.
+    Returns (header_row, parcels, dep_flags, header_info) for the data rows under the header;
+    header_info["columns"] has the letters used ({"parcel": "D", "notes": "H"}).
+    """
+    sample_rows = sample_rows or HEADER_SAMPLE_ROWS
+    resolver = _ColumnResolver(columns)
+    t0 = time.perf_counter()
+    scan = _scan_sheet(src, resolver, sample_rows, t0, sheet_index)
+    sample, parcels, dep_flags, width, last_row_with_data, sample_ms, resolved = scan
+
+    n_rows = last_row_with_data + 1
+    if n_rows < 2:
+        raise ValueError("The file has no data rows.")
+    if resolved is None:
+        raise resolver.error
+    # The header needs at least one data row under it
+    header_row, header_info = score_header_rows(sample[:n_rows - 1])
+    if resolver.by_name and header_row != resolver.header_row:
+        # Only when the data ends inside the sample: look the names up again in the final header row
+        columns_now = resolver.for_header(sample, header_row)
+        if columns_now is None:
+            raise resolver.error
+        if columns_now != resolved:
+            resolved = columns_now
+            _, parcels, dep_flags, *_ = _scan_sheet(src, lambda rows: columns_now, sample_rows, t0, sheet_index)
+    parcel_col, notes_col = resolved
+    if width <= max(parcel_col, notes_col):
+        raise ValueError(_too_few_columns(parcel_col, notes_col))
+    header_info["ms"] = round(sample_ms if sample_ms is not None else (time.perf_counter() - t0) * 1000, 1)
+    header_info["columns"] = {"parcel": get_column_letter(parcel_col + 1), "notes": get_column_letter(notes_col + 1)}
+    return header_row, parcels[header_row + 1:n_rows], dep_flags[header_row + 1:n_rows], header_info
+
+
+def _scan_sheet(src, resolve, sample_rows, t0, sheet_index=0):
+    try:
+        return _scan_sheet_xml(src, resolve, sample_rows, t0, sheet_index)
+    except Exception as e:
+        print(f"XML sheet scan not possible ({e}); reading with openpyxl instead", file=sys.stderr, flush=True)
+        return _scan_sheet_openpyxl(src, resolve, sample_rows, time.perf_counter(), sheet_index)
+
+
+def _scan_sheet_openpyxl(src, resolve, sample_rows, t0, sheet_index=0):
+    """read_sheet_columns via openpyxl read_only iter_rows. resolve(sample) gives the columns once the
+    sample rows are read. Returns (sample, parcels, dep_flags, width, last_row_with_data, sample_ms,
+    columns) for every sheet row; columns is None (and the scan stops there) when resolve fails."""
+    wb = _open_read_only(src)
+    try:
+        sheet = wb.worksheets[sheet_index]
+        sheet.reset_dimensions()  # stored <dimension> is often wrong; read what is really there
+        sample = []
+        sample_ms = None
+        columns = None
+        parcels = []
+        dep_flags = []
+        width = 0
+        last_row_with_data = -1
+        for row_number, row in enumerate(sheet.iter_rows(values_only=True)):
+            used = len(row)
+            while used and (row[used - 1] is None or row[used - 1] == ""):
+                used -= 1
+            if used:
+                last_row_with_data = row_number
+                width = max(width, used)
+            if row_number < sample_rows:
+                sample.append(row)
+                continue
+            if columns is None:
+                sample_ms = (time.perf_counter() - t0) * 1000
+                columns = resolve(sample)
+                if columns is None:
+                    return sample, parcels, dep_flags, width, last_row_with_data, sample_ms, None
+                parcel_col, notes_col = columns
+                parcels, dep_flags = _sample_columns(sample, columns)
+            parcels.append(_cell_text(row[parcel_col]) if parcel_col < used else "")
+            dep_flags.append(notes_col < used and "DEP" in _cell_text(row[notes_col]).upper())
+    finally:
+        wb.close()
+    if columns is None:  # the whole sheet fits in the sample
+        columns = resolve(sample)
+        if columns is not None:
+            parcels, dep_flags = _sample_columns(sample, columns)
+    return sample, parcels, dep_flags, width, last_row_with_data, sample_ms, columns
+
+
+# Direct worksheet XML scan: same values as openpyxl read_only (data_only) for the cells we look at
+_SHEET_ROW = re.compile(rb"<((?:\w+:)?)row\b([^>]*?)(?:/>|>(.*?)</\1row>)", re.S)
+_CELL_TYPE = re.compile(rb'\bt="(\w+)"')
+_CELL_VALUE = re.compile(rb"<((?:\w+:)?)v>([^<]*)</\1v>")
+_INLINE_PLAIN = re.compile(rb"<((?:\w+:)?)is>\s*<\1t(?:\s[^>]*)?>([^<]*)</\1t>\s*</\1is>")
+_INLINE_ANY = re.compile(rb"<((?:\w+:)?)is>(.*?)</\1is>", re.S)
+_TAG_PREFIX = re.compile(rb"<(/?)\w+:")
+_DATE1904 = re.compile(rb"<(?:\w+:)?workbookPr\b[^>]*\bdate1904=\"(?:1|true)\"")
+
+
+class _SheetValues:
+    """Cell value decoding for _scan_sheet_xml: shared strings, date styles and the workbook epoch."""
+
+    def __init__(self, zf, workbook_part, styles_part, shared_part):
+        self.shared = read_string_table(zf.open(shared_part)) if shared_part else []
+        self.epoch = CALENDAR_MAC_1904 if _DATE1904.search(zf.read(workbook_part)) else CALENDAR_WINDOWS_1900
+        root = ET.fromstring(zf.read(styles_part))
+        custom = {int(f.get("numFmtId")): f.get("formatCode") for f in root.iter(f"{_NS_MAIN}numFmt")}
+        xfs = root.find(f"{_NS_MAIN}cellXfs")
+        # openpyxl read_only converts every date style to datetime (never timedelta); so does this
+        self.date_styles = set()
+        for i, xf in enumerate(xfs.findall(f"{_NS_MAIN}xf") if xfs is not None else []):
+            num_fmt_id = int(xf.get("numFmtId", 0))
+            fmt = custom.get(num_fmt_id, BUILTIN_FORMATS.get(num_fmt_id))
+            if fmt and is_date_format(fmt):
+                self.date_styles.add(i)
+
+    @staticmethod
+    def _text(raw):
+        if b"\r" in raw:  # XML parsers normalize line ends
+            raw = raw.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        text = raw.decode("utf-8")
+        return html.unescape(text) if "&" in text else text
+
+    def value(self, attrs, rest):
+        """Cell value from a <c> match: attrs = its attributes, rest = b"/>" or its content and end tag."""
+        if rest == b"/>":
+            return None
+        m = _CELL_TYPE.search(attrs)
+        data_type = m.group(1) if m else b"n"
+        if data_type == b"inlineStr":
+            m = _INLINE_PLAIN.search(rest)
+            if m:
+                return self._text(m.group(2))
+            m = _INLINE_ANY.search(rest)
+            if not m:
+                return None
+            node = ET.fromstring(b'<is xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                                 + _TAG_PREFIX.sub(rb"<\1", m.group(2)) + b"</is>")
+            return Text.from_tree(node).content
+        m = _CELL_VALUE.search(rest)
+        if not m or not m.group(2):
+            return None
+        raw = m.group(2)
+        if data_type == b"s":
+            return self.shared[int(raw)]
+        if data_type == b"n":
+            value = float(raw) if (b"." in raw or b"E" in raw or b"e" in raw) else int(raw)
+            style = _STYLE_ATTR.search(attrs)
+            style_id = int(style.group(1)) if style else 0
+            if style_id in self.date_styles:
+                try:
+                    return from_excel(value, self.epoch)
+                except (OverflowError, ValueError):
+                    return "#VALUE!"
+            return value
+        if data_type == b"b":
+            return bool(int(raw))
+        if data_type == b"d":
+            return from_ISO8601(raw.decode("ascii"))
+        return self._text(raw)
+
+
+def _scan_sheet_xml(src, resolve, sample_rows, t0, sheet_index=0):
+    """read_sheet_columns straight from the worksheet XML: rows are cut out of the decompressed stream
+    chunk by chunk and only the cells needed are decoded (parcel, notes, the last filled cell of each row,
+    every cell of the sample rows). Same arguments and return value as _scan_sheet_openpyxl."""
+    src = _excel_source(src)
+    if hasattr(src, "seek"):
+        src.seek(0)
+    sample = []
+    sample_ms = None
+    columns = None
+    parcels = []
+    dep_flags = []
+    width = 0
+    last_row_with_data = -1
+    with zipfile.ZipFile(src) as zf:
+        parts = _workbook_parts(zf)
+        values = _SheetValues(zf, parts["workbook"], parts["styles"], parts["shared_strings"])
+
+        row_number = 0  # 0-based: index in the output lists == Excel row - 1
+        with zf.open(parts["sheets"][sheet_index][1]) as stream:
+            tail = b""
+            while True:
+                chunk = stream.read(PATCH_CHUNK_SIZE)
+                data = tail + chunk
+                consumed = 0
+                for row in _SHEET_ROW.finditer(data):
+                    consumed = row.end()
+                    m = _ROW_NUM.search(row.group(2))
+                    index = int(m.group(1)) - 1 if m else row_number
+                    if index < row_number:  # out of order / duplicate rows are skipped, as openpyxl does
+                        continue
+                    # rows missing from the file are empty rows
+                    if row_number < min(index, sample_rows):
+                        sample.extend([()] * (min(index, sample_rows) - row_number))
+                        row_number = min(index, sample_rows)
+                    if columns is None and index >= sample_rows:
+                        sample_ms = (time.perf_counter() - t0) * 1000
+                        columns = resolve(sample)
+                        if columns is None:
+                            return sample, parcels, dep_flags, width, last_row_with_data, sample_ms, None
+                        parcel_col, notes_col = columns
+                        parcels, dep_flags = _sample_columns(sample, columns)
+                    if row_number < index:
+                        parcels.extend([""] * (index - row_number))
+                        dep_flags.extend([False] * (index - row_number))
+                        row_number = index
+                    cells = {}
+                    col = -1
+                    for cell in _CELL.finditer(row.group(3) or b""):
+                        ref = _CELL_REF.search(cell.group(2))
+                        col = column_index_from_string(ref.group(1).decode("ascii")) - 1 if ref else col + 1
+                        cells[col] = cell
+                    decoded = {}
+
+                    def cell_value(c):
+                        if c not in decoded:
+                            cell = cells.get(c)
+                            decoded[c] = values.value(cell.group(2), cell.group(3)) if cell else None
+                        return decoded[c]
+
+                    used = 0
+                    for c in sorted(cells, reverse=True):
+                        value = cell_value(c)
+                        if value is not None and value != "":
+                            used = c + 1
+                            break
+                    if used:
+                        last_row_with_data = row_number
+                        width = max(width, used)
+                    if row_number < sample_rows:
+                        sample.append(tuple(cell_value(c) for c in range(max(cells) + 1)) if cells else ())
+                    else:
+                        parcels.append(_cell_text(cell_value(parcel_col)) if parcel_col < used else "")
+                        dep_flags.append(notes_col < used and "DEP" in _cell_text(cell_value(notes_col)).upper())
+                    row_number += 1
+                tail = data[consumed:]
+                if not chunk:
+                    break
+    if columns is None:  # the whole sheet fits in the sample
+        columns = resolve(sample)
+        if columns is not None:
+            parcels, dep_flags = _sample_columns(sample, columns)
+    return sample, parcels, dep_flags, width, last_row_with_data, sample_ms, columns
+
+
+def _read_sheet_pandas(buf, sample_rows=None, sheet_index=0, columns=None):
+    """pandas reader: header scored from the sample rows (as detect_header_row), columns resolved against it,
+    then one pd.read_excel of just the parcel and notes columns, as strings (NaN for blanks).
+    Returns (df, header_row, header_info, (parcel position, notes position in df)).
+    pandas is imported here, on first use: the default streaming path never needs it."""
+    import pandas as pd
+
+    resolver = _ColumnResolver(columns)
+    t0 = time.perf_counter()
+    sample = _header_sample(buf, sample_rows or HEADER_SAMPLE_ROWS, sheet_index)
+    header_row, header_info = score_header_rows(sample)
+    header_info["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    resolved = resolver.for_header(sample, header_row)
+    if resolved is None:
+        raise resolver.error
+    parcel_col, notes_col = resolved
+    usecols = sorted({parcel_col, notes_col})
+    try:
+        if hasattr(buf, "seek"):
+            buf.seek(0)
+        df = pd.read_excel(buf, engine="openpyxl", sheet_name=sheet_index, header=header_row,
+                           usecols=usecols, dtype=str)
+    except pd.errors.ParserError:  # usecols past the last column
+        raise ValueError(_too_few_columns(parcel_col, notes_col))
+    except Exception as e:
+        raise ValueError(f"Cannot read Excel file. Is it a valid .xlsx or .xlsm? Details: {e}")
+    if df is None or len(df) == 0:
+        raise ValueError("The file has no data rows.")
+    header_info["columns"] = {"parcel": get_column_letter(parcel_col + 1), "notes": get_column_letter(notes_col + 1)}
+    return df, header_row, header_info, (usecols.index(parcel_col), usecols.index(notes_col))
+
+
+# Zip-level patch writer: regexes work on the raw (UTF-8) XML bytes of the worksheet part
+_ROW_START = re.compile(rb"<(?:\w+:)?row\b([^>]*)>")
+_ROW_END = re.compile(rb"</(?:\w+:)?row>")
+_ROW_NUM = re.compile(rb'\br="(\d+)"')
+_CELL = re.compile(rb"<((?:\w+:)?)c\b([^>]*?)(/>|>.*?</\1c>)", re.S)
+_CELL_REF = re.compile(rb'\br="([A-Z]+)\d+"')
+_STYLE_ATTR = re.compile(rb'\bs="(\d+)"')
+_DIMENSION = re.compile(rb'<(?:\w+:)?dimension\b[^>]*\bref="[A-Z]*\d*:?([A-Z]+)\d+"')
+_XF = re.compile(r"<(?:\w+:)?xf\b[^>]*?/>|<(?:\w+:)?xf\b[^>]*>.*?</(?:\w+:)?xf>", re.S)
+_NS_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_DOC_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PATCH_CHUNK_SIZE = 1 << 20
+
+
+def _rels_targets(zf, rels_path, base_dir):
+    """{rId: (type, part path)} from a .rels part; targets resolved against base_dir."""
+    targets = {}
+    for rel in ET.fromstring(zf.read(rels_path)).iter(f"{_NS_REL}Relationship"):
+        target = rel.get("Target", "")
+        if rel.get("TargetMode") == "External":
+            continue
+        path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(base_dir, target))
+        targets[rel.get("Id")] = (rel.get("Type", ""), path)
+    return targets
+
+
+def _workbook_parts(zf):
+    """Part names of an xlsx/xlsm package: {"workbook", "sheets": [(sheet name, part)] in workbook
+    order (worksheets only, same order as wb.worksheets), "styles", "shared_strings" (or None)}."""
+    root = _rels_targets(zf, "_rels/.rels", "")
+    workbook = next(p for t, p in root.values() if t.endswith("/officeDocument"))
+    wb_dir, wb_name = posixpath.split(workbook)
+    rels = _rels_targets(zf, posixpath.join(wb_dir, "_rels", wb_name + ".rels"), wb_dir)
+    sheets = []
+    for sheet in ET.fromstring(zf.read(workbook)).iter(f"{_NS_MAIN}sheet"):
+        rel_type, path = rels.get(sheet.get(f"{_NS_DOC_REL}id"), ("", ""))
+        if rel_type.endswith("/worksheet"):
+            sheets.append((sheet.get("name"), path))
+    styles = next((p for t, p in rels.values() if t.endswith("/styles")), None)
+    if not sheets or not styles:
+        raise ValueError("Workbook has no worksheet or no styles part")
+    shared_strings = next((p for t, p in rels.values() if t.endswith("/sharedStrings")), None)
+    return {"workbook": workbook, "sheets": sheets, "styles": styles, "shared_strings": shared_strings}
+
+
+def sheet_names(src):
+    """Worksheet names in workbook order (chart sheets excluded); invalid files raise ValueError."""
+    src = _excel_source(src)
+    if hasattr(src, "seek"):
+        src.seek(0)
+    try:
+        with zipfile.ZipFile(src) as zf:
+            return [name for name, _ in _workbook_parts(zf)["sheets"]]
+    except Exception:
+        wb = _open_read_only(src)
+        try:
+            return [ws.title for ws in wb.worksheets]
+        finally:
+            wb.close()
+
+
+def _set_attr(tag, name, value):
+    """Set attribute name on an XML start tag (str or bytes), replacing any existing value."""
+    is_bytes = isinstance(tag, bytes)
+    if is_bytes:
+        tag = tag.decode("utf-8")
+    pattern = re.compile(rf'\b{name}="[^"]*"')
+    if pattern.search(tag):
+        tag = pattern.sub(f'{name}="{value}"', tag, count=1)
+    else:
+        end = len(tag) - (2 if tag.endswith("/>") else 1)
+        tag = f'{tag[:end]} {name}="{value}"{tag[end:]}'
+    return tag.encode("utf-8") if is_bytes else tag
+
+
+class _StylePatch:
+    """Appends one yellow fill to styles.xml and, lazily, one cellXfs clone per original style
+    index seen on a highlighted row (same font/border/number format, fill swapped)."""
+
+    def __init__(self, styles_xml):
+        self.xml = styles_xml.decode("utf-8")
+        fills = re.search(r"<((?:\w+:)?)fills\b[^>]*>(.*?)</\1fills>", self.xml, re.S)
+        xfs = re.search(r"<((?:\w+:)?)cellXfs\b[^>]*>(.*?)</\1cellXfs>", self.xml, re.S)
+        if not fills or not xfs:
+            raise ValueError("styles.xml has no fills/cellXfs")
+        self.prefix = fills.group(1)
+        self.fill_id = len(re.findall(r"<(?:\w+:)?fill\b", fills.group(2)))
+        self.xfs = _XF.findall(xfs.group(2))
+        if not self.xfs:
+            raise ValueError("styles.xml has an empty cellXfs")
+        self.mapping = {}
+
+    def highlight(self, style_id):
+        """Style index to use for a highlighted cell whose current style index is style_id."""
+        new_id = self.mapping.get(style_id)
+        if new_id is None:
+            new_id = self.mapping[style_id] = len(self.xfs) + len(self.mapping)
+        return new_id
+
+    def render(self):
+        """styles.xml bytes with the fill and the cellXfs clones appended (counts updated)."""
+        p = self.prefix
+        fill = (
+            f'<{p}fill><{p}patternFill patternType="solid"><{p}fgColor rgb="FFFFFF00"/>'
+            f'<{p}bgColor rgb="FFFFFF00"/></{p}patternFill></{p}fill>'
+        )
+        clones = []
+        for style_id in sorted(self.mapping, key=self.mapping.get):
+            xf = self.xfs[style_id] if style_id < len(self.xfs) else self.xfs[0]
+            start = re.match(r"<[^>]*>", xf).group(0)
+            new_start = _set_attr(_set_attr(start, "fillId", self.fill_id), "applyFill", 1)
+            clones.append(new_start + xf[len(start):])
+        xml = self._append(self.xml, "fills", fill, self.fill_id + 1)
+        return self._append(xml, "cellXfs", "".join(clones), len(self.xfs) + len(clones)).encode("utf-8")
+
+    @staticmethod
+    def _append(xml, element, children, count):
+        m = re.search(rf"(<((?:\w+:)?){element}\b[^>]*>)(.*?)(</\2{element}>)", xml, re.S)
+        start = _set_attr(m.group(1), "count", count)
+        return xml[:m.start()] + start + m.group(3) + children + m.group(4) + xml[m.end():]
+
+
+def _restyle_row(row_xml, row_num, styles, max_col, fill_mode="cells"):
+    """Give every cell of one <row> element the highlighted style.
+    fill_mode "cells": like the openpyxl per-cell loop, columns 1..max_col without a cell get an
+    empty styled cell. "row": the row itself gets the style (s + customFormat) and only existing
+    cells are restyled."""
+    start = _ROW_START.match(row_xml)
+    start_tag = row_xml[:start.end()]
+    prefix = re.match(rb"<((?:\w+:)?)row", start_tag).group(1)
+    if start_tag.endswith(b"/>"):
+        start_tag = start_tag[:-2] + b">"
+        body, end_tag = b"", b"</" + prefix + b"row>"
+    else:
+        close = row_xml.rindex(b"</")
+        body, end_tag = row_xml[start.end():close], row_xml[close:]
+    start_tag = re.sub(rb'\s+spans="[^"]*"', b"", start_tag)  # optional hint, may no longer match
+    if fill_mode == "row":
+        row_style = _STYLE_ATTR.search(start_tag[:-1])
+        start_tag = _set_attr(start_tag, "s", styles.highlight(int(row_style.group(1)) if row_style else 0))
+        start_tag = _set_attr(start_tag, "customFormat", 1)
+        max_col = 0
+
+    def empty_cell(col):
+        ref = get_column_letter(col).encode("ascii") + str(row_num).encode("ascii")
+        return b"<%sc r=\"%s\" s=\"%d\"/>" % (prefix, ref, styles.highlight(0))
+
+    parts = []
+    last = 0
+    col = 0
+    for m in _CELL.finditer(body):
+        attrs = m.group(2)
+        ref = _CELL_REF.search(attrs)
+        new_col = column_index_from_string(ref.group(1).decode("ascii")) if ref else col + 1
+        parts.append(body[last:m.start()])
+        parts.extend(empty_cell(c) for c in range(col + 1, min(new_col, max_col + 1)))
+        col = new_col
+        if not ref:
+            attrs = b' r="%s%d"' % (get_column_letter(col).encode("ascii"), row_num) + attrs
+        style = _STYLE_ATTR.search(attrs)
+        new_style = b's="%d"' % styles.highlight(int(style.group(1)) if style else 0)
+        attrs = _STYLE_ATTR.sub(new_style, attrs, count=1) if style else attrs + b" " + new_style
+        parts.append(b"<" + m.group(1) + b"c" + attrs + m.group(3))
+        last = m.end()
+    parts.extend(empty_cell(c) for c in range(col + 1, max_col + 1))
+    parts.append(body[last:])
+    return start_tag + b"".join(parts) + end_tag
+
+
+def _rewrite_sheet_xml(src, dst, runs, styles, fill_mode="cells"):
+    """Stream worksheet XML from src to dst, restyling only the rows in runs (_RowRuns).
+    Everything else is copied as the original bytes; reads PATCH_CHUNK_SIZE at a time. Rows are
+    matched against the runs with a cursor, and once the last run is written the rest of the part
+    is copied without looking for rows."""
+    firsts, lasts = runs.firsts, runs.lasts
+    run = 0  # first run not yet behind the current row
+    buf = b""
+    row_num = 0
+    max_col = None
+    eof = False
+    while not eof and run < len(firsts):
+        chunk = src.read(PATCH_CHUNK_SIZE)
+        eof = not chunk
+        buf += chunk
+        if max_col is None:
+            dim = _DIMENSION.search(buf)
+            if dim:
+                max_col = column_index_from_string(dim.group(1).decode("ascii"))
+            elif _ROW_START.search(buf) or eof:
+                max_col = 0
+        pos = out = 0
+        pieces = []
+        pending = None
+        while run < len(firsts):
+            m = _ROW_START.search(buf, pos)
+            if m is None:
+                break
+            num_match = _ROW_NUM.search(m.group(1))
+            num = int(num_match.group(1)) if num_match else row_num + 1
+            if num < row_num:  # rows out of order: look the run up again
+                run = bisect.bisect_left(lasts, num)
+            while run < len(lasts) and lasts[run] < num:
+                run += 1
+            if run == len(firsts) or num < firsts[run]:
+                row_num = num
+                pos = m.end()
+                continue
+            if m.group(1).endswith(b"/"):
+                end = m.end()
+            else:
+                close = _ROW_END.search(buf, m.end())
+                if close is None:
+                    if eof:
+                        raise ValueError(f"Unterminated <row> {num} in worksheet XML")
+                    pending = m.start()  # wait for the end of this highlighted row
+                    break
+                end = close.end()
+            row_num = num
+            pieces.append(buf[out:m.start()])
+            pieces.append(_restyle_row(buf[m.start():end], num, styles, max_col or 0, fill_mode))
+            out = pos = end
+        # keep from the last '<' on: it may be the start of a tag split across chunks
+        keep = len(buf) if eof or run == len(firsts) else buf.rfind(b"<", pos)
+        if keep < pos:
+            keep = len(buf)
+        if pending is not None:
+            keep = pending
+        pieces.append(buf[out:keep])
+        dst.write(b"".join(pieces))
+        buf = buf[keep:]
+    dst.write(buf)
+    shutil.copyfileobj(src, dst, PATCH_CHUNK_SIZE)
+
+
+def _clone_zipinfo(info):
+    """Fresh ZipInfo with the member's name, timestamp, compression and attributes."""
+    zi = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    zi.compress_type = info.compress_type
+    zi.external_attr = info.external_attr
+    zi.create_system = info.create_system
+    zi.comment = info.comment
+    zi.file_size = info.file_size
+    return zi
+
+
+def _copy_member_raw(zin, zout, info):
+    """Copy one member's compressed bytes as they are (no inflate / deflate), with its CRC and sizes.
+    zipfile has no public raw copy, so this writes the local header the way ZipFile.open(..., "w") does.
+    Returns False (nothing written) for members it does not handle: encrypted or unusual compression."""
+    if info.flag_bits & 0x1 or info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        return False
+    zi = _clone_zipinfo(info)
+    zi.flag_bits = info.flag_bits & ~0x08  # sizes go in the local header, no data descriptor
+    zi.CRC = info.CRC
+    zi.compress_size = info.compress_size
+    zip64 = max(info.file_size, info.compress_size) > zipfile.ZIP64_LIMIT
+    with zin.open(info) as fsrc:
+        raw = fsrc._fileobj  # positioned at the member's compressed data
+        if zout._seekable:
+            zout.fp.seek(zout.start_dir)
+        zi.header_offset = zout.fp.tell()
+        zout._writecheck(zi)
+        zout._didModify = True
+        zout.fp.write(zi.FileHeader(zip64))
+        remaining = info.compress_size
+        while remaining:
+            chunk = raw.read(min(PATCH_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated member {info.filename}")
+            zout.fp.write(chunk)
+            remaining -= len(chunk)
+    zout.start_dir = zout.fp.tell()
+    zout.filelist.append(zi)
+    zout.NameToInfo[zi.filename] = zi
+    return True
+
+
+def patch_workbook(src, dst, excel_rows, fill_mode="cells"):
+    """
+    Zip-level clone: every package member is copied with its original compressed bytes (VBA project,
+    other sheets, drawings, media, metadata; nothing is inflated or deflated again) except the XML of the worksheets with highlights, where only the
+    highlighted rows are restyled while streaming, and styles.xml, which gets one fill plus the
+    needed cellXfs entries (shared by all sheets).
+    src: path or binary file object of the original; dst: writable binary file object.
+    excel_rows: 1-based rows of the first worksheet, or {worksheet index: rows}; rows are _RowRuns
+    or any iterable of row numbers.
+    fill_mode: "cells" or "row", see _restyle_row.
+    """
+    sheet_rows = excel_rows if isinstance(excel_rows, dict) else {0: excel_rows}
+    with zipfile.ZipFile(_excel_source(src)) as zin:
+        parts = _workbook_parts(zin)
+        styles_part = parts["styles"]
+        rows_by_part = {parts["sheets"][i][1]: _RowRuns.from_rows(rows) for i, rows in sheet_rows.items()}
+        styles = _StylePatch(zin.read(styles_part))
+        with zipfile.ZipFile(dst, "w", zipfile.ZIP_DEFLATED) as zout:
+            styles_info = None
+            for info in zin.infolist():
+                zi = _clone_zipinfo(info)
+                if info.filename == styles_part:
+                    styles_info = zi  # written last, once every highlighted style is known
+                    continue
+                if info.filename not in rows_by_part and _copy_member_raw(zin, zout, info):
+                    continue
+                large = info.file_size > zipfile.ZIP64_LIMIT // 2
+                with zin.open(info) as fsrc, zout.open(zi, "w", force_zip64=large) as fdst:
+                    if info.filename in rows_by_part:
+                        _rewrite_sheet_xml(fsrc, fdst, rows_by_part[info.filename], styles, fill_mode)
+                    else:
+                        shutil.copyfileobj(fsrc, fdst, PATCH_CHUNK_SIZE)
+            zout.writestr(styles_info, styles.render())
+
+
+# Clone verification: the patched package against its original, without loading either workbook
+_FILL = re.compile(r"<(?:\w+:)?fill\b[^>]*?/>|<(?:\w+:)?fill\b[^>]*>.*?</(?:\w+:)?fill>", re.S)
+_FILL_ID = re.compile(r'\bfillId="(\d+)"')
+_ROW_ATTRS_STYLE = re.compile(rb'\s+(?:s|customFormat|spans)="[^"]*"')
+_CELL_ATTRS_STYLE = re.compile(rb'\s*\b(?:r|s)="[^"]*"')
+
+
+class CloneVerificationError(Exception):
+    """The highlighted output differs from its original in more than highlight styles."""
+
+
+def _sheet_rows(stream):
+    """Split worksheet XML from a binary stream into (text before the row, <row> element) pairs,
+    PATCH_CHUNK_SIZE at a time; the last pair is (text after the last row, None)."""
+    buf = b""
+    gap = []
+    eof = False
+    while True:
+        pos = 0
+        while True:
+            m = _ROW_START.search(buf, pos)
+            if m is None:
+                break
+            if m.group(1).endswith(b"/"):
+                end = m.end()
+            else:
+                close = _ROW_END.search(buf, m.end())
+                if close is None:
+                    break
+                end = close.end()
+            gap.append(buf[pos:m.start()])
+            yield b"".join(gap), buf[m.start():end]
+            gap = []
+            pos = end
+        if eof:
+            if m is not None:
+                raise CloneVerificationError("Unterminated <row> in worksheet XML")
+            gap.append(buf[pos:])
+            yield b"".join(gap), None
+            return
+        # keep an open row, or from the last '<' on (a tag may be split across chunks)
+        keep = m.start() if m is not None else buf.rfind(b"<", pos)
+        keep = pos if keep < pos else keep
+        gap.append(buf[pos:keep])
+        chunk = stream.read(PATCH_CHUNK_SIZE)
+        eof = not chunk
+        buf = buf[keep:] + chunk
+
+
+class _StyleCheck:
+    """styles.xml of the original and the clone: the clone may only append fills and cellXfs entries.
+    ok(old, new) holds when style index new is an appended copy of old with the fill swapped."""
+
+    def __init__(self, original_xml, clone_xml):
+        original, clone = original_xml.decode("utf-8"), clone_xml.decode("utf-8")
+        blocks = {}
+        for element, pattern in (("fills", _FILL), ("cellXfs", _XF)):
+            found = [re.search(rf"<((?:\w+:)?){element}\b[^>]*>(.*?)</\1{element}>", xml, re.S)
+                     for xml in (original, clone)]
+            if not all(found):
+                raise CloneVerificationError(f"styles.xml has no {element}")
+            before, after = (pattern.findall(m.group(2)) for m in found)
+            if after[:len(before)] != before:
+                raise CloneVerificationError(f"styles.xml: original {element} entries were changed")
+            blocks[element] = (before, after)
+            original = original[:found[0].start()] + element + original[found[0].end():]
+            clone = clone[:found[1].start()] + element + clone[found[1].end():]
+        if original != clone:
+            raise CloneVerificationError("styles.xml changed outside fills and cellXfs")
+        fills_before, fills_after = blocks["fills"]
+        self.xfs, xfs_after = blocks["cellXfs"]
+        self.added = xfs_after[len(self.xfs):]
+        self.new_fills = range(len(fills_before), len(fills_after))
+        self.checked = {}
+
+    @staticmethod
+    def _key(xf):
+        """Attributes except fillId / applyFill (order and spacing ignored) and the element body."""
+        start = re.match(r"<[^>]*>", xf).group(0)
+        attrs = sorted(a for a in re.findall(r'([\w:]+)="([^"]*)"', start) if a[0] not in ("fillId", "applyFill"))
+        return attrs, xf[len(start):]
+
+    def ok(self, old, new):
+        result = self.checked.get((old, new))
+        if result is None:
+            added = new - len(self.xfs)
+            if not 0 <= added < len(self.added):
+                result = False
+            else:
+                fill = _FILL_ID.search(self.added[added])
+                base = self.xfs[old] if old < len(self.xfs) else self.xfs[0]
+                result = (bool(fill) and int(fill.group(1)) in self.new_fills
+                          and self._key(self.added[added]) == self._key(base))
+            self.checked[old, new] = result
+        return result
+
+
+def _row_cells(row_xml):
+    """(<row> start tag without style attributes, {column: (cell attrs without r/s, rest, style)},
+    row text outside the cells)."""
+    start = _ROW_START.match(row_xml)
+    body = b"" if start.group(1).endswith(b"/") else row_xml[start.end():row_xml.rindex(b"</")]
+    tag = _ROW_ATTRS_STYLE.sub(b"", row_xml[:start.end()]).replace(b"/>", b">").replace(b" >", b">")
+    cells = {}
+    col = 0
+    for m in _CELL.finditer(body):
+        ref = _CELL_REF.search(m.group(2))
+        col = column_index_from_string(ref.group(1).decode("ascii")) if ref else col + 1
+        style = _STYLE_ATTR.search(m.group(2))
+        attrs = b" ".join(_CELL_ATTRS_STYLE.sub(b"", m.group(2)).split())  # '<c t="s" />' gets s= before the space
+        cells[col] = (attrs, m.group(3), int(style.group(1)) if style else 0)
+    return tag, cells, _CELL.sub(b"", body)
+
+
+def _compare_rows(original, clone, styles, row_num):
+    """Error message if the clone row differs from the original in more than highlight styles, else None."""
+    tag, cells, text = _row_cells(original)
+    new_tag, new_cells, new_text = _row_cells(clone)
+    if tag != new_tag or text != new_text:
+        return f"row {row_num}: row attributes or content outside the cells changed"
+    row_style = _STYLE_ATTR.search(_ROW_START.match(clone).group(1))
+    if row_style:
+        old = _STYLE_ATTR.search(_ROW_START.match(original).group(1))
+        if not styles.ok(int(old.group(1)) if old else 0, int(row_style.group(1))):
+            return f"row {row_num}: row style {row_style.group(1).decode()} is not a highlight style"
+    for col, (attrs, rest, style) in new_cells.items():
+        old = cells.get(col)
+        if old is None:
+            if attrs.strip() or rest != b"/>" or not styles.ok(0, style):
+                return f"row {row_num}: added cell {get_column_letter(col)} is not an empty highlighted cell"
+        elif old[:2] != (attrs, rest):
+            return f"row {row_num}: cell {get_column_letter(col)} value or attributes changed"
+        elif old[2] != style and not styles.ok(old[2], style):
+            return f"row {row_num}: cell {get_column_letter(col)} style {style} is not a highlight style"
+    missing = set(cells) - set(new_cells)
+    if missing:
+        return f"row {row_num}: cell {get_column_letter(min(missing))} was removed"
+    return None
+
+
+def _verify_sheet(original, clone, styles, runs, name):
+    """Walk both worksheet streams row by row. Returns (rows, restyled rows); raises CloneVerificationError."""
+    rows = restyled = row_num = 0
+    pairs = zip(_sheet_rows(original), _sheet_rows(clone))
+    for (gap, row), (new_gap, new_row) in pairs:
+        if gap != new_gap:
+            raise CloneVerificationError(f"{name}: content between rows changed after row {row_num}")
+        if row is None or new_row is None:
+            if row is not new_row:
+                raise CloneVerificationError(f"{name}: row count differs after row {row_num}")
+            break
+        num = _ROW_NUM.search(_ROW_START.match(row).group(1))
+        row_num = int(num.group(1)) if num else row_num + 1
+        rows += 1
+        if row == new_row:
+            if runs is not None and row_num in runs:
+                raise CloneVerificationError(f"{name}: row {row_num} should be highlighted but is unchanged")
+            continue
+        if runs is not None and row_num not in runs:
+            raise CloneVerificationError(f"{name}: row {row_num} changed but is not a highlighted row")
+        error = _compare_rows(row, new_row, styles, row_num)
+        if error:
+            raise CloneVerificationError(f"{name}: {error}")
+        restyled += 1
+    return rows, restyled
+
+
+def verify_clone(original, clone, excel_rows=None):
+    """
+    Check that clone (a patch_workbook output) is original with only highlight styles added.
+    Members other than the highlighted worksheets and styles.xml must match by CRC-32 and size from
+    the zip directories (nothing is decompressed for them). styles.xml may only gain appended fills
+    and cellXfs clones. Worksheet XML that differs is streamed row by row: text between rows must be
+    identical, and a changed row may only change style indexes to appended highlight styles (and gain
+    empty highlighted cells). excel_rows: as for patch_workbook; when given, exactly those rows
+    (where present in the XML) must be the changed ones.
+    original, clone: paths or binary file objects. Raises CloneVerificationError; returns
+    {members, identical, sheets_checked, rows, restyled}.
+    """
+    sheet_rows = excel_rows if isinstance(excel_rows, dict) or excel_rows is None else {0: excel_rows}
+    for f in (original, clone):
+        if hasattr(f, "seek"):
+            f.seek(0)
+    with zipfile.ZipFile(_excel_source(original)) as zorig, zipfile.ZipFile(_excel_source(clone)) as zclone:
+        names, new_names = zorig.namelist(), zclone.namelist()
+        if sorted(names) != sorted(new_names):  # order may differ: the patch writes styles.xml last
+            changed = sorted(set(names) ^ set(new_names)) or ["duplicate member names"]
+            raise CloneVerificationError(f"Package members differ: {', '.join(changed[:5])}")
+        parts = _workbook_parts(zorig)
+        styles = None
+        sheets = {part: (name, i) for i, (name, part) in enumerate(parts["sheets"])}
+        stats = {"members": len(names), "identical": 0, "sheets_checked": 0, "rows": 0, "restyled": 0}
+        for info in zorig.infolist():
+            new = zclone.getinfo(info.filename)
+            if (info.CRC, info.file_size) == (new.CRC, new.file_size):
+                stats["identical"] += 1
+                continue
+            if info.filename == parts["styles"]:
+                styles = styles or _StyleCheck(zorig.read(info), zclone.read(new))
+            elif info.filename in sheets:
+                name, index = sheets[info.filename]
+                styles = styles or _StyleCheck(zorig.read(parts["styles"]), zclone.read(parts["styles"]))
+                runs = None if sheet_rows is None else _RowRuns.from_rows(sheet_rows.get(index, ()))
+                with zorig.open(info) as a, zclone.open(new) as b:
+                    rows, restyled = _verify_sheet(a, b, styles, runs, f"Sheet '{name}'")
+                stats["sheets_checked"] += 1
+                stats["rows"] += rows
+                stats["restyled"] += restyled
+            else:
+                raise CloneVerificationError(f"Package member changed: {info.filename}")
+    return stats
+
+
+def _fill_rows(sheet, excel_rows, fill_mode="cells"):
+    """Yellow fill on the given 1-based rows (_RowRuns or row numbers) of an openpyxl worksheet, run by run.
+    fill_mode "cells": fill every column 1..max_column of the row (creates empty cells);
+    "row": row-level style (<row s=.. customFormat="1">) plus fill on the cells that exist."""
+    # max_row/max_column scan every cell, so read them once, not per highlighted row
+    max_row, max_column = sheet.max_row, sheet.max_column
+    runs = [(max(first, 1), min(last, max_row)) for first, last in _RowRuns.from_rows(excel_rows)
+            if first <= max_row and last >= 1]
+    if fill_mode == "row":
+        rows = set()
+        for first, last in runs:
+            for excel_row in range(first, last + 1):
+                sheet.row_dimensions[excel_row].fill = YELLOW_FILL
+            rows.update(range(first, last + 1))
+        # worksheet._cells holds only cells present in the file; sheet[row] would create the rest
+        for (row, _col), cell in sheet._cells.items():
+            if row in rows:
+                cell.fill = YELLOW_FILL
+    else:
+        for first, last in runs:
+            for excel_row in range(first, last + 1):
+                for col in range(1, max_column + 1):
+                    sheet.cell(excel_row, col).fill = YELLOW_FILL
+
+
+def _clone_with_openpyxl(buf, file_ext, excel_rows, fill_mode="cells", dst=None, spans=None):
+    """Load the whole workbook with openpyxl, fill highlighted rows (_fill_rows), save to dst (path or binary file).
+    excel_rows: rows of the first worksheet, or {worksheet index: rows}.
+    spans: optional _Spans, gets load / fill / save timings."""
+    sheet_rows = excel_rows if isinstance(excel_rows, dict) else {0: excel_rows}
+    spans = spans or _Spans()
+    try:
+        if hasattr(buf, "seek"):
+            buf.seek(0)
+        with spans.span("load"):
+            wb = openpyxl.load_workbook(buf, keep_vba=(file_ext == ".xlsm"), data_only=False)
+        with spans.span("fill"):
+            for index, rows in sheet_rows.items():
+                _fill_rows(wb.worksheets[index], rows, fill_mode)
+        with spans.span("save"):
+            wb.save(dst)
+    except Exception as e:
+        raise ValueError(
+            f"Cannot preserve workbook (VBA/macros/hidden code must be kept). Clone failed: {e}. "
+            "File must be valid .xlsx or .xlsm with at least 8 columns (Column D = Parcel Number, Column H = Parcel Notes)."
+        ) from e
+
+
+# Instrumentation: per-stage spans for one request, histograms for /metrics (per process)
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_rss_mb():
+    """High-water RSS of this process in MB (None where the resource module is missing)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class _Spans:
+    """Stage timings of one request: {stage: {"ms": wall time, "peak_rss_mb": process high-water RSS after it}}."""
+
+    def __init__(self, stages=None):
+        self.stages = stages if stages is not None else {}
+
+    def add(self, name, ms):
+        self.stages[name] = {"ms": round(ms, 1), "peak_rss_mb": _peak_rss_mb()}
+
+    @contextlib.contextmanager
+    def span(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - t0) * 1000)
+
+
+def server_timing(stages, **extra):
+    """Server-Timing header value, e.g. 'parse;dur=812.4, patch;dur=95.0, cache;desc="miss"'."""
+    parts = [f"{name};dur={span['ms']}" for name, span in stages.items()]
+    parts += [f'{name};desc="{value}"' for name, value in extra.items()]
+    return ", ".join(parts)
+
+
+def sheets_header(sheets):
+    """X-DEP-Sheets value: per-sheet counts as compact ASCII JSON (sheet names are \\u-escaped)."""
+    keys = ("sheet", "rows", "highlighted", "header_row", "columns", "skipped")
+    return json.dumps([{k: m[k] for k in keys if k in m} for m in sheets], separators=(",", ":"))
+
+
+def log_event(event, **fields):
+    """One JSON log line per event, for log search / ingestion next to the plain-text lines."""
+    print(json.dumps({"ts": datetime.now().isoformat(timespec="milliseconds"), "event": event, **fields}), flush=True)
+
+
+class _Histogram:
+    """Minimal Prometheus histogram with labels; observe() is thread-safe."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.series = {}  # sorted label items -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted(self.series.items())
+        for key, series in items:
+            labels = ",".join(f'{k}="{v}"' for k, v in key)
+            sep = "," if labels else ""
+            for bound, count in zip(self.buckets, series):
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{le}"}} {count}')
+            braced = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{braced} {series[-2]}")
+            lines.append(f"{self.name}_count{braced} {series[-1]}")
+        return lines
+
+
+_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+METRICS = {
+    "request": _Histogram("dep_request_duration_seconds", "HTTP request duration by endpoint and status.", _SECONDS_BUCKETS),
+    "stage": _Histogram("dep_stage_duration_seconds", "Duration of each processing stage (/process).", _SECONDS_BUCKETS),
+    "rows": _Histogram("dep_workbook_rows", "Data rows per processed workbook.",
+                       (100, 1000, 5000, 10000, 50000, 100000, 250000, 500000, 1000000)),
+    "peak_rss": _Histogram("dep_peak_rss_megabytes", "Process high-water RSS after each /process request.",
+                           (128, 256, 384, 512, 768, 1024, 1536, 2048, 4096)),
+}
+
+
+READERS = ("stream", "pandas")
+WRITERS = ("patch", "openpyxl")
+FILL_MODES = ("cells", "row")
+
+
+def resolve_sheets(names, sheets=None):
+    """Worksheet indexes for the sheets option: None -> [0] (first sheet), "all" -> every worksheet,
+    or a list of sheet names / 1-based sheet numbers (a name that looks like a number wins)."""
+    if sheets is None:
+        return [0]
+    if isinstance(sheets, str) and sheets.strip().lower() == "all":
+        return list(range(len(names)))
+    indexes = []
+    for sheet in [sheets] if isinstance(sheets, (str, int)) else sheets:
+        key = str(sheet).strip()
+        if key in names:
+            index = names.index(key)
+        elif key.isdigit() and 1 <= int(key) <= len(names):
+            index = int(key) - 1
+        else:
+            raise ValueError(f"Unknown sheet: {key}. Sheets in this workbook: {', '.join(names)}.")
+        if index not in indexes:
+            indexes.append(index)
+    return indexes
+
+
+def _highlight_sheet(src, sheet_index, reader="stream", header_sample_rows=None, columns=None):
+    """Read one worksheet and run the highlight logic (runs in a pool worker for multi-sheet files).
+    Returns {index, header_row (0-based offset), header_info, rows, highlighted (count),
+    runs (_RowRuns of Excel rows), dep_parcels (set), read_ms, highlight_ms}."""
+    t0 = time.perf_counter()
+    if reader == "stream":
+        header_row, parcels, dep_flags, header_info = read_sheet_columns(
+            src, columns, sample_rows=header_sample_rows, sheet_index=sheet_index
+        )
+    else:
+        df, header_row, header_info, (parcel_col, notes_col) = _read_sheet_pandas(
+            _excel_source(src), header_sample_rows, sheet_index, columns
+        )
+        parcels, dep_flags = _run_inputs(df, parcel_col, notes_col)
+        del df
+    t1 = time.perf_counter()
+    mask = _highlight_mask_vectorized(parcels, dep_flags)
+    return {
+        "index": sheet_index, "header_row": header_row, "header_info": header_info, "rows": len(mask),
+        "highlighted": int(mask.sum()), "dep_parcels": _dep_parcels(parcels, dep_flags),
+        # data index i -> Excel row (1-based): header at row header_row+1, data starts header_row+2
+        "runs": _RowRuns.from_mask(mask, header_row + 2), "read_ms": (t1 - t0) * 1000, "highlight_ms": (time.perf_counter() - t1) * 1000,
+    }
+
+
+SHEET_POOL_WAIT = float(os.environ.get("DEP_SHEET_POOL_WAIT", "15"))  # seconds /process waits on pooled sheets
+
+
+def _highlight_sheets(src, indexes, reader, header_sample_rows, columns=None):
+    """_highlight_sheet for each index, in the job process pool when there are several sheets.
+    Inside a pool worker (jobs, batch, CLI) sheets run one after another: no nested pools; so do they
+    when a pool worker dies on the way (the broken pool is replaced for the next request). The pool is
+    shared with /jobs, so a request waits at most SHEET_POOL_WAIT seconds for it (sheets queued behind
+    long jobs); sheets not done by then, or that hit the job memory cap, are read in this process.
+    Returns one result or exception per index, in order."""
+    results = {}
+    if len(indexes) > 1 and multiprocessing.parent_process() is None and JOB_WORKERS > 1:
+        if hasattr(src, "read"):  # file objects do not cross process boundaries; paths and bytes do
+            src.seek(0)
+            src = src.read()
+        pools = set()
+        try:
+            futures = []
+            for i in indexes:
+                pool, future = _submit_job(_highlight_sheet, src, i, reader, header_sample_rows, columns)
+                pools.add(pool)
+                futures.append(future)
+            deadline = time.monotonic() + SHEET_POOL_WAIT
+            for i, future in zip(indexes, futures):
+                try:
+                    results[i] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                except BrokenProcessPool:
+                    raise
+                except (TimeoutError, MemoryError):
+                    future.cancel()  # a sheet still queued is dropped; one already running just finishes
+                except Exception as e:
+                    results[i] = e
+            if len(results) < len(indexes):
+                print(f"{len(indexes) - len(results)} sheet(s) not done by the job pool in {SHEET_POOL_WAIT:g} s "
+                      "or over its memory cap; reading them here", file=sys.stderr, flush=True)
+        except BrokenProcessPool as e:  # a worker died (OOM kill, crash): do the sheets here instead
+            for pool in pools:
+                _discard_job_pool(pool)
+            results = {}
+            print(f"Sheet workers failed ({e}); reading the sheets one after another", file=sys.stderr, flush=True)
+    for i in indexes:
+        if i in results:
+            continue
+        try:
+            results[i] = _highlight_sheet(src, i, reader, header_sample_rows, columns)
+        except Exception as e:
+            results[i] = e
+    return [results[i] for i in indexes]
+
+
+def process_excel_file(file_bytes, original_filename, reader="stream", meta=None, header_sample_rows=None,
+                       writer="patch", fill_mode="cells", progress=None, output_path=None, sheets=None, columns=None,
+                       verify=False, output_format="xlsx"):
+    """Read worksheets, run highlight logic, clone the workbook with yellow fill on highlighted rows.
+    sheets: None (first worksheet), "all", or a list of sheet names / 1-based numbers (resolve_sheets).
+    Each sheet gets its own header detection; several sheets are read in parallel (_highlight_sheets)
+    and patched into one cloned workbook. With "all", sheets that are not RDM-shaped (too few
+    columns, no data) are skipped; an explicitly selected sheet like that is an error.
+    columns: {"parcel": spec, "notes": spec}, e.g. {"parcel": "name:*parcel*number*", "notes": "H"}
+    (parse_column_spec); default DEFAULT_COLUMNS. Header names are resolved per sheet.
+    reader: "stream" (default) scans the sheet XML once and keeps only the parcel/notes columns;
+    "pandas" reads the sheet with pd.read_excel.
+    writer: "patch" (default) rewrites only the highlighted sheets' XML and styles.xml inside the zip
+    and falls back to "openpyxl" (full load_workbook + save) when the package cannot be patched.
+    fill_mode: "cells" (default) fills every column up to the last used one on a highlighted row;
+    "row" applies a row-level style and fills only existing cells (smaller, faster on wide sheets).
+    verify: check the patched output against the original with verify_clone (own "verify" stage,
+    result in meta["verify"]); a mismatch raises CloneVerificationError. openpyxl output is a full
+    rewrite and is not verified.
+    The header row is detected from the first header_sample_rows rows (default HEADER_SAMPLE_ROWS).
+    meta: optional dict, filled with header_row (1-based Excel row, first processed sheet), header_reason,
+    writer, sheets ([{sheet, rows, highlighted, header_row, header_reason, columns} or {sheet, skipped}]),
+    dep_parcels (set of parcels with a DEP note, over all sheets, for PARCEL_INDEX) and
+    stages ({name: {ms, peak_rss_mb}} for detect, parse, highlight, then patch or load/fill/save;
+    spans already in meta["stages"] are kept).
+    Returns (output, output_filename, highlighted rows, data rows, output bytes); counts are totals over sheets.
+    progress: optional callable(stage, fraction), called as each stage starts.
+    file_bytes may be bytes, a path or a binary file. With output_path the result is written
+    straight to that file and its path is returned in place of a BytesIO.
+    .csv / .parquet input goes to process_table_file (output_format "xlsx" or "same"; reader, writer,
+    fill_mode and sheets do not apply).
+    Supports NY RDM-style docs: header on row 6, Tax ID / Bill ID columns."""
+    file_ext = Path(original_filename).suffix.lower()
+    if file_ext == ".xls":
+        raise ValueError("Old .xls is not supported. Save as .xlsx or .xlsm.")
+    if file_ext in TABLE_EXTENSIONS:
+        return process_table_file(file_bytes, original_filename, meta=meta, header_sample_rows=header_sample_rows,
+                                  output_format=output_format, output_path=output_path, columns=columns,
+                                  verify=verify, progress=progress)
+    if reader not in READERS:
+        raise ValueError(f"Unknown reader: {reader}. Use one of: {', '.join(READERS)}.")
+    if writer not in WRITERS:
+        raise ValueError(f"Unknown writer: {writer}. Use one of: {', '.join(WRITERS)}.")
+    if fill_mode not in FILL_MODES:
+        raise ValueError(f"Unknown fill mode: {fill_mode}. Use one of: {', '.join(FILL_MODES)}.")
+    column_specs(columns)  # invalid specs fail before the workbook is read
+
+    progress = progress or (lambda stage, fraction: None)
+    spans = _Spans(meta.setdefault("stages", {}) if meta is not None else None)
+    progress("read", 0.05)
+    buf = _excel_source(file_bytes)
+    names = sheet_names(buf)
+    indexes = resolve_sheets(names, sheets)
+    t0 = time.perf_counter()
+    results = _highlight_sheets(buf, indexes, reader, header_sample_rows, columns)
+    if len(indexes) == 1:
+        if isinstance(results[0], ValueError) and sheets is not None:
+            raise ValueError(f"Sheet '{names[indexes[0]]}': {results[0]}")
+        if isinstance(results[0], Exception):
+            raise results[0]
+        # the header probe runs inside the read, so parse is the read time minus the probe
+        header_ms = results[0]["header_info"]["ms"]
+        spans.add("detect", header_ms)
+        spans.add("parse", results[0]["read_ms"] - header_ms)
+        spans.add("highlight", results[0]["highlight_ms"])
+    else:
+        spans.add("sheets", (time.perf_counter() - t0) * 1000)
+
+    excel_rows = {}
+    sheet_meta = []
+    dep_parcels = set()
+    total_rows = highlighted_count = 0
+    first = None
+    skip_invalid = isinstance(sheets, str) and sheets.strip().lower() == "all"
+    for index, result in zip(indexes, results):
+        if isinstance(result, ValueError):
+            if skip_invalid:
+                sheet_meta.append({"sheet": names[index], "skipped": str(result)})
+                continue
+            raise ValueError(f"Sheet '{names[index]}': {result}")
+        if isinstance(result, Exception):
+            raise result
+        first = first or result
+        excel_rows[index] = result["runs"]
+        dep_parcels |= result["dep_parcels"]
+        total_rows += result["rows"]
+        highlighted_count += result["highlighted"]
+        sheet_meta.append({
+            "sheet": names[index], "rows": result["rows"], "highlighted": result["highlighted"],
+            "header_row": result["header_info"]["header_row"], "header_reason": result["header_info"]["reason"],
+            "columns": result["header_info"]["columns"], "ms": round(result["read_ms"] + result["highlight_ms"], 1),
+        })
+    if first is None:
+        raise ValueError("No worksheet has RDM data: " + "; ".join(f"{m['sheet']}: {m['skipped']}" for m in sheet_meta))
+    if meta is not None:
+        meta["header_row"] = first["header_info"]["header_row"]
+        meta["header_reason"] = first["header_info"]["reason"]
+        meta["header_detect_ms"] = first["header_info"]["ms"]
+        meta["sheets"] = sheet_meta
+        meta["dep_parcels"] = dep_parcels
+
+    output_filename = output_filename_for(original_filename)
+
+    # CLONE ONLY: apply yellow fill ONLY to highlighted rows of the original workbook.
+    # No rebuild. 100% preservation of VBA macros, hidden/visible code, all sheets, metadata.
+    progress("write", 0.6)
+    def open_output():
+        return open(output_path, "wb") if output_path else io.BytesIO()
+
+    out = None
+    if writer == "patch":
+        try:
+            out = open_output()
+            with spans.span("patch"):
+                patch_workbook(buf, out, excel_rows, fill_mode)
+        except Exception as e:
+            print(f"Zip patch not possible ({e}); cloning with openpyxl instead", file=sys.stderr, flush=True)
+            if output_path:
+                out.close()
+            out = None
+            writer = "openpyxl"
+    if out is None:
+        out = open_output()
+        _clone_with_openpyxl(buf, file_ext, excel_rows, fill_mode, out, spans)
+    if meta is not None:
+        meta["writer"] = writer
+    if verify:
+        progress("verify", 0.9)
+        if writer == "patch":
+            out.flush()
+            with spans.span("verify"):
+                result = verify_clone(buf, output_path or out, excel_rows)
+        else:
+            result = {"skipped": "openpyxl output is a full rewrite"}
+        if meta is not None:
+            meta["verify"] = result
+    progress("done", 1.0)
+
+    if output_path:
+        out.close()
+        return output_path, output_filename, highlighted_count, total_rows, os.path.getsize(output_path)
+    out.seek(0)
+    return out, output_filename, highlighted_count, total_rows, out.getbuffer().nbytes
+
+
+def analyze_excel_file(file_bytes, original_filename, header_sample_rows=None, meta=None, columns=None):
+    """Dry run: read sheet 0 with the streaming reader and run the highlight logic only.
+    No writable workbook is built and nothing is saved. Returns a dict with header_row (1-based),
+    columns (letters used), rows, highlighted, and runs: [{parcel, first_row, last_row, length}] in Excel row numbers.
+    meta: optional dict, gets stages (detect, parse, highlight) and dep_parcels like process_excel_file."""
+    file_ext = Path(original_filename).suffix.lower()
+    if file_ext == ".xls":
+        raise ValueError("Old .xls is not supported. Save as .xlsx or .xlsm.")
+    spans = _Spans(meta.setdefault("stages", {}) if meta is not None else None)
+    t0 = time.perf_counter()
+    header_row, parcels, dep_flags, header_info = read_sheet_columns(
+        _excel_source(file_bytes), columns, sample_rows=header_sample_rows
+    )
+    spans.add("detect", header_info["ms"])
+    spans.add("parse", (time.perf_counter() - t0) * 1000 - header_info["ms"])
+    with spans.span("highlight"):
+        mask = _highlight_mask_vectorized(parcels, dep_flags)
+        starts, ends = _highlight_runs(parcels, mask)
+    if meta is not None:
+        meta["dep_parcels"] = _dep_parcels(parcels, dep_flags)
+    first_data_row = header_row + 2  # data index 0 -> Excel row
+    runs = [
+        {"parcel": parcels[start], "first_row": first_data_row + start, "last_row": first_data_row + end,
+         "length": end - start + 1}
+        for start, end in zip(starts.tolist(), ends.tolist())
+    ]
+    return {
+        "file": original_filename,
+        "header_row": header_info["header_row"],
+        "header_reason": header_info["reason"],
+        "columns": header_info["columns"],
+        "rows": len(parcels),
+        "highlighted": int(mask.sum()),
+        "runs": runs,
+        "parcels": len({run["parcel"] for run in runs}),
+    }
+
+
+def analysis_csv(result):
+    """CSV text of an analyze_excel_file result: one line per highlighted Excel row."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["excel_row", "parcel", "run_first_row", "run_length"])
+    for run in result["runs"]:
+        for row in range(run["first_row"], run["last_row"] + 1):
+            writer.writerow([row, run["parcel"], run["first_row"], run["length"]])
+    return out.getvalue()
+
+
+# CSV / Parquet input: the same run detection over a table export, read in chunks so memory stays flat.
+# Output is a highlighted .xlsx (openpyxl write-only) or, with output_format="same", the input format
+# plus a HIGHLIGHT_COLUMN flag column.
+TABLE_EXTENSIONS = (".csv", ".parquet")
+TABLE_OUTPUTS = ("xlsx", "same")
+TABLE_CHUNK_ROWS = int(os.environ.get("DEP_TABLE_CHUNK_ROWS", "10000"))
+HIGHLIGHT_COLUMN = "DEP Highlight"
+XLSX_MAX_ROWS = 1048576
+MIMETYPES = {".csv": "text/csv", ".parquet": "application/vnd.apache.parquet"}
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def output_filename_for(original_filename, output_format="xlsx"):
+    """<stem>_Highlighted<ext>: workbooks keep their extension, tables become .xlsx unless output_format is "same"."""
+    extension = Path(original_filename).suffix
+    if extension.lower() in TABLE_EXTENSIONS and output_format != "same":
+        extension = ".xlsx"
+    return f"{Path(original_filename).stem}_Highlighted{extension}"
+
+
+def output_mimetype(output_filename):
+    return MIMETYPES.get(Path(output_filename).suffix.lower(), XLSX_MIMETYPE)
+
+
+class _ChunkedMask:
+    """_highlight_mask_vectorized over a table read in chunks. A run of equal DEP parcels can cross a chunk
+    boundary, so the run still open at the end of a chunk is carried into the next one and its earlier rows
+    are set once it reaches two rows. Holds one byte per row and nothing else."""
+
+    def __init__(self):
+        self.mask = bytearray()
+        self.open_parcel = ""   # parcel of the DEP run open at the end of the last chunk, "" = none
+        self.open_start = 0     # row of its first line
+
+    def add(self, parcels, dep_flags):
+        parcel = np.asarray(parcels, dtype=object)
+        dep = np.asarray(dep_flags, dtype=bool)
+        n = len(parcel)
+        if n == 0:
+            return
+        base = len(self.mask)
+        chunk = _highlight_mask_vectorized(parcel, dep)
+        valid = dep & (parcel != "")
+        if self.open_parcel:
+            carried = valid & (parcel == self.open_parcel)
+            k = n if carried.all() else int(np.argmin(carried))
+            if k:
+                chunk[:k] = True
+                self.mask[self.open_start:base] = b"\x01" * (base - self.open_start)
+                if k == n:
+                    self.mask += chunk.view(np.uint8).tobytes()
+                    return
+        self.mask += chunk.view(np.uint8).tobytes()
+        if not valid[-1]:
+            self.open_parcel = ""
+            return
+        other = np.flatnonzero(~(valid & (parcel == parcel[-1])))
+        self.open_parcel = parcel[-1]
+        self.open_start = base + (int(other[-1]) + 1 if len(other) else 0)
+
+    def result(self, rows=None):
+        return np.frombuffer(bytes(self.mask[:rows]), dtype=bool)
+
+
+def _csv_format(src):
+    """(encoding, delimiter) of a CSV export: UTF-8 (with or without BOM) if the whole file decodes,
+    else Windows-1252, else Latin-1; delimiter sniffed from the first 64 KB (, ; tab or |), by line counts
+    when csv.Sniffer gives up on ragged rows."""
+    with _binary(src) as f:
+        head = f.read(1 << 16)
+        encoding = "utf-8-sig" if head.startswith(codecs.BOM_UTF8) else None
+        for candidate in (("utf-8",) if encoding else ("utf-8", "cp1252")):
+            f.seek(0)
+            decoder = codecs.getincrementaldecoder(candidate)()
+            try:
+                for data in iter(lambda: f.read(PATCH_CHUNK_SIZE), b""):
+                    decoder.decode(data)
+                decoder.decode(b"", final=True)
+            except UnicodeDecodeError:
+                continue
+            encoding = encoding or candidate
+            break
+        else:
+            encoding = "latin-1"
+    text = head.decode(encoding, errors="ignore")
+    try:
+        delimiter = csv.Sniffer().sniff(text[:text.rfind("\n") + 1] or text, delimiters=",;\t|").delimiter
+    except csv.Error:
+        # the sniffer wants rows of one width; title lines and short rows defeat it, so take the candidate
+        # with the highest median count per line (a decimal comma shows up once, the delimiter many times)
+        lines = [line for line in text.splitlines()[:-1] or text.splitlines() if line.strip()]
+        medians = {d: sorted(line.count(d) for line in lines)[len(lines) // 2] if lines else 0 for d in ",;\t|"}
+        delimiter = max(medians, key=medians.get) if any(medians.values()) else ","
+    return encoding, delimiter
+
+
+@contextlib.contextmanager
+def _binary(src):
+    """Binary stream over a path or an in-memory upload, positioned at the first byte."""
+    src = _excel_source(src)
+    if hasattr(src, "read"):
+        src.seek(0)
+        yield src
+    else:
+        with open(src, "rb") as f:
+            yield f
+
+
+class _TableFile:
+    """A .csv or .parquet upload as rows of cell values, read in chunks of TABLE_CHUNK_ROWS rows.
+    CSV lines are rows as they are (title rows included), so the header is scored like a worksheet's.
+    For Parquet the column names are row 0 and the header; pyarrow is optional and only needed here."""
+
+    def __init__(self, src, filename):
+        self.src = _excel_source(src)
+        self.kind = Path(filename).suffix.lower()
+        if self.kind == ".parquet":
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ValueError("Parquet input needs pyarrow on the server (pip install pyarrow). Upload .csv or .xlsx instead.")
+            try:
+                self.parquet = pq.ParquetFile(self.src)
+            except Exception as e:
+                raise ValueError(f"Not a valid Parquet file: {e}")
+            self.names = list(self.parquet.schema_arrow.names)
+        else:
+            self.encoding, self.delimiter = _csv_format(self.src)
+
+    @contextlib.contextmanager
+    def _text(self):
+        with _binary(self.src) as f:
+            text = io.TextIOWrapper(f, encoding=self.encoding, newline="")
+            try:
+                yield text
+            finally:
+                text.detach()
+
+    def chunks(self, columns=None):
+        """Lists of row tuples, header row first. columns: 0-based indexes to read (Parquet only reads
+        those, CSV rows are split whole); rows then hold just those values, in that order."""
+        if self.kind == ".parquet":
+            names = [self.names[c] for c in columns] if columns is not None else self.names
+            yield [tuple(names)]
+            for batch in self.parquet.iter_batches(batch_size=TABLE_CHUNK_ROWS, columns=names):
+                yield list(zip(*(column.to_pylist() for column in batch.columns)))
+            return
+        with self._text() as f:
+            rows = []
+            for row in csv.reader(f, delimiter=self.delimiter):
+                rows.append(tuple(row[c] if c < len(row) else "" for c in columns) if columns is not None else tuple(row))
+                if len(rows) == TABLE_CHUNK_ROWS:
+                    yield rows
+                    rows = []
+            if rows:
+                yield rows
+
+    def sample(self, sample_rows):
+        """First sample_rows rows for header scoring; for Parquet just the column names."""
+        if self.kind == ".parquet":
+            return [tuple(self.names)]
+        sample = []
+        for rows in self.chunks():
+            sample.extend(rows[:sample_rows - len(sample)])
+            if len(sample) == sample_rows:
+                break
+        return sample
+
+
+# CSV fields written as numbers: plain decimals up to 11 integer digits (what Excel's General format shows
+# without switching to 1.2E+11). Leading zeros (SWIS codes, ZIPs), thousands separators, decimal commas and
+# longer IDs stay text.
+_CSV_NUMBER = re.compile(r"-?(?:0|[1-9]\d{0,10})(\.\d+)?")
+
+
+def _xlsx_value(value, numbers=False):
+    """A table cell as a value openpyxl can write: text without control characters (empty CSV fields
+    stay blank cells); timezone-aware datetimes, lists, bytes and other Arrow types as text.
+    numbers: text that is a plain number (_CSV_NUMBER) becomes an int or float, so CSV amounts sum and sort."""
+    if isinstance(value, str):
+        if numbers:
+            number = _CSV_NUMBER.fullmatch(value.strip())
+            if number:
+                return float(number.group(0)) if number.group(1) else int(number.group(0))
+        return ILLEGAL_CHARACTERS_RE.sub("", value) or None
+    if value is None or isinstance(value, (int, float, Decimal)):
+        return value
+    if hasattr(value, "isoformat") and getattr(value, "tzinfo", None) is None:
+        return value
+    return ILLEGAL_CHARACTERS_RE.sub("", str(value))
+
+
+def _write_table_xlsx(table, header_row, mask, output_path, title, parcel_col=None):
+    """Highlighted copy of a table as a one-sheet workbook in write-only mode (rows go straight to disk).
+    Numeric CSV fields under the header are written as numbers, except in parcel_col (parcel ids stay text)."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title=re.sub(r"[\[\]:*?/\\]", "_", title)[:31] or "Sheet1")
+    # one styled cell; highlighted cells share its style array instead of assigning the fill each time
+    yellow = WriteOnlyCell(ws)
+    yellow.fill = YELLOW_FILL
+    first_data = header_row + 1
+    row_number = 0
+    csv_numbers = table.kind == ".csv"
+    for rows in table.chunks():
+        for row in rows:
+            i = row_number - first_data
+            values = [_xlsx_value(value, csv_numbers and i >= 0 and c != parcel_col) for c, value in enumerate(row)]
+            if 0 <= i < len(mask) and mask[i]:
+                cells = []
+                for value in values:
+                    cell = WriteOnlyCell(ws, value=value)
+                    cell._style = yellow._style
+                    cells.append(cell)
+                ws.append(cells)
+            else:
+                ws.append(values)
+            row_number += 1
+    wb.save(output_path)
+
+
+def _write_table_same(table, header_row, mask, width, output_path):
+    """Copy of the table in its own format with HIGHLIGHT_COLUMN appended: true on highlighted rows."""
+    first_data = header_row + 1
+    if table.kind == ".parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        name = HIGHLIGHT_COLUMN
+        while name in table.names:
+            name += "_"
+        schema = table.parquet.schema_arrow.append(pa.field(name, pa.bool_()))
+        start = 0
+        with pq.ParquetWriter(output_path, schema) as writer:
+            for batch in table.parquet.iter_batches(batch_size=TABLE_CHUNK_ROWS):
+                flags = np.zeros(batch.num_rows, dtype=bool)
+                part = mask[start:start + batch.num_rows]
+                flags[:len(part)] = part
+                writer.write_table(pa.Table.from_batches([batch]).append_column(name, pa.array(flags)))
+                start += batch.num_rows
+        return
+    with open(output_path, "w", encoding=table.encoding, newline="") as out:
+        writer = csv.writer(out, delimiter=table.delimiter)
+        row_number = 0
+        for rows in table.chunks():
+            for row in rows:
+                i = row_number - first_data
+                if i < 0:
+                    flag = HIGHLIGHT_COLUMN if i == -1 else ""
+                else:
+                    flag = "TRUE" if i < len(mask) and mask[i] else "FALSE"
+                writer.writerow(row + ("",) * (width - len(row)) + (flag,))
+                row_number += 1
+
+
+def process_table_file(src, original_filename, meta=None, header_sample_rows=None, output_format="xlsx",
+                       output_path=None, columns=None, verify=False, progress=None):
+    """process_excel_file for .csv / .parquet exports. Two streaming passes of TABLE_CHUNK_ROWS rows:
+    the first reads only the parcel / notes columns into _ChunkedMask (one byte per row), the second
+    writes the output. Header row and columns are resolved as for a worksheet (score_header_rows,
+    _ColumnResolver); Parquet's header is its column names. output_format: "xlsx" (one highlighted sheet,
+    openpyxl write-only) or "same" (input format plus HIGHLIGHT_COLUMN). meta gets the same keys as
+    process_excel_file, writer "table". Returns (output_path, output_filename, highlighted, data rows, bytes)."""
+    if output_format not in TABLE_OUTPUTS:
+        raise ValueError(f"Unknown output format: {output_format}. Use one of: {', '.join(TABLE_OUTPUTS)}.")
+    progress = progress or (lambda stage, fraction: None)
+    spans = _Spans(meta.setdefault("stages", {}) if meta is not None else None)
+    resolver = _ColumnResolver(columns)
+    progress("read", 0.05)
+    t0 = time.perf_counter()
+    table = _TableFile(src, original_filename)
+    sample_rows = header_sample_rows or HEADER_SAMPLE_ROWS
+    sample = table.sample(sample_rows)
+    if table.kind == ".parquet":
+        header_row, header_info = 0, {"header_row": 1, "reason": "Parquet column names"}
+    else:
+        # the header needs at least one data row under it
+        header_row, header_info = score_header_rows(sample if len(sample) == sample_rows else sample[:-1])
+    resolved = resolver.for_header(sample, header_row)
+    if resolved is None:
+        raise resolver.error
+    parcel_col, notes_col = resolved
+    width = max(map(len, sample), default=0)
+    header_info["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    header_info["columns"] = {"parcel": get_column_letter(parcel_col + 1), "notes": get_column_letter(notes_col + 1)}
+    spans.add("detect", header_info["ms"])
+
+    t1 = time.perf_counter()
+    runs = _ChunkedMask()
+    dep_parcels = set()
+    row_number = data_rows = 0
+    if table.kind == ".parquet":
+        if len(table.names) <= max(parcel_col, notes_col):
+            raise ValueError(f"{_too_few_columns(parcel_col, notes_col)} Found {len(table.names)} columns.")
+        width = len(table.names)
+        chunks = table.chunks([parcel_col, notes_col])
+        cols = (0, 1)
+    else:
+        chunks = table.chunks()
+        cols = resolved
+    for rows in chunks:
+        data = rows[max(0, header_row + 1 - row_number):]
+        row_number += len(rows)
+        if not data:
+            continue
+        parcels, dep_flags = _sample_columns(data, cols)
+        runs.add(parcels, dep_flags)
+        dep_parcels |= _dep_parcels(parcels, dep_flags)
+        if table.kind == ".parquet":
+            data_rows = len(runs.mask)
+            continue
+        # like a worksheet, trailing blank lines are not data rows
+        width = max(width, max(map(len, data)))
+        filled = [i for i, row in enumerate(data) if any(v.strip() for v in row)]
+        if filled:
+            data_rows = len(runs.mask) - len(data) + filled[-1] + 1
+    if data_rows == 0:
+        raise ValueError("The file has no data rows.")
+    if width <= max(parcel_col, notes_col):
+        raise ValueError(_too_few_columns(parcel_col, notes_col))
+    mask = runs.result(data_rows)
+    highlighted = int(mask.sum())
+    spans.add("parse", (time.perf_counter() - t1) * 1000)
+    if meta is not None:
+        meta.update(header_row=header_info["header_row"], header_reason=header_info["reason"],
+                    header_detect_ms=header_info["ms"], writer="table", dep_parcels=dep_parcels)
+        meta["sheets"] = [{
+            "sheet": original_filename, "rows": data_rows, "highlighted": highlighted,
+            "header_row": header_info["header_row"], "header_reason": header_info["reason"],
+            "columns": header_info["columns"], "ms": round((time.perf_counter() - t0) * 1000, 1),
+        }]
+        if verify:
+            meta["verify"] = {"skipped": "table input is written fresh, not cloned"}
+
+    output_filename = output_filename_for(original_filename, output_format)
+    if output_format == "xlsx" and row_number > XLSX_MAX_ROWS:
+        raise ValueError(f"{row_number:,} rows do not fit in one Excel sheet ({XLSX_MAX_ROWS:,} max). "
+                         f"Use output_format=same to get the table back with a {HIGHLIGHT_COLUMN} column.")
+    progress("write", 0.6)
+    owns_output = output_path is None
+    if owns_output:
+        fd, output_path = tempfile.mkstemp(prefix="dep_out_", suffix=Path(output_filename).suffix)
+        os.close(fd)
+    try:
+        with spans.span("write"):
+            if output_format == "xlsx":
+                _write_table_xlsx(table, header_row, mask, output_path, Path(original_filename).stem, parcel_col)
+            else:
+                _write_table_same(table, header_row, mask, width, output_path)
+        progress("done", 1.0)
+        if not owns_output:
+            return output_path, output_filename, highlighted, data_rows, os.path.getsize(output_path)
+        with open(output_path, "rb") as f:
+            out = io.BytesIO(f.read())
+        return out, output_filename, highlighted, data_rows, out.getbuffer().nbytes
+    finally:
+        if owns_output:
+            os.remove(output_path)
+
+
+# Startup warm-up: after a cold start (idle spin-down) the first upload would otherwise pay for lazy
+# imports, regex / openpyxl internals and the first zip writer; /health answers 503 until done
+# DEP_PREWARM: "1" warms in a background thread, "sync" blocks the importing process (gunicorn's
+# preloading master, so forked workers start warm), "0" turns it off
+PREWARM = os.environ.get("DEP_PREWARM", "1").lower()
+WARM_STATE = {"state": "cold"}   # cold -> warming -> ready (or failed)
+
+
+def warm_up():
+    """Run a tiny synthetic RDM workbook through process_excel_file (both writers) and
+    analyze_excel_file once. Returns the milliseconds it took."""
+    t0 = time.perf_counter()
+    wb = openpyxl.Workbook()
+    sheet = wb.active
+    sheet.append(["Tax ID", "Bill ID", "Owner", "Parcel Number", "Address", "Amount", "Status", "Parcel Notes"])
+    for i in range(4):
+        sheet.append([i, f"B{i}", "Owner", "100-0000001", "1 Main St", 12.5, "Open", "DEP"])
+    buf = io.BytesIO()
+    wb.save(buf)
+    data = buf.getvalue()
+    for writer in WRITERS:
+        process_excel_file(data, "warm_up.xlsx", writer=writer)
+    analyze_excel_file(data, "warm_up.xlsx")
+    return round((time.perf_counter() - t0) * 1000, 1)
+
+
+def _warm_up_state():
+    WARM_STATE.update(state="warming", started=time.time(), pid=os.getpid())
+    try:
+        WARM_STATE.update(state="ready", ms=warm_up())
+        print(f"Warm-up done in {WARM_STATE['ms']} ms", flush=True)
+    except Exception as e:  # the server still works, just cold
+        WARM_STATE.update(state="failed", error=str(e))
+        print(f"Warm-up failed: {e}", file=sys.stderr, flush=True)
+
+
+def start_warm_up(background=None):
+    """Warm the processing path once per server process (DEP_PREWARM=0 turns it off).
+    In the background (the default unless DEP_PREWARM=sync) the worker accepts connections
+    meanwhile and /health reports "warming" (503) until it is done. Called by the server entry
+    points only, so the CLI, benchmark and tests never pay for it."""
+    if PREWARM in ("0", "false", "no", "off") or WARM_STATE["state"] != "cold":
+        return
+    WARM_STATE.update(state="warming", pid=os.getpid())
+    if background is None:
+        background = PREWARM != "sync"
+    if background:
+        threading.Thread(target=_warm_up_state, name="dep-warm-up", daemon=True).start()
+    else:
+        _warm_up_state()
+
+
+def after_fork():
+    """gunicorn post_fork hook: a warm-up thread does not survive fork, so a worker forked while
+    its parent was still warming would report "warming" forever. Restart it in the worker."""
+    if WARM_STATE["state"] == "warming" and WARM_STATE.get("pid") != os.getpid():
+        WARM_STATE.clear()
+        WARM_STATE["state"] = "cold"
+        start_warm_up(background=True)
+
+
+# Admission control: estimate a workbook's expanded size from its ZIP directory before parsing it, and
+# keep the requests of one server process inside a memory budget
+MEMORY_BUDGET_MB = int(os.environ.get("DEP_MEMORY_BUDGET_MB", "320"))     # per server process, 0 = off
+HEAVY_REQUEST_MB = int(os.environ.get("DEP_HEAVY_REQUEST_MB", "100"))     # estimates from here on are heavy
+MAX_HEAVY_REQUESTS = int(os.environ.get("DEP_MAX_HEAVY_REQUESTS", "1"))   # heavy requests at the same time
+ADMISSION_WAIT = float(os.environ.get("DEP_ADMISSION_WAIT", "20"))        # seconds a request may queue
+ADMISSION_MAX_QUEUE = int(os.environ.get("DEP_ADMISSION_MAX_QUEUE", "8"))
+# Peak RSS over the uncompressed part sizes, measured with benchmark.py: streaming reader + zip patch
+# ~1x the worksheet XML, pandas reader ~3x, openpyxl load_workbook + save ~10x of every worksheet;
+# the shared string table ~2x as Python strings; a chunked CSV / Parquet read stays near 20 MB (13 MB CSV)
+MEMORY_FACTORS = {"stream": 1.0, "pandas": 3.0, "openpyxl": 12.0, "shared_strings": 2.0, "table": 1.0}
+
+
+def estimate_memory_mb(src, reader="stream", writer="patch", sheets=None):
+    """Expected extra memory (MB) to process a workbook, from the uncompressed sizes in its ZIP
+    directory only (nothing is decompressed). writer=None for analysis only. Sheets read in
+    parallel are summed. Returns None for packages that cannot be sized; processing reports those.
+    .csv / .parquet paths are read in chunks: a small share of the file size (MEMORY_FACTORS["table"])."""
+    if isinstance(src, (str, os.PathLike)) and Path(src).suffix.lower() in TABLE_EXTENSIONS:
+        return round(os.path.getsize(src) * MEMORY_FACTORS["table"] / (1024 * 1024), 1)
+    try:
+        src = _excel_source(src)
+        if hasattr(src, "seek"):
+            src.seek(0)
+        with zipfile.ZipFile(src) as zf:
+            parts = _workbook_parts(zf)
+            sizes = {info.filename: info.file_size for info in zf.infolist()}
+    except Exception:
+        return None
+    names = [name for name, _ in parts["sheets"]]
+    sheet_sizes = [sizes.get(part, 0) for _, part in parts["sheets"]]
+    try:
+        indexes = resolve_sheets(names, sheets)
+    except ValueError:  # unknown sheet: processing reports it
+        indexes = range(len(names))
+    selected = sum(sheet_sizes[i] for i in indexes)
+    shared = sizes.get(parts["shared_strings"], 0) * MEMORY_FACTORS["shared_strings"]
+    need = selected * MEMORY_FACTORS[reader] + shared
+    if writer == "openpyxl":
+        need = max(need, sum(sheet_sizes) * MEMORY_FACTORS["openpyxl"] + shared)
+    return round(need / (1024 * 1024), 1)
+
+
+class AdmissionRejected(Exception):
+    """A request that does not fit the memory budget: status 413 (never fits) or 503 (busy, retry)."""
+
+    def __init__(self, message, status, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _Admission:
+    """Memory budget shared by the requests of one server process. A request reserves its estimate
+    for as long as it runs; while the budget (or the heavy-request slots) are taken it waits up to
+    ADMISSION_WAIT seconds in a bounded queue, then gets 503. An estimate over the whole budget is
+    refused at once with 413."""
+
+    def __init__(self, budget_mb, heavy_mb, max_heavy, wait, max_queue):
+        self.budget_mb = budget_mb
+        self.heavy_mb = heavy_mb
+        self.max_heavy = max_heavy
+        self.wait = wait
+        self.max_queue = max_queue
+        self.cond = threading.Condition()
+        self.in_use_mb = 0.0
+        self.heavy = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def _reject(self, message, status, retry_after=None):
+        self.rejected += 1
+        raise AdmissionRejected(message, status, retry_after)
+
+    @contextlib.contextmanager
+    def reserve(self, need_mb):
+        if not self.budget_mb or need_mb is None:
+            yield
+            return
+        heavy = need_mb >= self.heavy_mb
+        with self.cond:
+            if need_mb > self.budget_mb:
+                self._reject(f"Workbook too large for this server: needs about {need_mb:.0f} MB of memory, "
+                             f"the limit is {self.budget_mb} MB. Split the file or use fewer sheets.", 413)
+
+            def fits():
+                return self.in_use_mb + need_mb <= self.budget_mb and not (heavy and self.heavy >= self.max_heavy)
+
+            if not fits():
+                if self.queued >= self.max_queue:
+                    self._reject("Server busy with other large files. Try again shortly.", 503, 5)
+                self.queued += 1
+                try:
+                    if not self.cond.wait_for(fits, timeout=self.wait):
+                        self._reject("Server busy with other large files. Try again shortly.", 503, 10)
+                finally:
+                    self.queued -= 1
+            self.in_use_mb += need_mb
+            self.heavy += heavy
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.in_use_mb -= need_mb
+                self.heavy -= heavy
+                self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {"budget_mb": self.budget_mb, "in_use_mb": round(self.in_use_mb, 1), "heavy": self.heavy,
+                    "queued": self.queued, "rejected": self.rejected}
+
+
+ADMISSION = _Admission(MEMORY_BUDGET_MB, HEAVY_REQUEST_MB, MAX_HEAVY_REQUESTS, ADMISSION_WAIT, ADMISSION_MAX_QUEUE)
+
+
+# Async jobs: state lives in JOBS_DIR/<job id>/status.json so any gunicorn worker can answer
+JOBS_DIR = Path(os.environ.get("DEP_JOBS_DIR", os.path.join(tempfile.gettempdir(), "dep_jobs")))
+JOB_WORKERS = int(os.environ.get("DEP_JOB_WORKERS", str(min(2, os.cpu_count() or 1))))
+JOB_MAX_PENDING = int(os.environ.get("DEP_JOB_MAX_PENDING", "8"))        # queued jobs beyond busy workers
+JOB_MAX_FILE_SIZE = int(os.environ.get("DEP_JOB_MAX_FILE_MB", "200")) * 1024 * 1024
+JOB_MAX_SECONDS = int(os.environ.get("DEP_JOB_MAX_SECONDS", "900"))
+# Address-space cap per pool worker (RLIMIT_AS), 0 = none. It has to trip before the kernel OOM killer, so the
+# default is what the instance has left after one warmed web worker (~80 MB) at 80% headroom, from
+# DEP_SERVER_MEMORY_MB (gunicorn.conf.py exports the memory it planned for); 1024 when that is unknown.
+SERVER_MEMORY_MB = int(os.environ.get("DEP_SERVER_MEMORY_MB") or 0)
+_JOB_MEMORY_DEFAULT = max(256, int(SERVER_MEMORY_MB * 0.8) - 80) if SERVER_MEMORY_MB else 1024
+JOB_MAX_MEMORY_MB = int(os.environ.get("DEP_JOB_MAX_MEMORY_MB", str(_JOB_MEMORY_DEFAULT)))
+JOB_RESULT_TTL = int(os.environ.get("DEP_JOB_RESULT_TTL", "3600"))       # seconds a finished job is kept
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+_job_pool = None
+_job_pool_lock = threading.Lock()
+
+
+def _job_dir(job_id):
+    return JOBS_DIR / job_id if _JOB_ID.fullmatch(job_id or "") else None
+
+
+def _read_job(job_dir):
+    try:
+        with open(job_dir / "status.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_job(job_dir, **fields):
+    """Merge fields into status.json (atomic replace, so readers never see a partial file)."""
+    status = _read_job(job_dir) or {}
+    status.update(fields)
+    tmp = job_dir / f"status.{uuid.uuid4().hex}.tmp"  # unique per write: gthread workers share a pid
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(status, f)
+    os.replace(tmp, job_dir / "status.json")
+    return status
+
+
+def _job_worker_init():
+    """Pool worker setup: cap the address space so one huge workbook cannot take the instance down."""
+    if JOB_MAX_MEMORY_MB > 0:
+        try:
+            import resource
+            limit = JOB_MAX_MEMORY_MB * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError) as e:
+            print(f"Job memory limit not applied: {e}", file=sys.stderr, flush=True)
+
+
+def _job_timeout(signum, frame):
+    raise TimeoutError(f"Job exceeded {JOB_MAX_SECONDS} s")
+
+
+def _job_memory_error(input_path, sheets=None):
+    """Message when a job / batch file is estimated above DEP_JOB_MAX_MEMORY_MB, else None.
+    The worker would only hit its address-space cap part way through."""
+    need_mb = estimate_memory_mb(input_path, sheets=sheets)
+    if JOB_MAX_MEMORY_MB and need_mb is not None and need_mb > JOB_MAX_MEMORY_MB:
+        return (f"Workbook too large for this server: needs about {need_mb:.0f} MB of memory, "
+                f"the limit is {JOB_MAX_MEMORY_MB} MB. Split the file or use fewer sheets.")
+    return None
+
+
+@contextlib.contextmanager
+def _job_time_limit():
+    """In a pool worker: TimeoutError in the running job once it has taken JOB_MAX_SECONDS (SIGALRM)."""
+    use_alarm = JOB_MAX_SECONDS > 0 and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _job_timeout)
+        signal.alarm(JOB_MAX_SECONDS)
+    try:
+        yield
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+
+
+def _run_job(job_dir, input_path, original_filename, options):
+    """Runs in a pool worker: process the spooled upload, write the result next to it."""
+    job_dir = Path(job_dir)
+    if (_read_job(job_dir) or {}).get("status") != "queued":  # expired by _sweep_jobs while it waited
+        _remove_files(input_path)
+        return
+    _write_job(job_dir, status="running", stage="read", progress=0.0, started=time.time())
+    try:
+        meta = {}
+        with _job_time_limit():
+            _, output_filename, highlighted, total_rows, size = process_excel_file(
+                input_path, original_filename, meta=meta, output_path=str(job_dir / "output"),
+                progress=lambda stage, fraction: _write_job(job_dir, stage=stage, progress=fraction),
+                **options,
+            )
+        _write_job(
+            job_dir, status="done", stage="done", progress=1.0, finished=time.time(),
+            output_filename=output_filename, highlighted=highlighted, rows=total_rows, output_bytes=size,
+            header_row=meta.get("header_row"), header_reason=meta.get("header_reason"), stages=meta.get("stages"),
+            sheets=meta.get("sheets"),
+        )
+    except MemoryError:
+        _write_job(job_dir, status="failed", finished=time.time(),
+                   error=f"File too large for processing (job memory limit {JOB_MAX_MEMORY_MB} MB)")
+    except Exception as e:
+        _write_job(job_dir, status="failed", finished=time.time(), error=str(e) or type(e).__name__)
+    finally:
+        try:
+            os.remove(input_path)
+        except OSError:
+            pass
+
+
+def _get_job_pool():
+    """Process pool shared by the job API, created on first use (never in a pre-fork parent)."""
+    global _job_pool
+    with _job_pool_lock:
+        if _job_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _job_pool = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=ctx, initializer=_job_worker_init)
+        return _job_pool
+
+
+def _discard_job_pool(pool):
+    """Forget a broken pool (a worker died) so the next _get_job_pool() starts a fresh one."""
+    global _job_pool
+    with _job_pool_lock:
+        if _job_pool is pool:
+            _job_pool = None
+    pool.shutdown(wait=False)
+
 
-# Fixed columns per spec: Column D = Parcel Number, Column H = Parcel Notes (no auto-detect)
-COL_D_PARCEL = 3   # 0-based index (Excel column D = 4th column)
-COL_H_NOTES = 7    # 0-based index (Excel column H = 8th column)
-MIN_COLUMNS = 8    # Need at least D and H
+def _submit_job(fn, *args):
+    """Submit fn(*args) to the job pool; returns (pool, future). A pool found broken at submit (a worker
+    died since it was last used) is replaced and the submit retried once."""
+    for attempt in range(2):
+        pool = _get_job_pool()
+        try:
+            return pool, pool.submit(fn, *args)
+        except BrokenProcessPool:
+            _discard_job_pool(pool)
+            if attempt:
+                raise
 
 
-def _parcel_val(val):
-    """Normalize parcel value for comparison."""
-    if val is None or (isinstance(val, float) and pd.isna(val)):
-        return ""
-    s = str(val).strip()
-    return "" if s.upper() == "NAN" else s
+def _job_finished(job_dir, future, pool):
+    """Pool callback: a worker that died (crash, OOM kill) cannot report, so record it here."""
+    exc = future.exception()
+    if exc is None:
+        return
+    _write_job(job_dir, status="failed", finished=time.time(), error=f"Worker failed: {exc}")
+    if isinstance(exc, BrokenProcessPool):
+        _discard_job_pool(pool)
 
 
-def _notes_has_dep(val):
-    """True if cell value contains the note 'DEP' (Parcel Notes column H)."""
-    if val is None or (isinstance(val, float) and pd.isna(val)):
+def _job_wait_limit(queued=True):
+    """Seconds a job may take before it counts as lost (None without JOB_MAX_SECONDS): JOB_MAX_SECONDS to
+    run plus, while queued, the time the jobs ahead of it may take; the worker's alarm fires at
+    JOB_MAX_SECONDS and still has to report, hence the grace."""
+    if JOB_MAX_SECONDS <= 0:
+        return None
+    waves = 1 + -(-JOB_MAX_PENDING // max(JOB_WORKERS, 1)) if queued else 1
+    return waves * JOB_MAX_SECONDS + 60
+
+
+def _job_expired(status, now):
+    """True when a queued or running job has outlived _job_wait_limit: its worker is gone (pool replaced,
+    gunicorn worker restarted) and nobody will update it."""
+    running = status.get("status") == "running"
+    limit = _job_wait_limit(queued=not running)
+    if limit is None:
         return False
-    return "DEP" in str(val).strip().upper()
+    since = (status.get("started") if running else None) or status.get("created") or now
+    return now - since > limit
 
 
-def highlight_logic(df):
-    """
-    Core logic (exact spec):
-    - Column D = Parcel Number (same value).
-    - Column H = Parcel Notes (must contain the note "DEP").
-    Highlight a row ONLY when BOTH are true:
-    (1) Two or more consecutive rows have the same value in column D, and
-    (2) Column H has the note DEP on those rows.
-    No values added; only highlight existing rows that meet both rules.
-    """
-    df = df.copy()
-    if df.shape[1] < MIN_COLUMNS:
-        raise ValueError(
-            f"Sheet must have at least 8 columns (Column D = Parcel Number, Column H = Parcel Notes). Found {df.shape[1]} columns."
-        )
-    parcel = df.iloc[:, COL_D_PARCEL].fillna("").astype(str).str.strip()
-    notes = df.iloc[:, COL_H_NOTES].fillna("").astype(str).str.strip().str.upper()
-    dep_mask = notes.str.contains("DEP", na=False)
+def _job_queue_full():
+    """429 response when JOB_WORKERS + JOB_MAX_PENDING jobs are queued or running (/jobs, /batch), else None."""
+    active = _sweep_jobs()
+    if active >= JOB_WORKERS + JOB_MAX_PENDING:
+        msg = f"Too many jobs in progress ({active}). Try again in a few minutes."
+        return jsonify({"error": msg, "details": msg}), 429
+    return None
 
-    # Find maximal runs: consecutive rows with same column D value and column H contains DEP (length >= 2)
-    runs = []
-    i = 0
-    while i < len(df):
-        if not dep_mask.iloc[i]:
-            i += 1
+
+def _sweep_jobs():
+    """Delete finished jobs older than JOB_RESULT_TTL, fail queued/running jobs that can no longer finish
+    (_job_expired) and return the number of queued/running jobs."""
+    active = 0
+    now = time.time()
+    if not JOBS_DIR.is_dir():
+        return 0
+    for job_dir in JOBS_DIR.iterdir():
+        status = _read_job(job_dir)
+        if status is None:
+            # half-created or foreign directory: clean it up once it is clearly stale
+            try:
+                if now - job_dir.stat().st_mtime > JOB_RESULT_TTL:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+            except OSError:
+                pass
             continue
-        p = _parcel_val(parcel.iloc[i])
-        if not p:
-            i += 1
+        if status.get("status") in ("queued", "running") and _job_expired(status, now):
+            _write_job(job_dir, status="failed", finished=now,
+                       error=f"Job was lost: no result after {int(now - status.get('created', now))} s")
             continue
-        j = i
-        while j < len(df) and dep_mask.iloc[j] and _parcel_val(parcel.iloc[j]) == p:
-            j += 1
-        if j - i >= 2:
-            runs.append((i, j - 1))
-        i = j
+        if status.get("status") in ("queued", "running"):
+            active += 1
+        elif now - (status.get("finished") or status.get("created") or now) > JOB_RESULT_TTL:
+            shutil.rmtree(job_dir, ignore_errors=True)
+    return active
 
-    flags = [False] * len(df)
-    for start, end in runs:
-        for idx in range(start, end + 1):
-            flags[idx] = True
-    df["_highlight"] = flags
-    return df
 
+def _public_job(status):
+    keep = ("id", "status", "stage", "progress", "filename", "output_filename", "rows", "highlighted",
+            "output_bytes", "header_row", "header_reason", "error", "created", "started", "finished")
+    out = {k: status[k] for k in keep if k in status}
+    if status.get("finished"):
+        out["expires"] = status["finished"] + JOB_RESULT_TTL
+    return out
+
+
+# Result cache: highlighted output keyed by SHA-256 of the upload + processing options
+CACHE_DIR = Path(os.environ.get("DEP_CACHE_DIR", os.path.join(tempfile.gettempdir(), "dep_cache")))
+CACHE_MAX_BYTES = int(os.environ.get("DEP_CACHE_MAX_MB", "256")) * 1024 * 1024  # 0 disables the cache
+CACHE_VERSION = "3"  # bump when highlight or writer output (or the stored info) changes, so old entries are never served
+_cache_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_cache_lock = threading.Lock()
+
+
+def result_cache_key(upload_sha256, options):
+    """Hex SHA-256 over the upload's SHA-256 and the options that change the output."""
+    h = hashlib.sha256(upload_sha256.encode("ascii"))
+    h.update(json.dumps({"v": CACHE_VERSION, **options}, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def cache_get(key):
+    """(output path, info dict) for a cached result, or None. A hit refreshes the entry's LRU time."""
+    if CACHE_MAX_BYTES <= 0:
+        return None
+    out_path = CACHE_DIR / f"{key}.out"
+    try:
+        with open(CACHE_DIR / f"{key}.json", "r", encoding="utf-8") as f:
+            info = json.load(f)
+        os.utime(out_path)
+    except (OSError, ValueError):
+        with _cache_lock:
+            _cache_stats["misses"] += 1
+        return None
+    with _cache_lock:
+        _cache_stats["hits"] += 1
+    return out_path, info
 
-def process_excel_file(file_bytes, original_filename):
-    """Read with pandas, run highlight logic, build a NEW workbook from scratch with yellow fill.
-    Output is minimal valid xlsx so Excel on Mac and Windows opens it.
-    Supports NY RDM-style docs: header on row 6, Tax ID / Bill ID columns."""
-    file_ext = Path(original_filename).suffix.lower()
-    if file_ext == ".xls":
-        raise ValueError("Old .xls is not supported. Save as .xlsx or .xlsm.")
 
-    buf = io.BytesIO(file_bytes)
-    df = None
-    header_row_used = 0
-    for header_row in (0, 5, 4, 6, 3, 7):
+def cache_put(key, output_path, info):
+    """Copy a result file into the cache, then evict least recently used entries until the cache
+    fits CACHE_MAX_BYTES."""
+    try:
+        if CACHE_MAX_BYTES <= 0 or os.path.getsize(output_path) > CACHE_MAX_BYTES:
+            return
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # unique temp names: threads of one gthread worker share a pid and may store the same key at once
+        tmp_out, tmp_info = (CACHE_DIR / f"{key}.{uuid.uuid4().hex}.tmp" for _ in range(2))
         try:
-            buf.seek(0)
-            df_try = pd.read_excel(buf, engine="openpyxl", sheet_name=0, header=header_row)
-            if df_try is None or len(df_try) == 0:
-                continue
-            if df_try.shape[1] >= MIN_COLUMNS:
-                df = df_try
-                header_row_used = header_row
-                break
-        except Exception:
-            continue
-    if df is None:
+            shutil.copyfile(output_path, tmp_out)
+            with open(tmp_info, "w", encoding="utf-8") as f:
+                json.dump(info, f)
+            os.replace(tmp_out, CACHE_DIR / f"{key}.out")
+            os.replace(tmp_info, CACHE_DIR / f"{key}.json")
+        finally:
+            _remove_files(tmp_out, tmp_info)
+        with _cache_lock:
+            _cache_stats["stores"] += 1
+        _cache_evict()
+    except OSError as e:
+        print(f"Result cache store failed: {e}", file=sys.stderr, flush=True)
+
+
+def _cache_entries():
+    """[(mtime, size, key)] of complete cache entries, oldest first."""
+    entries = []
+    for out_path in CACHE_DIR.glob("*.out"):
         try:
-            buf.seek(0)
-            df = pd.read_excel(buf, engine="openpyxl", sheet_name=0)
-        except Exception as e:
-            raise ValueError(f"Cannot read Excel file. Is it a valid .xlsx or .xlsm? Details: {e}")
-        if df is None or len(df) == 0:
-            raise ValueError("The file has no data rows.")
-        if df.shape[1] < MIN_COLUMNS:
-            raise ValueError(
-                "Sheet must have at least 8 columns. Column D = Parcel Number, Column H = Parcel Notes."
-            )
+            st = out_path.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, out_path.stem))
+    return sorted(entries)
 
-    df_processed = highlight_logic(df)
-    rows_to_highlight = set()
-    for pandas_idx, row in df_processed.iterrows():
-        if row["_highlight"]:
-            rows_to_highlight.add(int(pandas_idx))
 
-    base_name = Path(original_filename).stem
-    extension = Path(original_filename).suffix
-    output_filename = f"{base_name}_Highlighted{extension}"
+def _cache_evict():
+    entries = _cache_entries()
+    total = sum(size for _, size, _ in entries)
+    for _, size, key in entries:
+        if total <= CACHE_MAX_BYTES:
+            break
+        for suffix in (".json", ".out"):
+            try:
+                os.remove(CACHE_DIR / f"{key}{suffix}")
+            except OSError:
+                pass
+        total -= size
+        with _cache_lock:
+            _cache_stats["evictions"] += 1
 
-    # CLONE ONLY: Load original workbook, apply yellow fill ONLY to highlighted rows.
-    # No rebuild. 100% preservation of VBA macros, hidden/visible code, all sheets, metadata.
-    # All submitted files have exactly Column D = Parcel Number, Column H = Parcel Notes.
-    try:
-        buf.seek(0)
-        wb = openpyxl.load_workbook(buf, keep_vba=(file_ext == ".xlsm"), data_only=False)
-        sheet = wb.worksheets[0]
-        # pandas index i -> Excel row (1-based): header at row header_row_used+1, data starts header_row_used+2
-        for pandas_idx in rows_to_highlight:
-            excel_row = header_row_used + 2 + int(pandas_idx)
-            if 1 <= excel_row <= sheet.max_row:
-                for col in range(1, sheet.max_column + 1):
-                    sheet.cell(excel_row, col).fill = YELLOW_FILL
-        tmp = None
+
+def cache_stats():
+    """Hit/miss counters (this worker process) plus entry count and size on disk."""
+    entries = _cache_entries() if CACHE_DIR.is_dir() else []
+    with _cache_lock:
+        stats = dict(_cache_stats)
+    stats.update(entries=len(entries), bytes=sum(size for _, size, _ in entries), max_bytes=CACHE_MAX_BYTES)
+    return stats
+
+
+# Parcel index: DEP parcels of every processed upload in SQLite, so a new export can report which of its
+# DEP parcels were already DEP in earlier files without rescanning them. Shared by all workers on the host.
+PARCEL_INDEX_PATH = os.environ.get("DEP_PARCEL_INDEX", os.path.join(tempfile.gettempdir(), "dep_parcels.sqlite3"))
+PARCEL_INDEX_MAX_FILES = int(os.environ.get("DEP_PARCEL_INDEX_MAX_FILES", "1000"))  # oldest files are dropped
+REPEAT_HEADER_BYTES = 4000  # X-DEP-Repeat-DEP lists parcels up to about this size; the count is always complete
+
+
+class _ParcelIndex:
+    """SQLite index of the DEP parcels per upload (files identified by content SHA-256).
+    dep_parcels has primary key (parcel, file_id) WITHOUT ROWID, so a parcel lookup is one index range.
+    Uploads are added in one transaction with executemany over the parcels in key order."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, sha256 TEXT NOT NULL UNIQUE, filename TEXT,
+                                          processed REAL, dep_parcels INTEGER);
+        CREATE TABLE IF NOT EXISTS dep_parcels (parcel TEXT NOT NULL, file_id INTEGER NOT NULL,
+                                                PRIMARY KEY (parcel, file_id)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS dep_parcels_file ON dep_parcels (file_id);
+    """
+
+    def __init__(self, path, max_files):
+        self.path = path
+        self.max_files = max_files
+        self.created = False
+
+    @property
+    def enabled(self):
+        return bool(self.path) and self.path.lower() not in ("0", "off", "none")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")  # readers never wait for an ingest
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self.created:
+            conn.executescript(self.SCHEMA)
+            self.created = True
+        return conn
+
+    @staticmethod
+    def _group(rows):
+        """[(parcel, filename, processed)] ordered by parcel -> [{parcel, files: [{filename, processed}]}]."""
+        seen = []
+        for parcel, filename, processed in rows:
+            if not seen or seen[-1]["parcel"] != parcel:
+                seen.append({"parcel": parcel, "files": []})
+            seen[-1]["files"].append({"filename": filename, "processed": processed})
+        return seen
+
+    def record(self, sha256, filename, parcels):
+        """Add an upload's DEP parcels (once per file content; a repeat upload keeps its first entry) and
+        return the ones that were DEP in earlier files: [{parcel, files: [{filename, processed}]}]."""
+        conn = self._connect()
         try:
-            fd, tmp = tempfile.mkstemp(suffix=extension)
-            os.close(fd)
-            wb.save(tmp)
-            with open(tmp, "rb") as f:
-                output_bytes = f.read()
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT id FROM files WHERE sha256 = ?", (sha256,)).fetchone()
+            if row:
+                file_id = row[0]
+            else:
+                file_id = conn.execute(
+                    "INSERT INTO files (sha256, filename, processed, dep_parcels) VALUES (?, ?, ?, ?)",
+                    (sha256, filename, time.time(), len(parcels)),
+                ).lastrowid
+                conn.executemany("INSERT OR IGNORE INTO dep_parcels (parcel, file_id) VALUES (?, ?)",
+                                 ((parcel, file_id) for parcel in sorted(parcels)))
+                if self.max_files > 0 and file_id > self.max_files:
+                    conn.execute("DELETE FROM dep_parcels WHERE file_id <= ?", (file_id - self.max_files,))
+                    conn.execute("DELETE FROM files WHERE id <= ?", (file_id - self.max_files,))
+            rows = conn.execute(
+                "SELECT d.parcel, f.filename, f.processed FROM dep_parcels d "
+                "JOIN dep_parcels e ON e.parcel = d.parcel AND e.file_id < d.file_id "
+                "JOIN files f ON f.id = e.file_id WHERE d.file_id = ? ORDER BY d.parcel, f.id",
+                (file_id,),
+            ).fetchall()
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
         finally:
-            if tmp and os.path.exists(tmp):
-                try:
-                    os.unlink(tmp)
-                except OSError:
-                    pass
+            conn.close()
+        return self._group(rows)
+
+    def lookup(self, parcels):
+        """Files in which each of parcels was DEP, without adding anything (same shape as record)."""
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TEMP TABLE wanted (parcel TEXT PRIMARY KEY) WITHOUT ROWID")
+            conn.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((p,) for p in sorted(parcels)))
+            rows = conn.execute(
+                "SELECT d.parcel, f.filename, f.processed FROM wanted w JOIN dep_parcels d ON d.parcel = w.parcel "
+                "JOIN files f ON f.id = d.file_id ORDER BY d.parcel, f.id"
+            ).fetchall()
+        finally:
+            conn.close()
+        return self._group(rows)
+
+    def stats(self):
+        if not self.enabled or not os.path.exists(self.path):
+            return {"enabled": self.enabled, "files": 0, "parcels": 0}
+        try:
+            conn = self._connect()
+            try:
+                files, = conn.execute("SELECT count(*) FROM files").fetchone()
+                parcels, = conn.execute("SELECT count(*) FROM dep_parcels").fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            return {"enabled": True, "error": str(e)}
+        return {"enabled": True, "files": files, "parcels": parcels, "bytes": os.path.getsize(self.path)}
+
+
+PARCEL_INDEX = _ParcelIndex(PARCEL_INDEX_PATH, PARCEL_INDEX_MAX_FILES)
+
+
+def repeat_header(seen):
+    """X-DEP-Repeat-DEP value: {"count", "parcels": [{parcel, files: [filename]}]} as ASCII JSON, the list
+    cut to about REPEAT_HEADER_BYTES."""
+    shown = []
+    size = 0
+    for entry in seen:
+        item = {"parcel": entry["parcel"], "files": [f["filename"] for f in entry["files"]]}
+        size += len(json.dumps(item, separators=(",", ":")))
+        if size > REPEAT_HEADER_BYTES:
+            break
+        shown.append(item)
+    return json.dumps({"count": len(seen), "parcels": shown}, separators=(",", ":"))
+
+
+def _index_upload(meta, sha256, filename):
+    """Record the upload's DEP parcels in PARCEL_INDEX (own "index" stage) and put the parcels already
+    DEP in earlier files into meta["repeat_dep"]. An index failure is logged, never fails the request."""
+    if not PARCEL_INDEX.enabled:
+        return
+    try:
+        with _Spans(meta["stages"]).span("index"):
+            meta["repeat_dep"] = PARCEL_INDEX.record(sha256, filename, meta.get("dep_parcels") or ())
+    except sqlite3.Error as e:
+        print(f"Parcel index not updated: {e}", file=sys.stderr, flush=True)
+
+
+# Batch: many workbooks per request, fanned out over the job process pool
+BATCH_MAX_FILES = int(os.environ.get("DEP_BATCH_MAX_FILES", "50"))
+BATCH_MAX_BYTES = int(os.environ.get("DEP_BATCH_MAX_MB", "200")) * 1024 * 1024  # all inputs together
+
+
+def _run_batch_item(input_path, output_path, original_filename, options):
+    """Runs in a pool worker: one workbook of a batch. Never raises; errors go in the manifest entry."""
+    t0 = time.perf_counter()
+    entry = {"file": original_filename, "input_bytes": os.path.getsize(input_path)}
+    try:
+        memory_error = _job_memory_error(input_path, options.get("sheets"))
+        if memory_error:
+            raise ValueError(memory_error)
+        meta = {}
+        with _job_time_limit():
+            _, output_filename, highlighted, total_rows, size = process_excel_file(
+                input_path, original_filename, meta=meta, output_path=output_path, **options
+            )
+        entry.update(status="ok", output=output_filename, rows=total_rows, highlighted=highlighted,
+                     output_bytes=size, header_row=meta.get("header_row"), sheets=meta.get("sheets"),
+                     stages=meta.get("stages"))
+    except MemoryError:
+        entry.update(status="failed", error="File too large for processing")
     except Exception as e:
-        raise ValueError(
-            f"Cannot preserve workbook (VBA/macros/hidden code must be kept). Clone failed: {e}. "
-            "File must be valid .xlsx or .xlsm with at least 8 columns (Column D = Parcel Number, Column H = Parcel Notes)."
-        ) from e
+        entry.update(status="failed", error=str(e) or type(e).__name__)
+    entry["seconds"] = round(time.perf_counter() - t0, 3)
+    return entry
+
+
+def _batch_entries(items, options):
+    """Run _run_batch_item for each (name, input path, output path) in the job pool and yield
+    (item, manifest entry) in order. At most JOB_WORKERS items are in the pool at a time, so a large batch
+    never queues far ahead of /jobs. A worker that dies breaks the pool: it is replaced and the items
+    that were in it are retried once; an item that does not finish within _job_wait_limit fails."""
+    timeout = _job_wait_limit()
+    in_flight = []  # [(item, retried, pool, future or submit error)]
+
+    def submit(item, retried):
+        name, input_path, output_path = item
+        try:
+            pool, future = _submit_job(_run_batch_item, input_path, output_path, name, options)
+        except Exception as e:  # pool broken twice in a row, or shutting down
+            pool, future = None, e
+        in_flight.append((item, retried, pool, future))
+
+    pending = list(items)
+    pending.reverse()
+    while pending or in_flight:
+        while pending and len(in_flight) < max(JOB_WORKERS, 1):
+            submit(pending.pop(), False)
+        item, retried, pool, future = in_flight.pop(0)
+        try:
+            if isinstance(future, Exception):
+                raise future
+            entry = future.result(timeout=timeout)
+        except BrokenProcessPool as e:
+            if pool is not None:
+                _discard_job_pool(pool)
+            if not retried:
+                submit(item, True)
+                in_flight.insert(0, in_flight.pop())  # keep the manifest in upload order
+                continue
+            entry = {"file": item[0], "status": "failed", "error": f"Worker failed: {e}"}
+        except TimeoutError:
+            entry = {"file": item[0], "status": "failed", "error": f"No result after {timeout} s"}
+        except Exception as e:
+            entry = {"file": item[0], "status": "failed", "error": f"Worker failed: {e}"}
+        yield item, entry
 
-    return io.BytesIO(output_bytes), output_filename, len(rows_to_highlight), len(df), len(output_bytes)
+
+def _batch_inputs(files, work_dir):
+    """Spool uploaded workbooks (and the .xlsx/.xlsm members of uploaded .zip files) into work_dir.
+    Returns [(original name, path)]; raises ValueError when a limit is exceeded."""
+    inputs = []
+    total = 0
+
+    def add(name, stream):
+        nonlocal total
+        if len(inputs) >= BATCH_MAX_FILES:
+            raise ValueError(f"Too many files in batch. Max {BATCH_MAX_FILES}.")
+        path = os.path.join(work_dir, f"in_{len(inputs)}{Path(name).suffix.lower()}")
+        size, _ = _spool_upload(stream, path, min(MAX_FILE_SIZE, BATCH_MAX_BYTES - total))
+        if size > MAX_FILE_SIZE:
+            raise ValueError(f"{name}: file too large. Max {MAX_FILE_SIZE // (1024*1024)} MB per file.")
+        if total + size > BATCH_MAX_BYTES:
+            raise ValueError(f"Batch too large. Max {BATCH_MAX_BYTES // (1024*1024)} MB in total.")
+        total += size
+        inputs.append((name, path))
+
+    for file in files:
+        name = Path(file.filename or "").name
+        ext = Path(name).suffix.lower()
+        if ext == ".zip":
+            zip_path = os.path.join(work_dir, f"upload_{len(inputs)}.zip")
+            size, _ = _spool_upload(file.stream, zip_path, BATCH_MAX_BYTES - total)
+            if total + size > BATCH_MAX_BYTES:
+                os.remove(zip_path)
+                raise ValueError(f"Batch too large. Max {BATCH_MAX_BYTES // (1024*1024)} MB in total.")
+            try:
+                with zipfile.ZipFile(zip_path) as zf:
+                    for info in zf.infolist():
+                        member = Path(info.filename)
+                        if info.is_dir() or member.name.startswith((".", "~$")) or "__MACOSX" in member.parts:
+                            continue
+                        if member.suffix.lower() in (".xlsx", ".xlsm"):
+                            with zf.open(info) as stream:
+                                add(member.name, stream)
+            except zipfile.BadZipFile:
+                raise ValueError(f"{name} is not a valid ZIP file.")
+            finally:
+                os.remove(zip_path)
+        elif ext in (".xlsx", ".xlsm"):
+            add(name, file.stream)
+        else:
+            raise ValueError(f"{name}: invalid file type. Use .xlsx, .xlsm or a .zip of them.")
+    if not inputs:
+        raise ValueError("No .xlsx or .xlsm files in the batch.")
+    return inputs
 
 
 @app.errorhandler(500)
@@ -202,98 +2865,772 @@ def handle_exception(e):
     return jsonify({"error": msg, "details": msg}), 500
 
 
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response):
+    if "request_start" in g:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        METRICS["request"].observe(time.perf_counter() - g.request_start, endpoint=endpoint, status=response.status_code)
+    return response
+
+
+def _instrument(response, meta, filename, rows, highlighted, cache):
+    """Result headers (X-DEP-*, Server-Timing), /metrics histograms and one JSON log line for /process."""
+    stages = meta.get("stages", {})
+    total_ms = round((time.perf_counter() - g.request_start) * 1000, 1)
+    peak_rss = _peak_rss_mb()
+    response.headers["X-DEP-Header-Row"] = str(meta["header_row"])
+    response.headers["X-DEP-Header-Reason"] = meta["header_reason"]
+    response.headers["X-DEP-Rows"] = str(rows)
+    response.headers["X-DEP-Highlighted"] = str(highlighted)
+    response.headers["X-DEP-Cache"] = cache
+    if peak_rss is not None:
+        response.headers["X-DEP-Peak-RSS-MB"] = str(peak_rss)
+    if meta.get("memory_estimate_mb") is not None:
+        response.headers["X-DEP-Memory-Estimate-MB"] = str(meta["memory_estimate_mb"])
+    if meta.get("sheets"):
+        response.headers["X-DEP-Sheets"] = sheets_header(meta["sheets"])
+    if meta.get("verify"):
+        response.headers["X-DEP-Verify"] = "skipped" if "skipped" in meta["verify"] else "ok"
+    if "repeat_dep" in meta:
+        response.headers["X-DEP-Repeat-DEP"] = repeat_header(meta["repeat_dep"])
+    response.headers["Server-Timing"] = server_timing({**stages, "total": {"ms": total_ms}}, cache=cache)
+    for name, span in stages.items():
+        METRICS["stage"].observe(span["ms"] / 1000, stage=name)
+    if cache == "miss":
+        METRICS["rows"].observe(rows)
+    if peak_rss is not None:
+        METRICS["peak_rss"].observe(peak_rss)
+    log_event("process", file=filename, rows=rows, highlighted=highlighted, header_row=meta["header_row"],
+              writer=meta.get("writer"), cache=cache, total_ms=total_ms, peak_rss_mb=peak_rss,
+              memory_estimate_mb=meta.get("memory_estimate_mb"), verify=meta.get("verify"),
+              repeat_dep=len(meta["repeat_dep"]) if "repeat_dep" in meta else None, stages=stages)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text format. Counts are per server process (each gunicorn worker keeps its own)."""
+    lines = []
+    for histogram in METRICS.values():
+        lines += histogram.render()
+    peak_rss = _peak_rss_mb()
+    if peak_rss is not None:
+        lines += ["# HELP dep_process_peak_rss_bytes High-water RSS of this server process.",
+                  "# TYPE dep_process_peak_rss_bytes gauge",
+                  f"dep_process_peak_rss_bytes {int(peak_rss * 1024 * 1024)}"]
+    stats = cache_stats()
+    lines += ["# HELP dep_cache_requests_total Result cache lookups by outcome.",
+              "# TYPE dep_cache_requests_total counter",
+              f'dep_cache_requests_total{{result="hit"}} {stats["hits"]}',
+              f'dep_cache_requests_total{{result="miss"}} {stats["misses"]}']
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/health", methods=["GET"])
 def health_check():
+    if WARM_STATE["state"] == "warming":
+        return jsonify({"status": "warming", "service": "DEP Highlighter", "warm_up": WARM_STATE}), 503
     return jsonify({
         "status": "ok",
+        "warm_up": WARM_STATE,
         "service": "DEP Highlighter",
         "timestamp": datetime.now().isoformat(),
         "python_version": platform.python_version(),
         "openpyxl_installed": "openpyxl" in sys.modules,
         "temp_writable": os.access("/tmp", os.W_OK),
         "cwd": os.getcwd(),
+        "cache": cache_stats(),
+        "admission": ADMISSION.stats(),
+        "parcel_index": PARCEL_INDEX.stats(),
     })
 
 
+def _upload_name_error(file, tables=False):
+    """(json, status) error response when the upload is missing or not .xlsx/.xlsm (tables: also .csv/.parquet), else None."""
+    if file is None:
+        print("400: No file in request.files", flush=True)
+        return jsonify({"error": "No file provided", "details": "No file provided. The upload form did not include a file. Try selecting a file again and click Process."}), 400
+    return _filename_error(file.filename, tables)
+
+
+def _filename_error(filename, tables=False):
+    """(json, status) error response when filename is blank or not .xlsx/.xlsm (tables: also .csv/.parquet), else None."""
+    if filename == "" or not (filename or "").strip():
+        print("400: Empty filename", flush=True)
+        return jsonify({"error": "No file selected", "details": "No file selected. Please choose an Excel file (.xlsx or .xlsm) and try again."}), 400
+
+    file_ext = Path(filename).suffix.lower()
+    if tables and file_ext in TABLE_EXTENSIONS:
+        return None
+    if file_ext not in (".xlsx", ".xlsm", ".xls"):
+        print(f"400: Invalid file type: {file_ext}", flush=True)
+        msg = "Invalid file type. Use .xlsx, .xlsm, .csv or .parquet" if tables else "Invalid file type. Use .xlsx or .xlsm"
+        return jsonify({"error": msg, "details": msg}), 400
+    if file_ext == ".xls":
+        print("400: .xls not supported", flush=True)
+        return jsonify({"error": "Old .xls not supported. Save as .xlsx or .xlsm", "details": "Old .xls not supported. Save as .xlsx or .xlsm"}), 400
+    return None
+
+
+def _sheets_option(form):
+    """Form field sheets: empty -> None (first sheet), "all", or comma-separated names / 1-based numbers."""
+    value = (form.get("sheets") or "").strip()
+    if not value:
+        return None
+    if value.lower() == "all":
+        return "all"
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+VERIFY_OUTPUT = os.environ.get("DEP_VERIFY_OUTPUT", "0").lower() in ("1", "true", "yes", "on")
+
+
+def _verify_option(form):
+    """Form field verify ("1"/"true"/...) or DEP_VERIFY_OUTPUT: run verify_clone on /process output."""
+    value = (form.get("verify") or "").strip().lower()
+    return value in ("1", "true", "yes", "on") if value else VERIFY_OUTPUT
+
+
+def _output_format_option(form):
+    """Form field output_format for .csv / .parquet uploads: "xlsx" (default) or "same"; others raise ValueError."""
+    value = (form.get("output_format") or "xlsx").strip().lower()
+    if value not in TABLE_OUTPUTS:
+        raise ValueError(f"Unknown output format: {value}. Use one of: {', '.join(TABLE_OUTPUTS)}.")
+    return value
+
+
+def _rejected_response(e):
+    """413 / 503 JSON error for an AdmissionRejected, with Retry-After when the server is only busy."""
+    response = jsonify({"error": str(e), "details": str(e)})
+    response.status_code = e.status
+    if e.retry_after:
+        response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+def _columns_option(form):
+    """Form fields parcel_column / notes_column (parse_column_spec); blank -> DEFAULT_COLUMNS.
+    Invalid specs raise ValueError."""
+    columns = {role: (form.get(f"{role}_column") or "").strip() or DEFAULT_COLUMNS[role] for role in COLUMN_LABELS}
+    column_specs(columns)
+    return columns
+
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+
+def _spool_upload(stream, path, limit):
+    """Copy an upload stream to path in UPLOAD_CHUNK_SIZE chunks while hashing it.
+    Stops as soon as more than limit bytes arrived. Returns (bytes written, hex SHA-256)."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as f:
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    return size, digest.hexdigest()
+
+
+def _remove_files(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+                print(f"Cleaned up {path}", flush=True)
+            except OSError:
+                pass
+
+
+# Chunked uploads: UPLOADS_DIR/<upload id>/upload.json plus the spool file the chunks are appended to.
+# The offset is the spool file's size, so any gunicorn worker can take the next chunk and a client whose
+# connection dropped asks where to resume instead of starting over.
+UPLOADS_DIR = Path(os.environ.get("DEP_UPLOADS_DIR", os.path.join(tempfile.gettempdir(), "dep_uploads")))
+UPLOAD_TTL = int(os.environ.get("DEP_UPLOAD_TTL", "3600"))  # seconds an upload may sit without a new chunk
+UPLOAD_PART_SIZE = int(os.environ.get("DEP_UPLOAD_PART_MB", "2")) * 1024 * 1024  # chunk size offered to clients
+
+
+def _upload_dir(upload_id):
+    return UPLOADS_DIR / upload_id if _JOB_ID.fullmatch(upload_id or "") else None
+
+
+def _read_upload(upload_dir):
+    """upload.json plus "offset" (bytes received so far), or None for an unknown or expired upload."""
+    try:
+        with open(upload_dir / "upload.json", "r", encoding="utf-8") as f:
+            upload = json.load(f)
+        upload["offset"] = os.path.getsize(upload_dir / upload["spool"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return upload
+
+
+def _sweep_uploads():
+    """Delete uploads that have not received a chunk for UPLOAD_TTL seconds (abandoned or never finalized)."""
+    if not UPLOADS_DIR.is_dir():
+        return
+    now = time.time()
+    for upload_dir in UPLOADS_DIR.iterdir():
+        try:
+            last = max(p.stat().st_mtime for p in [upload_dir, *upload_dir.iterdir()])
+        except OSError:
+            continue
+        if now - last > UPLOAD_TTL:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def _upload_lock(f):
+    """Exclusive lock on an open spool file for one chunk or finalize, across gunicorn workers.
+    Raises BlockingIOError when another request holds it. No-op where fcntl is missing (Windows dev server)."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _append_chunk(stream, f, remaining):
+    """Append a request body to the spool file f in UPLOAD_CHUNK_SIZE reads. Whatever arrived before a
+    disconnect stays (the client resumes from there). Returns bytes written, or None when the body ran past
+    remaining, in which case the chunk is dropped again."""
+    start = f.tell()
+    written = 0
+    while True:
+        data = stream.read(UPLOAD_CHUNK_SIZE)
+        if not data:
+            return written
+        if written + len(data) > remaining:
+            f.flush()
+            f.truncate(start)
+            return None
+        f.write(data)
+        written += len(data)
+
+
+def _file_sha256(f):
+    digest = hashlib.sha256()
+    for data in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def _public_upload(upload_id, upload):
+    return {"upload_id": upload_id, "filename": upload["filename"], "size": upload["size"],
+            "offset": upload["offset"], "complete": upload["offset"] == upload["size"], "chunk_size": UPLOAD_PART_SIZE}
+
+
+def _unknown_upload(upload_id):
+    return jsonify({"error": "Unknown or expired upload", "details": f"No upload {upload_id}. Uploads expire {UPLOAD_TTL} s after the last chunk; start again."}), 404
+
+
+def _upload_busy(upload_id):
+    msg = f"Upload {upload_id} is being written or processed by another request."
+    return jsonify({"error": msg, "details": msg}), 409
+
+
 @app.route("/process", methods=["POST"])
 def process_file():
-    temp_path = None
+    # Upload is spooled to disk, processed from that path and the output streamed from disk,
+    # so the request never holds the workbook bytes in memory.
+    temp_paths = []
     try:
         print(f"[{datetime.now().isoformat()}] === Processing started ===", flush=True)
 
-        if "file" not in request.files:
-            print("400: No file in request.files", flush=True)
-            return jsonify({"error": "No file provided", "details": "No file provided. The upload form did not include a file. Try selecting a file again and click Process."}), 400
+        error = _upload_name_error(request.files.get("file"), tables=True)
+        if error:
+            return error
         file = request.files["file"]
-        if file.filename == "" or not (file.filename or "").strip():
-            print("400: Empty filename", flush=True)
-            return jsonify({"error": "No file selected", "details": "No file selected. Please choose an Excel file (.xlsx or .xlsm) and try again."}), 400
-
         file_ext = Path(file.filename).suffix.lower()
-        if file_ext not in (".xlsx", ".xlsm", ".xls"):
-            print(f"400: Invalid file type: {file_ext}", flush=True)
-            return jsonify({"error": "Invalid file type. Use .xlsx or .xlsm", "details": "Invalid file type. Use .xlsx or .xlsm"}), 400
-        if file_ext == ".xls":
-            print("400: .xls not supported", flush=True)
-            return jsonify({"error": "Old .xls not supported. Save as .xlsx or .xlsm", "details": "Old .xls not supported. Save as .xlsx or .xlsm"}), 400
-
-        file_bytes = file.read()
-        file_size = len(file_bytes)
+
+        fd, input_path = tempfile.mkstemp(prefix="dep_in_", suffix=file_ext)
+        os.close(fd)
+        temp_paths.append(input_path)
+        print(f"Saving to temp file: {input_path}", flush=True)
+        meta = {"stages": {}}
+        with _Spans(meta["stages"]).span("upload"):
+            file_size, upload_sha256 = _spool_upload(file.stream, input_path, MAX_FILE_SIZE)
         print(f"File received: {file.filename}, size: {file_size} bytes ({file_size / 1024 / 1024:.2f} MB)", flush=True)
+        return _process_spooled(input_path, file.filename, file_size, upload_sha256, meta, temp_paths)
+    except Exception as e:
+        return _process_error_response(e)
+    finally:
+        _remove_files(*temp_paths)
 
-        if not file_bytes or file_size < 100:
-            print(f"400: File too small: {file_size} bytes", flush=True)
-            return jsonify({"error": "File is empty or too small. Use a valid .xlsx or .xlsm file.", "details": "File is empty or too small (under 100 bytes). Use a valid .xlsx or .xlsm file."}), 400
 
-        if file_size > MAX_FILE_SIZE:
-            msg = f"File too large: {file_size / 1024 / 1024:.1f} MB. Max {MAX_FILE_SIZE // (1024*1024)} MB."
-            print(msg, file=sys.stderr, flush=True)
-            return jsonify({"error": msg, "details": msg}), 413
+def _process_spooled(input_path, filename, file_size, upload_sha256, meta, temp_paths):
+    """/process after the upload is on disk (also the end of a chunked upload): size checks, result cache,
+    admission, process_excel_file, parcel index, then the file response. request.form holds the options.
+    Temp files still in temp_paths are the caller's to remove; paths handed to the response are taken out."""
+    file_ext = Path(filename).suffix.lower()
+    if file_size < 100:
+        print(f"400: File too small: {file_size} bytes", flush=True)
+        return jsonify({"error": "File is empty or too small. Use a valid .xlsx or .xlsm file.", "details": "File is empty or too small (under 100 bytes). Use a valid .xlsx or .xlsm file."}), 400
 
-        # Optional temp save for Render diagnostics (per doc: "File system issues - temp file writes failing")
-        try:
-            safe_name = "".join(c if c.isalnum() or c in "._-" else "_" for c in file.filename)
-            temp_path = os.path.join(tempfile.gettempdir(), safe_name)
-            print(f"Saving to temp file: {temp_path}", flush=True)
-            with open(temp_path, "wb") as f:
-                f.write(file_bytes)
-            print(f"Saved to: {temp_path}", flush=True)
-        except Exception as te:
-            print(f"Temp save failed (continuing in-memory): {te}", file=sys.stderr, flush=True)
-
-        print("Loading workbook with openpyxl...", flush=True)
-        output_buffer, output_filename, highlighted_count, total_rows, content_length = process_excel_file(
-            file_bytes, file.filename
-        )
-        print(f"Processing complete. Rows: {total_rows}, highlighted: {highlighted_count}. Sending file: {output_filename}", flush=True)
+    if file_size > MAX_FILE_SIZE:
+        total = max(file_size, request.content_length or 0)
+        msg = f"File too large: {total / 1024 / 1024:.1f} MB. Max {MAX_FILE_SIZE // (1024*1024)} MB."
+        print(msg, file=sys.stderr, flush=True)
+        return jsonify({"error": msg, "details": msg}), 413
 
-        return send_file(
-            output_buffer,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    fill_mode = request.form.get("fill_mode", "cells")
+    sheets = _sheets_option(request.form)
+    columns = _columns_option(request.form)
+    output_format = _output_format_option(request.form)
+    verify = _verify_option(request.form)
+    options = {"ext": file_ext, "fill_mode": fill_mode, "sheets": sheets, "columns": columns, "verify": verify}
+    if file_ext in TABLE_EXTENSIONS:
+        options["output_format"] = output_format
+    cache_key = result_cache_key(upload_sha256, options)
+    cached = cache_get(cache_key)
+    if cached:
+        cached_path, info = cached
+        output_filename = output_filename_for(filename, output_format)
+        print(f"Cache hit {cache_key[:12]}: rows {info['rows']}, highlighted {info['highlighted']}. Sending file: {output_filename}", flush=True)
+        response = send_file(
+            str(cached_path),
+            mimetype=output_mimetype(output_filename),
             as_attachment=True,
             download_name=output_filename,
         )
-    except ValueError as ve:
-        print(f"ValueError: {ve}", file=sys.stderr, flush=True)
-        return jsonify({"error": str(ve), "details": str(ve)}), 400
-    except MemoryError as e:
+        meta.update(header_row=info["header_row"], header_reason=info["header_reason"], sheets=info.get("sheets"),
+                    verify=info.get("verify"), dep_parcels=set(info["dep_parcels"]))
+        _index_upload(meta, upload_sha256, filename)
+        _instrument(response, meta, filename, info["rows"], info["highlighted"], "hit")
+        return response
+
+    fd, output_path = tempfile.mkstemp(prefix="dep_out_", suffix=file_ext)
+    os.close(fd)
+    temp_paths.append(output_path)
+    meta["memory_estimate_mb"] = estimate_memory_mb(input_path, sheets=sheets)
+    t_admit = time.perf_counter()
+    with ADMISSION.reserve(meta["memory_estimate_mb"]):
+        _Spans(meta["stages"]).add("admit", (time.perf_counter() - t_admit) * 1000)
+        print(f"Processing (estimated {meta['memory_estimate_mb']} MB)...", flush=True)
+        _, output_filename, highlighted_count, total_rows, content_length = process_excel_file(
+            input_path, filename, meta=meta, fill_mode=fill_mode, output_path=output_path, sheets=sheets,
+            columns=columns, verify=verify, output_format=output_format,
+        )
+    print(f"Header row {meta['header_row']} ({meta['header_reason']}, {meta['header_detect_ms']} ms)", flush=True)
+    print(f"Processing complete. Rows: {total_rows}, highlighted: {highlighted_count}. Sending file: {output_filename}", flush=True)
+    _index_upload(meta, upload_sha256, filename)
+    cache_put(cache_key, output_path, {
+        "rows": total_rows,
+        "highlighted": highlighted_count,
+        "header_row": meta["header_row"],
+        "header_reason": meta["header_reason"],
+        "sheets": meta["sheets"],
+        "verify": meta.get("verify"),
+        # the parcel index may not know this file on a later hit (index deleted, rotated or enabled since)
+        "dep_parcels": sorted(meta.get("dep_parcels") or ()),
+    })
+
+    response = send_file(
+        output_path,
+        mimetype=output_mimetype(output_filename),
+        as_attachment=True,
+        download_name=output_filename,
+    )
+    _instrument(response, meta, filename, total_rows, highlighted_count, "miss")
+    # temp files go once the body has been sent; call_on_close only fires without passthrough
+    response.direct_passthrough = False
+    paths = list(temp_paths)
+    response.call_on_close(lambda: _remove_files(*paths))
+    temp_paths.clear()
+    return response
+
+
+def _process_error_response(e):
+    """Error response for an exception raised while processing an upload (/process, chunked finalize)."""
+    if isinstance(e, AdmissionRejected):
+        print(f"{e.status}: {e}", file=sys.stderr, flush=True)
+        return _rejected_response(e)
+    if isinstance(e, ValueError):
+        print(f"ValueError: {e}", file=sys.stderr, flush=True)
+        return jsonify({"error": str(e), "details": str(e)}), 400
+    if isinstance(e, MemoryError):
         error_msg = f"MEMORY ERROR: {e}"
         print(error_msg, file=sys.stderr, flush=True)
         return jsonify({"error": "File too large for processing", "details": error_msg}), 413
+    msg = str(e).strip() or "Processing failed"
+    if len(msg) > 400:
+        msg = msg[:397] + "..."
+    error_msg = f"ERROR: {e}\n{traceback.format_exc()}"
+    print(error_msg, file=sys.stderr, flush=True)
+    return jsonify({"error": msg, "details": msg}), 500
+
+
+@app.route("/uploads", methods=["POST"])
+def create_upload():
+    """Start a chunked upload (JSON or form fields filename, size). PUT the bytes to /uploads/<id>?offset=N
+    in chunks, then POST /uploads/<id>/finalize with the /process form options to get the highlighted file."""
+    fields = request.get_json(silent=True) or request.form
+    filename = str(fields.get("filename") or "")
+    error = _filename_error(filename, tables=True)
+    if error:
+        return error
+    try:
+        size = int(fields.get("size"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Missing file size", "details": "Send size: the file size in bytes."}), 400
+    if size < 100:
+        return jsonify({"error": "File is empty or too small. Use a valid .xlsx or .xlsm file.", "details": "File is empty or too small (under 100 bytes). Use a valid .xlsx or .xlsm file."}), 400
+    if size > MAX_FILE_SIZE:
+        msg = f"File too large: {size / 1024 / 1024:.1f} MB. Max {MAX_FILE_SIZE // (1024*1024)} MB."
+        return jsonify({"error": msg, "details": msg}), 413
+
+    _sweep_uploads()
+    upload_id = uuid.uuid4().hex
+    upload_dir = UPLOADS_DIR / upload_id
+    upload_dir.mkdir(parents=True)
+    upload = {"filename": filename, "size": size, "spool": "data" + Path(filename).suffix.lower(), "created": time.time()}
+    (upload_dir / upload["spool"]).touch()
+    with open(upload_dir / "upload.json", "w", encoding="utf-8") as f:
+        json.dump(upload, f)
+    print(f"Upload {upload_id} started: {filename}, {size} bytes", flush=True)
+    return jsonify({
+        **_public_upload(upload_id, {**upload, "offset": 0}),
+        "upload_url": f"/uploads/{upload_id}",
+        "finalize_url": f"/uploads/{upload_id}/finalize",
+    }), 201
+
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    """Offset to resume from after a dropped connection."""
+    upload_dir = _upload_dir(upload_id)
+    upload = _read_upload(upload_dir) if upload_dir else None
+    if upload is None:
+        return _unknown_upload(upload_id)
+    return jsonify(_public_upload(upload_id, upload))
+
+
+@app.route("/uploads/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    """Append the raw request body at ?offset=N. N must be the bytes received so far; otherwise 409 with the
+    server's offset, so a client that lost a response (or the middle of a chunk) continues from there."""
+    upload_dir = _upload_dir(upload_id)
+    upload = _read_upload(upload_dir) if upload_dir else None
+    if upload is None:
+        return _unknown_upload(upload_id)
+    try:
+        offset = int(request.args.get("offset", ""))
+    except ValueError:
+        return jsonify({"error": "Missing offset", "details": "PUT chunks to /uploads/<id>?offset=<bytes already sent>."}), 400
+
+    with open(upload_dir / upload["spool"], "ab") as f:
+        try:
+            with _upload_lock(f):
+                current = os.fstat(f.fileno()).st_size
+                if offset != current:
+                    msg = f"Expected offset {current}, got {offset}. Resume from {current}."
+                    return jsonify({"error": msg, "details": msg, "offset": current, "size": upload["size"]}), 409
+                remaining = upload["size"] - current
+                written = None
+                if (request.content_length or 0) <= remaining:
+                    written = _append_chunk(request.stream, f, remaining)
+        except BlockingIOError:
+            return _upload_busy(upload_id)
+    if written is None:
+        msg = f"Chunk runs past the declared size ({upload['size']} bytes). Resume from {current}."
+        return jsonify({"error": msg, "details": msg, "offset": current, "size": upload["size"]}), 400
+    upload["offset"] = current + written
+    return jsonify(_public_upload(upload_id, upload))
+
+
+@app.route("/uploads/<upload_id>", methods=["DELETE"])
+def cancel_upload(upload_id):
+    upload_dir = _upload_dir(upload_id)
+    if upload_dir is None or not upload_dir.is_dir():
+        return _unknown_upload(upload_id)
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    return jsonify({"upload_id": upload_id, "deleted": True})
+
+
+@app.route("/uploads/<upload_id>/finalize", methods=["POST"])
+def finalize_upload(upload_id):
+    """Process a complete chunked upload from its spool file, exactly like /process (same form options,
+    same response). The upload is kept only on 503 (server busy) so finalize can be retried without re-sending."""
+    upload_dir = _upload_dir(upload_id)
+    upload = _read_upload(upload_dir) if upload_dir else None
+    if upload is None:
+        return _unknown_upload(upload_id)
+    if upload["offset"] != upload["size"]:
+        msg = f"Upload incomplete: {upload['offset']} of {upload['size']} bytes received."
+        return jsonify({"error": msg, "details": msg, "offset": upload["offset"], "size": upload["size"]}), 409
+
+    print(f"[{datetime.now().isoformat()}] === Processing started (upload {upload_id}) ===", flush=True)
+    input_path = upload_dir / upload["spool"]
+    temp_paths = []
+    try:
+        with open(input_path, "rb") as f, _upload_lock(f):
+            meta = {"stages": {}}
+            with _Spans(meta["stages"]).span("hash"):
+                upload_sha256 = _file_sha256(f)
+            print(f"File received in chunks: {upload['filename']}, size: {upload['size']} bytes ({upload['size'] / 1024 / 1024:.2f} MB)", flush=True)
+            response = _process_spooled(str(input_path), upload["filename"], upload["size"], upload_sha256, meta, temp_paths)
+    except BlockingIOError:
+        return _upload_busy(upload_id)
     except Exception as e:
-        msg = str(e).strip() or "Processing failed"
-        if len(msg) > 400:
-            msg = msg[:397] + "..."
-        error_msg = f"ERROR: {e}\n{traceback.format_exc()}"
-        print(error_msg, file=sys.stderr, flush=True)
-        return jsonify({"error": msg, "details": msg}), 500
+        response = _process_error_response(e)
     finally:
-        if temp_path and os.path.exists(temp_path):
+        _remove_files(*temp_paths)
+    status = response[1] if isinstance(response, tuple) else response.status_code
+    if status != 503:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+    return response
+
+
+@app.route("/analyze", methods=["POST"])
+def analyze_file():
+    """Analysis only: highlighted rows, parcels and run lengths as JSON (or CSV with format=csv); no workbook is written."""
+    input_path = None
+    try:
+        error = _upload_name_error(request.files.get("file"))
+        if error:
+            return error
+        file = request.files["file"]
+        output_format = (request.form.get("format") or request.args.get("format") or "json").lower()
+        if output_format not in ("json", "csv"):
+            return jsonify({"error": f"Unknown format: {output_format}", "details": "Use format=json or format=csv."}), 400
+
+        fd, input_path = tempfile.mkstemp(prefix="dep_in_", suffix=Path(file.filename).suffix.lower())
+        os.close(fd)
+        meta = {"stages": {}}
+        with _Spans(meta["stages"]).span("upload"):
+            file_size, _ = _spool_upload(file.stream, input_path, MAX_FILE_SIZE)
+        if file_size < 100:
+            return jsonify({"error": "File is empty or too small. Use a valid .xlsx or .xlsm file.", "details": "File is empty or too small (under 100 bytes). Use a valid .xlsx or .xlsm file."}), 400
+        if file_size > MAX_FILE_SIZE:
+            msg = f"File too large: {max(file_size, request.content_length or 0) / 1024 / 1024:.1f} MB. Max {MAX_FILE_SIZE // (1024*1024)} MB."
+            return jsonify({"error": msg, "details": msg}), 413
+
+        with ADMISSION.reserve(estimate_memory_mb(input_path, writer=None)):
+            result = analyze_excel_file(input_path, file.filename, meta=meta, columns=_columns_option(request.form))
+        result["dep_parcels"] = len(meta["dep_parcels"])
+        if PARCEL_INDEX.enabled:  # a dry run only looks parcels up; /process adds them
             try:
-                os.remove(temp_path)
-                print(f"Cleaned up {temp_path}", flush=True)
-            except Exception:
-                pass
+                with _Spans(meta["stages"]).span("index"):
+                    result["seen_before"] = PARCEL_INDEX.lookup(meta["dep_parcels"])
+            except sqlite3.Error as e:
+                print(f"Parcel index lookup failed: {e}", file=sys.stderr, flush=True)
+        total_ms = round((time.perf_counter() - g.request_start) * 1000, 1)
+        for name, span in meta["stages"].items():
+            METRICS["stage"].observe(span["ms"] / 1000, stage=name)
+        log_event("analyze", file=file.filename, rows=result["rows"], highlighted=result["highlighted"],
+                  header_row=result["header_row"], runs=len(result["runs"]), total_ms=total_ms, stages=meta["stages"])
+        if output_format == "csv":
+            response = send_file(io.BytesIO(analysis_csv(result).encode("utf-8")), mimetype="text/csv",
+                                 as_attachment=True, download_name=f"{Path(file.filename).stem}_DEP_rows.csv")
+        else:
+            result["stages"] = meta["stages"]
+            response = jsonify(result)
+        response.headers["X-DEP-Header-Row"] = str(result["header_row"])
+        response.headers["X-DEP-Rows"] = str(result["rows"])
+        response.headers["X-DEP-Highlighted"] = str(result["highlighted"])
+        if "seen_before" in result:
+            response.headers["X-DEP-Repeat-DEP"] = repeat_header(result["seen_before"])
+        response.headers["Server-Timing"] = server_timing({**meta["stages"], "total": {"ms": total_ms}})
+        return response
+    except AdmissionRejected as e:
+        print(f"{e.status}: {e}", file=sys.stderr, flush=True)
+        return _rejected_response(e)
+    except ValueError as ve:
+        print(f"ValueError: {ve}", file=sys.stderr, flush=True)
+        return jsonify({"error": str(ve), "details": str(ve)}), 400
+    except MemoryError as e:
+        print(f"MEMORY ERROR: {e}", file=sys.stderr, flush=True)
+        return jsonify({"error": "File too large for processing", "details": f"MEMORY ERROR: {e}"}), 413
+    finally:
+        _remove_files(input_path)
+
+
+@app.route("/parcels/<path:parcel>", methods=["GET"])
+def parcel_history(parcel):
+    """Earlier uploads in which a parcel had a DEP note (parcel index lookup)."""
+    if not PARCEL_INDEX.enabled:
+        return jsonify({"error": "Parcel index is disabled", "details": "Set DEP_PARCEL_INDEX to a file path."}), 404
+    key = parcel.strip()
+    found = PARCEL_INDEX.lookup([key])
+    return jsonify({"parcel": key, "files": found[0]["files"] if found else []})
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """Queue a workbook for background processing; for uploads too big or slow for /process."""
+    error = _upload_name_error(request.files.get("file"), tables=True)
+    if error:
+        return error
+    file = request.files["file"]
+    fill_mode = request.form.get("fill_mode", "cells")
+    if fill_mode not in FILL_MODES:
+        return jsonify({"error": f"Unknown fill mode: {fill_mode}", "details": f"Use one of: {', '.join(FILL_MODES)}."}), 400
+    try:
+        columns = _columns_option(request.form)
+        output_format = _output_format_option(request.form)
+    except ValueError as ve:
+        return jsonify({"error": str(ve), "details": str(ve)}), 400
+
+    busy = _job_queue_full()
+    if busy:
+        return busy
+
+    job_id = uuid.uuid4().hex
+    job_dir = JOBS_DIR / job_id
+    job_dir.mkdir(parents=True)
+    input_path = job_dir / ("input" + Path(file.filename).suffix.lower())
+    size, _ = _spool_upload(file.stream, input_path, JOB_MAX_FILE_SIZE)
+    if size < 100 or size > JOB_MAX_FILE_SIZE:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        if size < 100:
+            msg = "File is empty or too small (under 100 bytes). Use a valid .xlsx or .xlsm file."
+            return jsonify({"error": msg, "details": msg}), 400
+        total = max(size, request.content_length or 0)
+        msg = f"File too large: {total / 1024 / 1024:.1f} MB. Max {JOB_MAX_FILE_SIZE // (1024*1024)} MB."
+        return jsonify({"error": msg, "details": msg}), 413
+    sheets = _sheets_option(request.form)
+    msg = _job_memory_error(input_path, sheets)
+    if msg:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return jsonify({"error": msg, "details": msg}), 413
+
+    _write_job(job_dir, id=job_id, status="queued", stage="queued", progress=0.0,
+               filename=file.filename, input_bytes=size, created=time.time())
+    options = {"fill_mode": fill_mode, "sheets": sheets, "columns": columns, "output_format": output_format}
+    pool = _get_job_pool()
+    try:
+        future = pool.submit(_run_job, str(job_dir), str(input_path), file.filename, options)
+    except Exception as e:  # broken pool (a worker died) or shutting down: the job would stay queued forever
+        if isinstance(e, BrokenProcessPool):
+            _discard_job_pool(pool)
+        msg = f"Job could not be started: {str(e) or type(e).__name__}. Try again."
+        print(f"Job {job_id}: {msg}", file=sys.stderr, flush=True)
+        _write_job(job_dir, status="failed", finished=time.time(), error=msg)
+        _remove_files(str(input_path))
+        return jsonify({"error": msg, "details": msg, "job_id": job_id}), 503
+    future.add_done_callback(lambda f: _job_finished(job_dir, f, pool))
+    print(f"Job {job_id} queued: {file.filename}, {size} bytes", flush=True)
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result",
+    }), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    _sweep_jobs()
+    job_dir = _job_dir(job_id)
+    status = _read_job(job_dir) if job_dir else None
+    if status is None:
+        return jsonify({"error": "Unknown or expired job", "details": f"No job {job_id}. Results expire after {JOB_RESULT_TTL} s."}), 404
+    return jsonify(_public_job(status))
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    job_dir = _job_dir(job_id)
+    status = _read_job(job_dir) if job_dir else None
+    if status is None:
+        return jsonify({"error": "Unknown or expired job", "details": f"No job {job_id}. Results expire after {JOB_RESULT_TTL} s."}), 404
+    if status.get("status") != "done":
+        msg = status.get("error") or f"Job is {status.get('status')}"
+        return jsonify({"error": msg, "details": msg, "status": status.get("status")}), 409
+    response = send_file(
+        str(job_dir / "output"),
+        mimetype=output_mimetype(status["output_filename"]),
+        as_attachment=True,
+        download_name=status["output_filename"],
+    )
+    response.headers["X-DEP-Header-Row"] = str(status.get("header_row", ""))
+    response.headers["X-DEP-Header-Reason"] = status.get("header_reason", "")
+    response.headers["X-DEP-Rows"] = str(status.get("rows", ""))
+    response.headers["X-DEP-Highlighted"] = str(status.get("highlighted", ""))
+    if status.get("sheets"):
+        response.headers["X-DEP-Sheets"] = sheets_header(status["sheets"])
+    if status.get("stages"):
+        response.headers["Server-Timing"] = server_timing(status["stages"])
+    return response
+
+
+@app.route("/batch", methods=["POST"])
+def process_batch():
+    """Process many workbooks in parallel; returns a ZIP of the _Highlighted files plus manifest.json."""
+    work_dir = tempfile.mkdtemp(prefix="dep_batch_")
+    try:
+        files = request.files.getlist("files") + request.files.getlist("file")
+        if not files:
+            return jsonify({"error": "No files provided", "details": "Upload workbooks in the form field 'files' (or one .zip of them)."}), 400
+        fill_mode = request.form.get("fill_mode", "cells")
+        if fill_mode not in FILL_MODES:
+            return jsonify({"error": f"Unknown fill mode: {fill_mode}", "details": f"Use one of: {', '.join(FILL_MODES)}."}), 400
+        sheets = _sheets_option(request.form)
+        busy = _job_queue_full()  # batch items share the job pool
+        if busy:
+            return busy
+        try:
+            columns = _columns_option(request.form)
+            inputs = _batch_inputs(files, work_dir)
+        except ValueError as ve:
+            return jsonify({"error": str(ve), "details": str(ve)}), 400
+        print(f"[{datetime.now().isoformat()}] === Batch started: {len(inputs)} files ===", flush=True)
+
+        t0 = time.perf_counter()
+        items = [(name, path, os.path.join(work_dir, f"out_{i}{Path(name).suffix.lower()}"))
+                 for i, (name, path) in enumerate(inputs)]
+        options = {"fill_mode": fill_mode, "sheets": sheets, "columns": columns}
+
+        manifest = {"files": [], "ok": 0, "failed": 0, "rows": 0, "highlighted": 0}
+        zip_path = os.path.join(work_dir, "DEP_Highlighted_batch.zip")
+        used_names = set()
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zout:
+            for (name, _, out_path), entry in _batch_entries(items, options):
+                if entry["status"] == "ok":
+                    arcname = entry["output"]
+                    n = 2
+                    while arcname in used_names:
+                        arcname = f"{Path(entry['output']).stem} ({n}){Path(entry['output']).suffix}"
+                        n += 1
+                    used_names.add(arcname)
+                    entry["output"] = arcname
+                    zout.write(out_path, arcname)
+                    manifest["ok"] += 1
+                    manifest["rows"] += entry["rows"]
+                    manifest["highlighted"] += entry["highlighted"]
+                else:
+                    manifest["failed"] += 1
+                    print(f"Batch item failed: {name}: {entry['error']}", file=sys.stderr, flush=True)
+                manifest["files"].append(entry)
+            manifest["seconds"] = round(time.perf_counter() - t0, 3)
+            zout.writestr("manifest.json", json.dumps(manifest, indent=2))
+        print(f"Batch complete: {manifest['ok']} ok, {manifest['failed']} failed, {manifest['seconds']} s", flush=True)
+
+        response = send_file(zip_path, mimetype="application/zip", as_attachment=True,
+                             download_name="DEP_Highlighted_batch.zip")
+        response.headers["X-DEP-Batch-Files"] = str(len(inputs))
+        response.headers["X-DEP-Batch-Failed"] = str(manifest["failed"])
+        response.direct_passthrough = False
+        response.call_on_close(lambda path=work_dir: shutil.rmtree(path, ignore_errors=True))
+        work_dir = None
+        return response
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
 
 
 @app.route("/", methods=["GET"])
@@ -303,11 +3640,25 @@ def index():
     return jsonify({
         "service": "Webpoint LLC - DEP Highlighter API",
         "version": "1.0.0",
-        "endpoints": {"/health": "GET", "/process": "POST"},
+        "endpoints": {
+            "/health": "GET",
+            "/process": "POST",
+            "/analyze": "POST",
+            "/jobs": "POST",
+            "/jobs/<id>": "GET",
+            "/jobs/<id>/result": "GET",
+            "/batch": "POST",
+            "/uploads": "POST",
+            "/uploads/<id>": "GET, PUT, DELETE",
+            "/uploads/<id>/finalize": "POST",
+            "/parcels/<parcel>": "GET",
+            "/metrics": "GET",
+        },
     })
 
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     debug = os.environ.get("DEBUG", "false").lower() == "true"
+    start_warm_up()
     app.run(host="0.0.0.0", port=port, debug=debug)
@@ -0,0 +1,79 @@
+"""
+gunicorn settings for the DEP Highlighter (picked up automatically from the working directory).
+Workers are sized from the CPU count and the memory each one may use: a worker is ~WORKER_BASE_MB
+after warm-up plus up to DEP_MEMORY_BUDGET_MB for the workbooks it admits (see admission control in
+dep_highlighter_server.py). Workers share nothing but the on-disk job, upload and cache directories.
+Overrides: WEB_CONCURRENCY (workers), DEP_GUNICORN_THREADS, DEP_SERVER_MEMORY_MB (memory to plan
+for; default: the container's cgroup limit, else physical memory), DEP_MAX_REQUESTS.
+"""
+import gc
+import os
+
+WORKER_BASE_MB = 80       # RSS of a warmed worker before any upload (benchmark.py --suite startup)
+MEMORY_HEADROOM = 0.8     # plan for this share of the limit; the rest is the master, page cache, spikes
+
+
+def _memory_limit_mb():
+    """Memory available to this container: DEP_SERVER_MEMORY_MB, the cgroup limit, or physical RAM."""
+    if os.environ.get("DEP_SERVER_MEMORY_MB"):
+        return int(os.environ["DEP_SERVER_MEMORY_MB"])
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 50:   # "max" / huge numbers mean no limit
+            return int(value) // (1024 * 1024)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return 512
+
+
+def _worker_count(cpus, memory_mb, budget_mb):
+    """One worker per CPU (processing is CPU-bound, so threads do not add throughput), but never more
+    than the memory limit can hold at full admission budget. Always at least one."""
+    if os.environ.get("WEB_CONCURRENCY"):
+        return max(1, int(os.environ["WEB_CONCURRENCY"]))
+    fit = int(memory_mb * MEMORY_HEADROOM) // (WORKER_BASE_MB + budget_mb)
+    return max(1, min(cpus, fit))
+
+
+_cpus = os.cpu_count() or 1
+_memory_mb = _memory_limit_mb()
+_budget_mb = int(os.environ.get("DEP_MEMORY_BUDGET_MB", "320"))
+# The app sizes its job workers' address-space cap (DEP_JOB_MAX_MEMORY_MB) from the same figure
+os.environ.setdefault("DEP_SERVER_MEMORY_MB", str(_memory_mb))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = _worker_count(_cpus, _memory_mb, _budget_mb)
+# A few threads per worker: /health, job polling and cache hits are answered while an upload is being
+# processed; admission control keeps concurrent uploads within the worker's memory budget.
+worker_class = "gthread"
+threads = int(os.environ.get("DEP_GUNICORN_THREADS", "4"))
+timeout = 120
+graceful_timeout = 30
+
+# Import the app (flask, openpyxl, numpy) once in the master and fork the workers from it, so those
+# pages are shared copy-on-write. Warm up there too (synchronously: threads do not survive fork).
+preload_app = True
+os.environ.setdefault("DEP_PREWARM", "sync")
+
+# Recycle workers to cap heap growth (openpyxl and fragmented large-workbook allocations are not
+# returned to the OS); jitter keeps all workers from restarting at once.
+max_requests = int(os.environ.get("DEP_MAX_REQUESTS", "200"))
+max_requests_jitter = max(1, max_requests // 4)
+
+
+def when_ready(server):
+    # Objects created by the preloaded import never change: move them out of the collector's reach
+    # so a worker's first gc pass does not touch (and copy) every shared page.
+    gc.freeze()
+    server.log.info(f"DEP Highlighter: {workers} worker(s) x {threads} thread(s); {_cpus} CPU(s), "
+                    f"planning for {_memory_mb} MB, {_budget_mb} MB admission budget per worker")
+
+
+def post_fork(server, worker):
+    from dep_highlighter_server import after_fork
+    after_fork()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Load test for the HTTP service: replays a mix of synthetic RDM workbooks against /process plus /health
+checks at a set concurrency and arrival rate, and reports throughput, p50/p95/p99 latency, error rates
+and server RSS over time. Results go to JSON so server configurations can be compared run against run.
+Starts gunicorn (gunicorn.conf.py, app:app) or the Flask dev server on a free port, with the result
+cache off, unless --url points at a server that is already running (RSS then comes from the
+X-DEP-Peak-RSS-MB response headers instead of /proc).
+Open loop by default: requests arrive as a Poisson process at --rate per second whether or not earlier
+ones have finished, at most --concurrency in flight; latency counts from the scheduled arrival, so time
+spent waiting for a free client shows up instead of being hidden. --rate 0 is a closed loop:
+--concurrency clients sending back to back.
+Usage: python load_test.py [--duration 60] [--rate 0.5] [--concurrency 8] [--mix 2000:3,20000:1]
+                           [--health 0.2] [--workers 2] [--env DEP_MEMORY_BUDGET_MB=640] [--json out.json]
+       python load_test.py --url http://127.0.0.1:5000 --rate 1 --duration 120 --compare base.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+DEPLOY_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(DEPLOY_DIR))
+
+from benchmark import _free_port, make_workbook
+
+SERVERS = {
+    "gunicorn": [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+    "flask": [sys.executable, "dep_highlighter_server.py"],
+}
+
+
+def parse_mix(text):
+    """"2000:3,20000:1" -> [(2000, 3.0), (20000, 1.0)]: workbook rows and relative weight."""
+    mix = []
+    for part in text.split(","):
+        rows, _, weight = part.strip().partition(":")
+        mix.append((int(rows), float(weight or 1)))
+    if not mix or any(rows < 1 or weight <= 0 for rows, weight in mix):
+        raise ValueError(f"Invalid mix: {text!r}. Use rows:weight pairs, e.g. 2000:3,20000:1.")
+    return mix
+
+
+def build_workbooks(mix, work_dir, header_offset=5):
+    """One synthetic workbook per mix entry: {rows, weight, name, bytes, data}."""
+    workbooks = []
+    for rows, weight in mix:
+        path = Path(work_dir) / f"rdm_{rows}.xlsx"
+        make_workbook(path, rows, header_offset=header_offset, dep_density=0.3, run_lengths=(1, 1, 2, 2, 3, 5))
+        data = path.read_bytes()
+        workbooks.append({"rows": rows, "weight": weight, "name": path.name, "bytes": len(data), "data": data})
+    return workbooks
+
+
+def start_server(kind, workers=None, env_overrides=None, log_path=None):
+    """Start the app on a free port (result cache off) and wait until /health is 200.
+    Returns (Popen, base url)."""
+    port = _free_port()
+    env = dict(os.environ, PORT=str(port), DEP_CACHE_MAX_MB="0")
+    if workers:
+        env["WEB_CONCURRENCY"] = str(workers)
+    env.update(env_overrides or {})
+    log = open(log_path, "wb") if log_path else subprocess.DEVNULL
+    server = subprocess.Popen(SERVERS[kind], cwd=DEPLOY_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 90
+    while True:
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=2) as response:
+                if response.status == 200:
+                    return server, base_url
+        except (urllib.error.URLError, OSError):
+            pass
+        if time.time() > deadline or server.poll() is not None:
+            stop_server(server)
+            raise RuntimeError(f"{kind} server did not become healthy" + (f"; log: {log_path}" if log_path else ""))
+        time.sleep(0.2)
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def process_tree_rss_mb(pid):
+    """(total RSS MB of pid and all its descendants, largest single process MB, process count) from /proc.
+    None where /proc is not available (macOS, Windows)."""
+    parents = {}
+    rss = {}
+    try:
+        entries = [e for e in os.listdir("/proc") if e.isdigit()]
+    except OSError:
+        return None
+    for entry in entries:
+        try:
+            with open(f"/proc/{entry}/status") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            continue
+        parents[int(entry)] = int(fields.get("PPid", "0").strip())
+        rss[int(entry)] = int(fields.get("VmRSS", "0 kB").split()[0]) / 1024
+    tree = {pid}
+    grew = True
+    while grew:
+        grew = False
+        for child, parent in parents.items():
+            if parent in tree and child not in tree:
+                tree.add(child)
+                grew = True
+    sizes = [rss.get(p, 0.0) for p in tree if p in rss]
+    if not sizes:
+        return None
+    return round(sum(sizes), 1), round(max(sizes), 1), len(sizes)
+
+
+def send(base_url, kind, workbook=None, timeout=300):
+    """One request. Returns (HTTP status or 0 for a connection error / timeout, peak RSS header or None, error text)."""
+    if kind == "health":
+        request = urllib.request.Request(f"{base_url}/health")
+    else:
+        boundary = uuid.uuid4().hex
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{workbook['name']}\"\r\n"
+                f"Content-Type: application/octet-stream\r\n\r\n").encode() + workbook["data"] + f"\r\n--{boundary}--\r\n".encode()
+        request = urllib.request.Request(f"{base_url}/process", data=body,
+                                         headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            peak = response.headers.get("X-DEP-Peak-RSS-MB")
+            return response.status, float(peak) if peak else None, None
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code, None, None
+    except (urllib.error.URLError, OSError) as e:
+        return 0, None, str(getattr(e, "reason", e))
+
+
+class LoadRun:
+    """One load test: schedules requests, records each one and samples server RSS in the background."""
+
+    def __init__(self, base_url, workbooks, rate, concurrency, duration, health_share, timeout, seed=1, server_pid=None,
+                 sample_interval=1.0):
+        self.base_url = base_url
+        self.workbooks = workbooks
+        self.rate = rate
+        self.concurrency = concurrency
+        self.duration = duration
+        self.health_share = health_share
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.server_pid = server_pid
+        self.sample_interval = sample_interval
+        self.records = []
+        self.samples = []
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stop = threading.Event()
+
+    def _pick(self):
+        if self.rng.random() < self.health_share:
+            return "health", None
+        return "process", self.rng.choices(self.workbooks, weights=[w["weight"] for w in self.workbooks])[0]
+
+    def _request(self, scheduled, kind, workbook):
+        started = time.perf_counter()
+        with self.lock:
+            self.in_flight += 1
+        status, peak_rss, error = send(self.base_url, kind, workbook, self.timeout)
+        done = time.perf_counter()
+        with self.lock:
+            self.in_flight -= 1
+            self.records.append({
+                "t": round(scheduled - self.t0, 3), "kind": kind, "rows": workbook["rows"] if workbook else None,
+                "status": status, "latency_s": round(done - scheduled, 4), "wait_s": round(started - scheduled, 4),
+                "peak_rss_mb": peak_rss, "error": error,
+            })
+
+    def _sampler(self):
+        while not self.stop.wait(self.sample_interval):
+            sample = {"t": round(time.perf_counter() - self.t0, 2)}
+            tree = process_tree_rss_mb(self.server_pid) if self.server_pid else None
+            if tree:
+                sample["rss_mb"], sample["max_process_rss_mb"], sample["processes"] = tree
+            with self.lock:
+                sample["in_flight"] = self.in_flight
+                sample["completed"] = len(self.records)
+            self.samples.append(sample)
+
+    def run(self):
+        self.t0 = time.perf_counter()
+        sampler = threading.Thread(target=self._sampler, daemon=True)
+        sampler.start()
+        deadline = self.t0 + self.duration
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            if self.rate > 0:
+                # open loop: arrival times are fixed up front, a busy pool only delays the start
+                scheduled = self.t0
+                while True:
+                    scheduled += self.rng.expovariate(self.rate)
+                    if scheduled >= deadline:
+                        break
+                    time.sleep(max(0.0, scheduled - time.perf_counter()))
+                    pool.submit(self._request, scheduled, *self._pick())
+            else:
+                def client():
+                    while time.perf_counter() < deadline:
+                        with self.lock:
+                            kind, workbook = self._pick()
+                        self._request(time.perf_counter(), kind, workbook)
+                for _ in range(self.concurrency):
+                    pool.submit(client)
+        self.elapsed = time.perf_counter() - self.t0
+        self.stop.set()
+        sampler.join()
+        return self
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list (q in 0..100); None when empty."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))]
+
+
+def summarize(records, elapsed):
+    """Counts, error rate, status codes, throughput and latency percentiles of a list of records."""
+    latencies = sorted(r["latency_s"] for r in records if r["status"] == 200)
+    statuses = {}
+    for r in records:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    errors = len(records) - len(latencies)
+    waits = sorted(r["wait_s"] for r in records)
+    return {
+        "requests": len(records), "ok": len(latencies), "errors": errors,
+        "error_rate": round(errors / len(records), 4) if records else 0.0, "status": statuses,
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "p50_s": percentile(latencies, 50), "p95_s": percentile(latencies, 95), "p99_s": percentile(latencies, 99),
+        "max_s": latencies[-1] if latencies else None, "p95_wait_s": percentile(waits, 95),
+    }
+
+
+def timeline(records, samples, bucket_s):
+    """Per bucket_s seconds of scheduled time: /process completions, errors, p95 latency and peak server RSS."""
+    buckets = {}
+    for r in records:
+        b = buckets.setdefault(int(r["t"] // bucket_s), {"latencies": [], "requests": 0, "errors": 0, "rss": []})
+        b["requests"] += 1
+        if r["status"] != 200:
+            b["errors"] += 1
+        elif r["kind"] == "process":
+            b["latencies"].append(r["latency_s"])
+        if r["peak_rss_mb"] is not None:
+            b["rss"].append(r["peak_rss_mb"])
+    for s in samples:
+        if "rss_mb" in s:
+            buckets.setdefault(int(s["t"] // bucket_s), {"latencies": [], "requests": 0, "errors": 0, "rss": []})["rss"].append(s["rss_mb"])
+    out = []
+    for i in sorted(buckets):
+        b = buckets[i]
+        out.append({"t": i * bucket_s, "requests": b["requests"], "errors": b["errors"],
+                    "process_p95_s": percentile(sorted(b["latencies"]), 95), "rss_mb": max(b["rss"]) if b["rss"] else None})
+    return out
+
+
+def report(run, args, workbooks, server_env):
+    records = run.records
+    summary = {"all": summarize(records, run.elapsed),
+               "process": summarize([r for r in records if r["kind"] == "process"], run.elapsed),
+               "health": summarize([r for r in records if r["kind"] == "health"], run.elapsed)}
+    by_size = {str(w["rows"]): summarize([r for r in records if r["rows"] == w["rows"]], run.elapsed) for w in workbooks}
+    rss = [s["rss_mb"] for s in run.samples if "rss_mb" in s] or [r["peak_rss_mb"] for r in records if r["peak_rss_mb"]]
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+        "cpu_count": os.cpu_count(), "target": args.url or args.server, "server_env": server_env,
+        "config": {"duration_s": args.duration, "rate": args.rate, "concurrency": args.concurrency,
+                   "health_share": args.health, "mix": [{"rows": w["rows"], "weight": w["weight"], "bytes": w["bytes"]}
+                                                         for w in workbooks], "seed": args.seed},
+        "elapsed_s": round(run.elapsed, 2), "summary": summary, "by_rows": by_size,
+        "peak_rss_mb": max(rss) if rss else None,
+        "timeline": timeline(records, run.samples, args.bucket), "rss_samples": run.samples, "requests": records,
+    }
+
+
+def _fmt(value, spec=".3f"):
+    return "-" if value is None else format(value, spec)
+
+
+def print_report(result):
+    print(f"\n{'group':<10} {'requests':>8} {'ok':>6} {'err %':>6} {'req/s':>7} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8}  status")
+    rows = list(result["summary"].items()) + [(f"{k} rows", v) for k, v in result["by_rows"].items()]
+    for name, s in rows:
+        if not s["requests"]:
+            continue
+        print(f"{name:<10} {s['requests']:>8} {s['ok']:>6} {s['error_rate'] * 100:>6.1f} {s['throughput_rps']:>7.2f} "
+              f"{_fmt(s['p50_s']):>8} {_fmt(s['p95_s']):>8} {_fmt(s['p99_s']):>8}  {s['status']}")
+    print(f"\n{'t s':>5} {'requests':>8} {'errors':>6} {'process p95 s':>14} {'server RSS MB':>14}")
+    for b in result["timeline"]:
+        print(f"{b['t']:>5} {b['requests']:>8} {b['errors']:>6} {_fmt(b['process_p95_s']):>14} {_fmt(b['rss_mb'], '.1f'):>14}")
+    print(f"\nPeak server RSS: {_fmt(result['peak_rss_mb'], '.1f')} MB; elapsed {result['elapsed_s']} s")
+
+
+def compare(result, baseline):
+    """Side by side: this run vs an earlier JSON result, for the headline numbers."""
+    print(f"\n{'metric':<22} {'baseline':>10} {'this run':>10} {'change':>8}")
+    pairs = [(f"{group} {key}", baseline["summary"][group].get(key), result["summary"][group].get(key))
+             for group in ("process", "health") for key in ("throughput_rps", "p50_s", "p95_s", "p99_s", "error_rate")]
+    pairs.append(("peak_rss_mb", baseline.get("peak_rss_mb"), result.get("peak_rss_mb")))
+    for name, old, new in pairs:
+        change = f"{(new - old) / old:+.0%}" if old and new is not None else "-"
+        print(f"{name:<22} {_fmt(old):>10} {_fmt(new):>10} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="target a running server (e.g. http://127.0.0.1:5000) instead of starting one")
+    parser.add_argument("--server", choices=tuple(SERVERS), default="gunicorn", help="server to start (default: %(default)s)")
+    parser.add_argument("--workers", type=int, help="WEB_CONCURRENCY for gunicorn (default: gunicorn.conf.py sizing)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra server environment, repeatable")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of arrivals (in-flight requests are then drained)")
+    parser.add_argument("--rate", type=float, default=0.5, help="arrivals per second, Poisson; 0 = closed loop")
+    parser.add_argument("--concurrency", type=int, default=8, help="max requests in flight (closed loop: clients)")
+    parser.add_argument("--mix", default="2000:3,20000:1", help="workbook rows:weight, comma separated (default: %(default)s)")
+    parser.add_argument("--health", type=float, default=0.2, help="share of requests that are GET /health (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=300, help="per-request timeout in seconds")
+    parser.add_argument("--bucket", type=int, default=10, help="timeline bucket in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the full result (summary, timeline, RSS samples, every request) here")
+    parser.add_argument("--compare", help="earlier --json result to compare against")
+    args = parser.parse_args()
+    try:
+        mix = parse_mix(args.mix)
+        env_overrides = dict(item.split("=", 1) for item in args.env)
+    except ValueError as e:
+        parser.error(str(e))
+    if not 0 <= args.health <= 1 or args.concurrency < 1:
+        parser.error("--health must be between 0 and 1 and --concurrency at least 1")
+
+    with tempfile.TemporaryDirectory(prefix="dep_load_") as work_dir:
+        workbooks = build_workbooks(mix, work_dir)
+        print("Workbooks: " + ", ".join(f"{w['rows']} rows ({w['bytes'] / 1024 / 1024:.2f} MB) x{w['weight']:g}" for w in workbooks))
+        server = None
+        base_url = args.url.rstrip("/") if args.url else None
+        server_env = env_overrides
+        if not base_url:
+            log_path = os.path.join(tempfile.gettempdir(), "dep_load_server.log")
+            server_env = {"DEP_CACHE_MAX_MB": "0", **({"WEB_CONCURRENCY": str(args.workers)} if args.workers else {}),
+                          **env_overrides}
+            server, base_url = start_server(args.server, args.workers, env_overrides, log_path)
+            print(f"Started {args.server} at {base_url} (pid {server.pid}); server log {log_path}")
+        loop = f"open loop, {args.rate:g} req/s" if args.rate > 0 else "closed loop"
+        print(f"Running {args.duration:g} s, {loop}, concurrency {args.concurrency}, {args.health:.0%} /health ...", flush=True)
+        try:
+            run = LoadRun(base_url, workbooks, args.rate, args.concurrency, args.duration, args.health, args.timeout,
+                          args.seed, server.pid if server else None).run()
+        finally:
+            if server:
+                stop_server(server)
+
+    result = report(run, args, workbooks, server_env)
+    print_report(result)
+    if args.compare:
+        compare(result, json.loads(Path(args.compare).read_text()))
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+        print(f"\nResults written to {args.json}")
+    return 1 if not result["summary"]["all"]["ok"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
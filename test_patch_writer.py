@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Regression check: zip-level patch writer (patch_workbook) against openpyxl's view of the result.
+Builds randomized workbooks (styled and unstyled cells, gaps, number formats, existing fills, a second
+sheet), patches random row sets (including rows past the last row) with a tiny PATCH_CHUNK_SIZE so
+rows and tags split across reads, reloads the output with openpyxl and asserts yellow fills on exactly
+the highlighted rows with values, fonts and number formats preserved.
+Run directly (python test_patch_writer.py) or via pytest.
+"""
+import copy
+import random
+import sys
+import tempfile
+import zipfile
+from pathlib import Path
+
+DEPLOY_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(DEPLOY_DIR))
+
+import openpyxl
+from openpyxl.styles import Font, PatternFill
+
+import dep_highlighter_server
+from benchmark import make_workbook
+from dep_highlighter_server import CloneVerificationError, patch_workbook, verify_clone
+
+RUNS = 60
+CHUNK_SIZES = [7, 13, 64, 1 << 20]
+FONTS = [None, Font(bold=True), Font(italic=True, color="FF0000FF"), Font(name="Courier New", size=9)]
+FILLS = [None, PatternFill(start_color="FF99CCFF", end_color="FF99CCFF", fill_type="solid")]
+NUMBER_FORMATS = [None, "0.00", "yyyy-mm-dd", "#,##0"]
+YELLOW = "FFFFFF00"
+
+
+def random_workbook(rng, path):
+    """Random sheet at path (plus an untouched second sheet); returns its {(row, col): cell snapshot}."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "RDM"
+    n_rows, n_cols = rng.randint(1, 80), rng.randint(3, 10)
+    for row in range(1, n_rows + 1):
+        if rng.random() < 0.1 and row < n_rows:
+            continue  # no <row> element at all
+        for col in range(1, n_cols + 1):
+            if rng.random() < 0.25 and (row, col) != (n_rows, n_cols):
+                continue  # no cell: "cells" mode adds an empty highlighted one
+            cell = ws.cell(row, col, rng.choice([None, row * col, f"t{row}-{col}", 1.5 * row, "DEP"]))
+            font, fill, number_format = rng.choice(FONTS), rng.choice(FILLS), rng.choice(NUMBER_FORMATS)
+            if font:
+                cell.font = font
+            if fill:
+                cell.fill = fill
+            if number_format:
+                cell.number_format = number_format
+    wb.create_sheet("Other")["A1"] = "untouched"
+    wb.save(path)
+    return snapshot(openpyxl.load_workbook(path).worksheets[0])
+
+
+def snapshot(ws):
+    return {(c.row, c.column): (c.value, copy.copy(c.font), c.number_format, copy.copy(c.fill)) for c in ws._cells.values()}
+
+
+def is_yellow(fill):
+    return fill is not None and fill.fill_type == "solid" and fill.fgColor.rgb == YELLOW
+
+
+def patched(tmp_path, n, rng, fill_mode):
+    """Patch random workbook n; returns (original snapshot, max_row, max_col, rows, reloaded workbook)."""
+    src, dst = tmp_path / f"in_{fill_mode}_{n}.xlsx", tmp_path / f"out_{fill_mode}_{n}.xlsx"
+    before = random_workbook(rng, src)
+    max_row, max_col = max(r for r, _ in before), max(c for _, c in before)
+    rows = {r for r in range(1, max_row + 6) if rng.random() < 0.3}
+    saved = dep_highlighter_server.PATCH_CHUNK_SIZE
+    dep_highlighter_server.PATCH_CHUNK_SIZE = rng.choice(CHUNK_SIZES)
+    try:
+        with open(dst, "wb") as f:
+            patch_workbook(src, f, rows, fill_mode=fill_mode)
+    finally:
+        dep_highlighter_server.PATCH_CHUNK_SIZE = saved
+    return before, max_row, max_col, rows, openpyxl.load_workbook(dst)
+
+
+def test_patch_cells(tmp_path):
+    """fill_mode "cells": every column up to the sheet's last one is yellow on highlighted rows."""
+    rng = random.Random(20260301)
+    for n in range(RUNS):
+        before, max_row, max_col, rows, wb = patched(tmp_path, n, rng, "cells")
+        ws = wb.worksheets[0]
+        after = snapshot(ws)
+        assert ws.max_row == max_row, f"Run {n}: rows past the end were created"
+        for (row, col), (value, font, number_format, fill) in after.items():
+            old = before.get((row, col))
+            if row in rows:
+                assert is_yellow(fill), f"Run {n}: {row},{col} not highlighted"
+                expected = old[:3] if old else (None, wb._fonts[0], "General")  # added cell: default style
+                assert (value, font, number_format) == expected, f"Run {n}: {row},{col} value or font changed"
+            else:
+                assert (value, font, number_format, fill) == old, f"Run {n}: {row},{col} changed"
+        for row in rows:
+            if row <= max_row and any(r == row for r, _ in before):
+                assert all((row, col) in after for col in range(1, max_col + 1)), f"Run {n}: row {row} not filled out"
+        assert wb["Other"]["A1"].value == "untouched"
+
+
+def test_patch_row(tmp_path):
+    """fill_mode "row": highlighted rows get a yellow row style and existing cells turn yellow; no cells are added."""
+    rng = random.Random(20260302)
+    for n in range(RUNS):
+        before, max_row, _, rows, wb = patched(tmp_path, n, rng, "row")
+        ws = wb.worksheets[0]
+        after = snapshot(ws)
+        assert ws.max_row == max_row, f"Run {n}: rows past the end were created"
+        assert set(after) == set(before), f"Run {n}: cells were added or removed"
+        for (row, col), (value, font, number_format, fill) in after.items():
+            old = before[row, col]
+            if row in rows:
+                assert is_yellow(fill), f"Run {n}: {row},{col} not highlighted"
+                assert (value, font, number_format) == old[:3], f"Run {n}: {row},{col} value or font changed"
+            else:
+                assert (value, font, number_format, fill) == old, f"Run {n}: {row},{col} changed"
+        for row in range(1, max_row + 1):
+            has_row = any(r == row for r, _ in before)
+            assert is_yellow(ws.row_dimensions[row].fill) == (row in rows and has_row), f"Run {n}: row {row} style"
+        assert wb["Other"]["A1"].value == "untouched"
+
+
+def test_untouched_members_copied_raw(tmp_path):
+    """Members other than the patched sheet and styles.xml keep their original compressed bytes."""
+    src, dst = tmp_path / "media.xlsx", tmp_path / "media_out.xlsx"
+    random_workbook(random.Random(20260304), tmp_path / "plain.xlsx")
+    media = random.Random(5).randbytes(1 << 18) + bytes(1 << 18)
+    with zipfile.ZipFile(tmp_path / "plain.xlsx") as zin, \
+            zipfile.ZipFile(src, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zout:
+        for info in zin.infolist():
+            zout.writestr(info.filename, zin.read(info))
+        zout.writestr("xl/media/image1.png", media, zipfile.ZIP_DEFLATED, compresslevel=1)
+        zout.writestr("xl/media/image2.bin", media, zipfile.ZIP_STORED)
+    with open(dst, "wb") as f:
+        patch_workbook(src, f, {1, 2})
+    patched_parts = {"xl/worksheets/sheet1.xml", "xl/styles.xml"}
+    with zipfile.ZipFile(src) as zin, zipfile.ZipFile(dst) as zout:
+        assert zout.testzip() is None
+        assert sorted(zout.namelist()) == sorted(zin.namelist())
+        for info in zin.infolist():
+            out = zout.getinfo(info.filename)
+            if info.filename not in patched_parts:
+                raw = (info.CRC, info.compress_size, info.compress_type)
+                assert (out.CRC, out.compress_size, out.compress_type) == raw, f"{info.filename} was recompressed"
+        assert zout.read("xl/media/image1.png") == media
+    assert openpyxl.load_workbook(dst)["Other"]["A1"].value == "untouched"
+
+
+def test_verify_clone_spaced_empty_cells(tmp_path):
+    """Write-only workbooks write empty cells as '<c r="H4" t="inlineStr" />'; patching them must still verify."""
+    src, dst = tmp_path / "spaced.xlsx", tmp_path / "spaced_out.xlsx"
+    make_workbook(src, 60)
+    with zipfile.ZipFile(src) as zf:
+        assert b't="inlineStr" />' in zf.read("xl/worksheets/sheet1.xml")
+    rows = set(range(2, 40))
+    with open(dst, "wb") as f:
+        patch_workbook(src, f, rows)
+    assert verify_clone(src, dst, rows)["restyled"] == len(rows)
+
+
+def tampered(src, dst, part, old, new):
+    """Copy of the package src at dst with the first old in member part replaced by new."""
+    with zipfile.ZipFile(src) as zin, zipfile.ZipFile(dst, "w", zipfile.ZIP_DEFLATED) as zout:
+        for info in zin.infolist():
+            data = zin.read(info)
+            if info.filename == part:
+                assert old in data, f"{part} has no {old!r} to tamper with"
+                data = data.replace(old, new, 1)
+            zout.writestr(info, data)
+    return dst
+
+
+def expect_rejected(original, clone, rows, what):
+    try:
+        verify_clone(original, clone, rows)
+    except CloneVerificationError:
+        return
+    raise AssertionError(f"verify_clone accepted {what}")
+
+
+def test_verify_clone(tmp_path):
+    """verify_clone passes real patch outputs and rejects changed values, styles and row sets."""
+    rng = random.Random(20260303)
+    for n in range(RUNS // 2):
+        fill_mode = rng.choice(["cells", "row"])
+        src, dst = tmp_path / f"v_in_{n}.xlsx", tmp_path / f"v_out_{n}.xlsx"
+        before = random_workbook(rng, src)
+        present = sorted({r for r, _ in before})
+        rows = set(rng.sample(present, max(1, len(present) // 3)))
+        with open(dst, "wb") as f:
+            patch_workbook(src, f, rows, fill_mode=fill_mode)
+        stats = verify_clone(src, dst, rows)
+        assert stats["restyled"] == len(rows) and stats["sheets_checked"] == 1, f"Run {n}: {stats}"
+        assert verify_clone(src, dst)["restyled"] == len(rows)
+
+        expect_rejected(src, dst, rows - {min(rows)}, f"run {n}: a highlighted row missing from excel_rows")
+        if len(rows) < len(present):
+            extra = next(r for r in present if r not in rows)
+            expect_rejected(src, dst, rows | {extra}, f"run {n}: a row that was not highlighted")
+        sheet = "xl/worksheets/sheet1.xml"
+        with zipfile.ZipFile(dst) as zf:
+            row_xml = zf.read(sheet)
+        first = min(rows)
+        value = row_xml.find(b"<v>", row_xml.find(b'<row r="%d"' % first))
+        if value != -1:
+            bad = tampered(dst, tmp_path / f"v_bad_{n}.xlsx", sheet, row_xml[value:value + 4], b"<v>1" + row_xml[value + 3:value + 4])
+            expect_rejected(src, bad, rows, f"run {n}: a changed cell value")
+        bad = tampered(dst, tmp_path / f"v_fill_{n}.xlsx", "xl/styles.xml", b'patternType="gray125"',
+                       b'patternType="darkGray"')
+        expect_rejected(src, bad, rows, f"run {n}: a changed original fill")
+        bad = tampered(dst, tmp_path / f"v_font_{n}.xlsx", "xl/styles.xml", b'<sz val="11"', b'<sz val="12"')
+        expect_rejected(src, bad, rows, f"run {n}: a changed font")
+
+
+def main():
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            test_patch_cells(Path(tmp))
+            test_patch_row(Path(tmp))
+            test_untouched_members_copied_raw(Path(tmp))
+            test_verify_clone(Path(tmp))
+            test_verify_clone_spaced_empty_cells(Path(tmp))
+    except AssertionError as e:
+        print("FAILED:", e)
+        return 1
+    print(f"PASS: patch writer output matches openpyxl expectations on {RUNS} randomized workbooks in both fill modes; "
+          "verify_clone passes them and rejects tampered copies.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
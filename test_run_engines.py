@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Equivalence check: vectorized run engine vs the reference row-by-row loop.
+Builds randomized RDM-shaped sheets (blank parcels, NaN, "nan" text, numbers, padded strings,
+DEP / non-DEP notes) and asserts both engines highlight exactly the same rows.
+Also checks the direct worksheet XML reader against the openpyxl read_only reader it replaces.
+Run directly (python test_run_engines.py) or via pytest.
+"""
+import datetime
+import io
+import random
+import re
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+DEPLOY_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(DEPLOY_DIR))
+
+import openpyxl
+import pandas as pd
+
+from dep_highlighter_server import (COL_D_PARCEL, COL_H_NOTES, _ChunkedMask, _ColumnResolver, _find_runs_loop,
+                                    _highlight_mask_vectorized, _highlight_runs, _parcel_val, _RowRuns,
+                                    _scan_sheet_openpyxl, _scan_sheet_xml, highlight_logic)
+
+SHEETS = 300
+PARCEL_POOL = ["100-001", " 100-001 ", "100-002", "", None, float("nan"), "nan", "NaN", 1001, 1001.0, "A-7"]
+NOTES_POOL = ["DEP", "dep", " DEP ", "DEP - duplicate", "NOT DEP", "OK", "", None, float("nan"), 0]
+
+
+def random_sheet(rng):
+    n_rows = rng.choice([0, 1, 2, 3, rng.randint(4, 60), rng.randint(200, 800)])
+    n_cols = rng.randint(8, 12)
+    # Runs of repeated parcels so long DEP runs actually occur
+    parcels = []
+    while len(parcels) < n_rows:
+        parcels.extend([rng.choice(PARCEL_POOL)] * rng.choice([1, 1, 2, 3, 5]))
+    parcels = parcels[:n_rows]
+    data = {c: [rng.random() for _ in range(n_rows)] for c in range(n_cols)}
+    data[COL_D_PARCEL] = parcels
+    data[COL_H_NOTES] = [rng.choice(NOTES_POOL) for _ in range(n_rows)]
+    return pd.DataFrame(data)
+
+
+def test_engines_agree():
+    rng = random.Random(20260203)
+    for n in range(SHEETS):
+        df = random_sheet(rng)
+        fast = highlight_logic(df, engine="vectorized").tolist()
+        slow = highlight_logic(df, engine="loop").tolist()
+        assert fast == slow, f"Sheet {n}: engines disagree ({sum(fast)} vs {sum(slow)} highlighted rows)"
+
+
+def test_runs_match_loop():
+    """Runs recovered from the vectorized mask are the reference loop's runs."""
+    rng = random.Random(20260204)
+    for n in range(SHEETS):
+        df = random_sheet(rng)
+        parcel = [_parcel_val(v) for v in df.iloc[:, COL_D_PARCEL]]
+        dep = ["DEP" in str(v).upper() for v in df.iloc[:, COL_H_NOTES].fillna("")]
+        starts, ends = _highlight_runs(parcel, _highlight_mask_vectorized(parcel, dep))
+        expected = _find_runs_loop(parcel, dep)
+        assert list(zip(starts.tolist(), ends.tolist())) == expected, f"Sheet {n}: runs differ"
+
+
+def test_row_runs_cover_mask():
+    """The writers' row ranges hold exactly the highlighted rows, shifted to Excel row numbers."""
+    rng = random.Random(20260205)
+    for n in range(SHEETS):
+        mask = highlight_logic(random_sheet(rng))
+        runs = _RowRuns.from_mask(mask, 7)
+        rows = [r for first, last in runs for r in range(first, last + 1)]
+        assert rows == [7 + i for i in mask.nonzero()[0].tolist()], f"Sheet {n}: ranges differ from mask"
+        assert all(r in runs for r in rows) and (6 not in runs) and (7 + len(mask) not in runs)
+
+
+def test_chunked_mask_matches():
+    """Table input reads in chunks: runs crossing chunk boundaries give the same mask as one pass."""
+    rng = random.Random(20260206)
+    for n in range(SHEETS):
+        df = random_sheet(rng)
+        parcel = [_parcel_val(v) for v in df.iloc[:, COL_D_PARCEL]]
+        dep = ["DEP" in str(v).upper() for v in df.iloc[:, COL_H_NOTES].fillna("")]
+        chunked = _ChunkedMask()
+        i = 0
+        while i < len(parcel):
+            size = rng.choice([1, 2, 3, 7, 50])
+            chunked.add(parcel[i:i + size], dep[i:i + size])
+            i += size
+        assert chunked.result().tolist() == _highlight_mask_vectorized(parcel, dep).tolist(), f"Sheet {n}: chunked mask differs"
+
+
+CELL_POOL = ["100-001", "DEP", "dep note", "  padded  ", "", None, 0, 7, -3.25, 1e-7, 12345678901, True, False,
+             "a & b <c>", "line\nbreak", "ünïcode", "=not a formula", datetime.datetime(2024, 2, 29, 13, 5),
+             datetime.date(1999, 12, 31)]
+
+
+def random_workbook_bytes(rng):
+    """Workbook with a random first sheet: title rows, gaps, mixed value types, dates, wide and short rows."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    if rng.random() < 0.5:
+        ws.append(["RDM export"])
+    ws.append(["Tax ID", "Bill ID", "Owner", "Parcel Number", "Address", "Amount", "Status", "Parcel Notes"])
+    for row in range(ws.max_row + 1, ws.max_row + 1 + rng.choice([0, 1, 5, rng.randint(20, 120)])):
+        if rng.random() < 0.1:
+            continue  # missing row
+        for col in range(1, rng.randint(1, 12) + 1):
+            if rng.random() < 0.8:
+                ws.cell(row, col, rng.choice(CELL_POOL))
+    if rng.random() < 0.3:
+        ws.cell(1, rng.randint(1, 5), "stray").number_format = "0.00"
+    buf = io.BytesIO()
+    wb.save(buf)
+    return shared_strings(buf.getvalue()) if rng.random() < 0.5 else buf.getvalue()
+
+
+def shared_strings(data):
+    """The package with the sheet's inline strings moved into a shared string table (as Excel saves it)."""
+    strings = []
+
+    def to_shared(m):
+        strings.append(m.group(1))
+        return b't="s"><v>%d</v>' % (len(strings) - 1)
+
+    out = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(data)) as zin, zipfile.ZipFile(out, "w") as zout:
+        for info in zin.infolist():
+            part = zin.read(info)
+            if info.filename == "xl/worksheets/sheet1.xml":
+                part = re.sub(rb't="inlineStr"><is><t(?:\s[^>]*)?>(.*?)</t></is>', to_shared, part, flags=re.S)
+            elif info.filename == "xl/_rels/workbook.xml.rels":
+                part = part.replace(b"</Relationships>", b'<Relationship Id="rIdSST" Target="sharedStrings.xml" Type='
+                                    b'"http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/>'
+                                    b"</Relationships>")
+            elif info.filename == "[Content_Types].xml":
+                part = part.replace(b"</Types>", b'<Override PartName="/xl/sharedStrings.xml" ContentType="application/'
+                                    b'vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/></Types>')
+            zout.writestr(info, part)
+        zout.writestr("xl/sharedStrings.xml", b'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                      + b"".join(b'<si><t xml:space="preserve">%s</t></si>' % s for s in strings) + b"</sst>")
+    return out.getvalue()
+
+
+def test_xml_reader_matches_openpyxl():
+    """_scan_sheet_xml (the fast path of read_sheet_columns) returns what the openpyxl reader returns."""
+    rng = random.Random(20260207)
+    for n in range(SHEETS // 2):
+        data = random_workbook_bytes(rng)
+        sample_rows = rng.choice([1, 2, 5, 25])
+        columns = rng.choice([None, {"parcel": "Parcel*", "notes": "Parcel Notes"}, {"parcel": "B", "notes": "3"}])
+        fast = _scan_sheet_xml(data, _ColumnResolver(columns), sample_rows, time.perf_counter())
+        slow = _scan_sheet_openpyxl(data, _ColumnResolver(columns), sample_rows, time.perf_counter())
+        # (sample, parcels, dep_flags, width, last_row_with_data, sample_ms, columns): all but the timing;
+        # openpyxl gives an empty row as [] and the XML reader as (). When the columns cannot be resolved
+        # both stop early and the caller raises, so only the sample and that outcome count.
+        fast, slow = ([list(map(tuple, scan[0]))] + list(scan[1:5]) + [scan[6]] for scan in (fast, slow))
+        if slow[-1] is None:
+            fast, slow = (scan[:1] + scan[-1:] for scan in (fast, slow))
+        assert fast == slow, f"Sheet {n}: XML reader differs from openpyxl"
+
+
+def main():
+    try:
+        test_engines_agree()
+        test_runs_match_loop()
+        test_row_runs_cover_mask()
+        test_chunked_mask_matches()
+        test_xml_reader_matches_openpyxl()
+    except AssertionError as e:
+        print("FAILED:", e)
+        return 1
+    print(f"PASS: vectorized and loop engines (masks and runs) agree on {SHEETS} randomized sheets; row ranges cover the masks; chunked masks match; "
+          "the XML reader matches openpyxl.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Behavior checks for the service through Flask's test client (jobs, result cache, batch, admission,
+parcel index, chunked uploads, column options, CSV / Parquet input), with every on-disk location
+(jobs, result cache, parcel index, chunked uploads) moved into a temporary directory.
+Run directly (python test_service.py) or via pytest.
+"""
+import csv
+import io
+import json
+import os
+import random
+import signal
+import sqlite3
+import sys
+import time
+import zipfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+DEPLOY_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(DEPLOY_DIR))
+
+import openpyxl
+import pytest
+
+import dep_highlighter_server as server
+from benchmark import make_workbook
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "JOBS_DIR", tmp_path / "jobs")
+    monkeypatch.setattr(server, "CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(server, "UPLOADS_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(server, "PARCEL_INDEX", server._ParcelIndex(str(tmp_path / "parcels.sqlite3"), 1000))
+    return server.app.test_client()
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    """(path, rows the highlighter must flag) of a small synthetic RDM workbook."""
+    path = tmp_path / "rdm.xlsx"
+    expected = make_workbook(path, 300, header_offset=3, dep_density=0.3, run_lengths=(1, 2, 3))
+    return path, expected
+
+
+def upload(path, name=None, **form):
+    return {"file": (open(path, "rb"), name or Path(path).name), **form}
+
+
+def yellow_rows(data):
+    ws = openpyxl.load_workbook(io.BytesIO(data)).worksheets[0]
+    return {row[0].row for row in ws.iter_rows() if row[0].fill.fill_type == "solid" and row[0].fill.fgColor.rgb.endswith("FFFF00")}
+
+
+def dep_rows(path):
+    """Rows of the runs (2+ consecutive rows, same parcel in D, DEP in H) the highlighter must flag."""
+    ws = openpyxl.load_workbook(path).worksheets[0]
+    rows = [(cell.row, ws.cell(cell.row, 4).value, "DEP" in str(ws.cell(cell.row, 8).value or "")) for cell in ws["D"]]
+    flagged, run = set(), []
+    for row, parcel, dep in rows + [(None, None, False)]:
+        if run and (not dep or parcel != run[-1][1]):
+            if len(run) >= 2:
+                flagged.update(r for r, _ in run)
+            run = []
+        if dep:
+            run.append((row, parcel))
+    return flagged
+
+
+def test_job_runs_and_returns_result(client, workbook):
+    """Submit -> poll -> download through the job pool (forkserver worker, memory and time limits)."""
+    response = client.post("/jobs", data=upload(workbook[0]))
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+    deadline = time.time() + 60
+    while (status := client.get(f"/jobs/{job_id}").get_json())["status"] in ("queued", "running"):
+        assert time.time() < deadline, status
+        time.sleep(0.2)
+    assert status["status"] == "done" and status["highlighted"] == workbook[1], status
+    result = client.get(f"/jobs/{job_id}/result")
+    assert result.status_code == 200 and result.headers["X-DEP-Highlighted"] == str(workbook[1])
+    assert result.headers["Content-Disposition"].endswith("rdm_Highlighted.xlsx")
+    expected = dep_rows(workbook[0])
+    assert len(expected) == workbook[1] and yellow_rows(result.data) == expected
+
+
+def test_job_submit_failure_is_recorded(client, workbook, monkeypatch):
+    """A pool that cannot take the job fails it right away instead of leaving it queued for good."""
+    class BrokenPool:
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("A child process terminated abruptly")
+
+        def shutdown(self, wait=True):
+            pass
+
+    monkeypatch.setattr(server, "_get_job_pool", lambda: BrokenPool())
+    response = client.post("/jobs", data=upload(workbook[0]))
+    assert response.status_code == 503
+    status = client.get(f"/jobs/{response.get_json()['job_id']}").get_json()
+    assert status["status"] == "failed" and "terminated abruptly" in status["error"]
+    assert server._sweep_jobs() == 0
+
+
+def test_job_upload_is_capped(client, workbook, monkeypatch):
+    monkeypatch.setattr(server, "JOB_MAX_FILE_SIZE", 1000)
+    response = client.post("/jobs", data=upload(workbook[0]))
+    assert response.status_code == 413
+    assert not any(server.JOBS_DIR.iterdir())
+
+
+def test_lost_jobs_expire(client, monkeypatch):
+    """Queued/running entries nobody will finish stop counting against the job limit."""
+    monkeypatch.setattr(server, "JOB_MAX_SECONDS", 10)
+    now = time.time()
+    for job_id, fields in (("a" * 32, {"status": "running", "created": now - 500, "started": now - 400}),
+                           ("b" * 32, {"status": "queued", "created": now - 10000}),
+                           ("c" * 32, {"status": "running", "created": now, "started": now})):
+        (server.JOBS_DIR / job_id).mkdir(parents=True)
+        server._write_job(server.JOBS_DIR / job_id, id=job_id, **fields)
+    assert server._sweep_jobs() == 1
+    assert client.get(f"/jobs/{'a' * 32}").get_json()["status"] == "failed"
+    assert client.get(f"/jobs/{'b' * 32}").get_json()["status"] == "failed"
+
+
+def test_cache_evicts_least_recently_used(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "CACHE_MAX_BYTES", 250)
+    result = tmp_path / "result.bin"
+    result.write_bytes(b"x" * 100)
+    for age, key in ((30, "a"), (20, "b")):
+        server.cache_put(key, result, {"key": key})
+        os.utime(server.CACHE_DIR / f"{key}.out", (time.time() - age,) * 2)
+    assert server.cache_get("a")[1] == {"key": "a"}  # a is now the most recently used
+    server.cache_put("c", result, {"key": "c"})
+    assert server.cache_get("b") is None
+    assert server.cache_get("a") and server.cache_get("c")
+    assert not list(server.CACHE_DIR.glob("*.tmp"))
+
+
+def test_process_cache_hit_and_verify_option(client, workbook):
+    """A repeat upload is served from the cache; verify=1 never gets an unverified cached result."""
+    first = client.post("/process", data=upload(workbook[0]))
+    again = client.post("/process", data=upload(workbook[0]))
+    assert (first.headers["X-DEP-Cache"], again.headers["X-DEP-Cache"]) == ("miss", "hit")
+    assert first.data == again.data and int(again.headers["X-DEP-Highlighted"]) == workbook[1]
+    for cache in ("miss", "hit"):
+        verified = client.post("/process", data=upload(workbook[0], verify="1"))
+        assert verified.headers["X-DEP-Cache"] == cache and verified.headers["X-DEP-Verify"] == "ok"
+
+
+def kill_pool_workers():
+    """SIGKILL every worker of the job pool (as the OOM killer would), leaving the pool broken."""
+    pool = server._get_job_pool()
+    pool.submit(int).result()  # make sure the workers exist
+    for process in list(pool._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+    time.sleep(0.5)
+
+
+def test_batch_survives_dead_pool_worker(client, workbook):
+    kill_pool_workers()
+    response = client.post("/batch", data={"files": [(open(workbook[0], "rb"), f"rdm_{i}.xlsx") for i in range(3)]})
+    assert response.status_code == 200 and response.headers["X-DEP-Batch-Failed"] == "0"
+    manifest = json.loads(zipfile.ZipFile(io.BytesIO(response.data)).read("manifest.json"))
+    assert [entry["file"] for entry in manifest["files"]] == ["rdm_0.xlsx", "rdm_1.xlsx", "rdm_2.xlsx"]
+    assert manifest["highlighted"] == 3 * workbook[1]
+
+
+def test_batch_respects_job_limit(client, workbook, monkeypatch):
+    monkeypatch.setattr(server, "JOB_MAX_PENDING", 0)
+    for n in range(server.JOB_WORKERS):
+        job_dir = server.JOBS_DIR / f"{n:032x}"
+        job_dir.mkdir(parents=True)
+        server._write_job(job_dir, id=job_dir.name, status="queued", created=time.time())
+    response = client.post("/batch", data={"files": [(open(workbook[0], "rb"), "rdm.xlsx")]})
+    assert response.status_code == 429
+
+
+def test_batch_zip_too_large(client, workbook, monkeypatch):
+    """An oversized ZIP is refused for its size, not cut off and reported as a broken ZIP."""
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zf:
+        for i in range(3):
+            zf.write(workbook[0], f"rdm_{i}.xlsx")
+    monkeypatch.setattr(server, "BATCH_MAX_BYTES", len(archive.getvalue()) - 100)
+    response = client.post("/batch", data={"files": [(io.BytesIO(archive.getvalue()), "rdm.zip")]})
+    assert response.status_code == 400 and response.get_json()["error"].startswith("Batch too large")
+
+
+@pytest.mark.parametrize("form, message", [
+    ({"parcel_column": "Parcel Code"}, "No Parcel Number column: no header in row 4 matches 'parcel code'."),
+    ({"parcel_column": "0"}, "Invalid column: '0'. Use a letter (D), a 1-based number (4) or a header name"),
+    ({"notes_column": "*parcel*"}, "Ambiguous Parcel Notes column: '*parcel*' matches 2 headers in row 4: "
+                                   "parcel number (D), parcel notes (H)."),
+    ({"parcel_column": "H"}, "Parcel Number and Parcel Notes must be different columns (both are H)."),
+    ({"parcel_column": "*number*", "notes_column": "name:parcel number"},
+     "Parcel Number and Parcel Notes must be different columns (both are D)."),
+])
+def test_process_column_errors(client, workbook, form, message):
+    response = client.post("/process", data=upload(workbook[0], **form))
+    assert response.status_code == 400 and response.get_json()["error"].startswith(message)
+
+
+def test_process_columns_by_name(client, workbook):
+    response = client.post("/process", data=upload(workbook[0], parcel_column=" *PARCEL*number ", notes_column="8"))
+    assert response.status_code == 200 and int(response.headers["X-DEP-Highlighted"]) == workbook[1]
+    assert json.loads(response.headers["X-DEP-Sheets"])[0]["columns"] == {"parcel": "D", "notes": "H"}
+
+
+def test_analyze_csv_download_name(client, workbook):
+    """Quotes and non-Latin-1 characters in the upload's name still give a valid Content-Disposition."""
+    # the test client cannot send a name with a quote in it, so the multipart body is built by hand
+    body = b"".join([
+        b'--B\r\nContent-Disposition: form-data; name="file"; filename="',
+        'Łódź \\"Q3\\".xlsx'.encode("utf-8"), b'"\r\n\r\n', workbook[0].read_bytes(),
+        b'\r\n--B\r\nContent-Disposition: form-data; name="format"\r\n\r\ncsv\r\n--B--\r\n',
+    ])
+    response = client.post("/analyze", data=body, content_type="multipart/form-data; boundary=B")
+    assert response.status_code == 200 and response.mimetype == "text/csv"
+    disposition = response.headers["Content-Disposition"]
+    disposition.encode("latin-1")
+    assert "filename*=UTF-8''%C5%81%C3%B3d%C5%BA%20%22Q3%22_DEP_rows.csv" in disposition
+    assert len(response.data.decode("utf-8").splitlines()) == workbook[1] + 1
+
+
+@pytest.fixture
+def two_sheets(workbook, tmp_path):
+    wb = openpyxl.load_workbook(workbook[0])
+    wb.copy_worksheet(wb.worksheets[0]).title = "Copy"
+    path = tmp_path / "two_sheets.xlsx"
+    wb.save(path)
+    return path, workbook[1]
+
+
+def check_all_sheets(response, expected):
+    assert response.status_code == 200
+    sheets = json.loads(response.headers["X-DEP-Sheets"])
+    assert [sheet["highlighted"] for sheet in sheets] == [expected, expected]
+
+
+def test_sheets_after_dead_pool_worker(client, two_sheets, monkeypatch):
+    monkeypatch.setattr(server, "JOB_WORKERS", 2)
+    kill_pool_workers()
+    check_all_sheets(client.post("/process", data=upload(two_sheets[0], sheets="all")), two_sheets[1])
+
+
+def test_sheets_fall_back_when_pool_breaks(client, two_sheets, monkeypatch):
+    """A worker dying while the sheets run: the sheets are read in this process instead."""
+    def broken_submit(fn, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+        return pool, future
+
+    pool = server._get_job_pool()
+    monkeypatch.setattr(server, "JOB_WORKERS", 2)
+    monkeypatch.setattr(server, "_submit_job", broken_submit)
+    check_all_sheets(client.post("/process", data=upload(two_sheets[0], sheets="all")), two_sheets[1])
+    assert server._job_pool is not pool
+
+
+def test_sheets_do_not_wait_behind_jobs(client, two_sheets, monkeypatch):
+    """Sheets stuck in the job queue (or over the job memory cap) are read in this process after SHEET_POOL_WAIT."""
+    futures = []
+
+    def queued_submit(fn, *args):
+        future = Future()
+        if futures:
+            future.set_exception(MemoryError())
+        futures.append(future)
+        return pool, future
+
+    pool = server._get_job_pool()
+    monkeypatch.setattr(server, "JOB_WORKERS", 2)
+    monkeypatch.setattr(server, "SHEET_POOL_WAIT", 0.2)
+    monkeypatch.setattr(server, "_submit_job", queued_submit)
+    t0 = time.monotonic()
+    check_all_sheets(client.post("/process", data=upload(two_sheets[0], sheets="all")), two_sheets[1])
+    assert time.monotonic() - t0 < 10 and futures[0].cancelled()
+    assert server._job_pool is pool
+
+
+def test_memory_estimate_from_zip_directory(workbook, two_sheets):
+    with zipfile.ZipFile(workbook[0]) as zf:
+        sizes = {info.filename: info.file_size for info in zf.infolist()}
+    sheet_mb = sizes["xl/worksheets/sheet1.xml"] / (1024 * 1024)
+    shared_mb = sizes.get("xl/sharedStrings.xml", 0) / (1024 * 1024) * server.MEMORY_FACTORS["shared_strings"]
+    assert server.estimate_memory_mb(workbook[0]) == round(sheet_mb + shared_mb, 1)
+    assert server.estimate_memory_mb(workbook[0], reader="pandas") == round(3 * sheet_mb + shared_mb, 1)
+    assert server.estimate_memory_mb(workbook[0], writer="openpyxl") == round(12 * sheet_mb + shared_mb, 1)
+    with zipfile.ZipFile(two_sheets[0]) as zf:
+        sheets_mb = [zf.getinfo(f"xl/worksheets/sheet{n}.xml").file_size / (1024 * 1024) for n in (1, 2)]
+        shared = sum(info.file_size for info in zf.infolist() if info.filename == "xl/sharedStrings.xml")
+    shared_mb = shared / (1024 * 1024) * server.MEMORY_FACTORS["shared_strings"]
+    assert server.estimate_memory_mb(two_sheets[0], sheets=["Copy"]) == round(sheets_mb[1] + shared_mb, 1)
+    assert server.estimate_memory_mb(two_sheets[0], sheets="all") == round(sum(sheets_mb) + shared_mb, 1)
+    assert server.estimate_memory_mb(b"not a zip") is None
+
+
+def test_admission_rejects_and_queues(client, tmp_path, monkeypatch):
+    """Over the whole budget: 413 at once. Budget taken by another request: 503 with Retry-After once
+    the wait runs out; the same upload goes through when the budget is free again."""
+    path = tmp_path / "large.xlsx"
+    expected = make_workbook(path, 4000, dep_density=0.3, run_lengths=(1, 2, 3))
+    need = server.estimate_memory_mb(path)
+    assert need >= 0.5
+    monkeypatch.setattr(server, "ADMISSION", server._Admission(need / 2, 1000, 1, 0.2, 8))
+    assert client.post("/process", data=upload(path)).status_code == 413
+
+    admission = server._Admission(need * 1.5, 1000, 1, 0.2, 8)
+    monkeypatch.setattr(server, "ADMISSION", admission)
+    with admission.reserve(need):
+        busy = client.post("/process", data=upload(path))
+    assert busy.status_code == 503 and busy.headers["Retry-After"]
+    ok = client.post("/process", data=upload(path))
+    assert ok.status_code == 200 and int(ok.headers["X-DEP-Highlighted"]) == expected
+    assert float(ok.headers["X-DEP-Memory-Estimate-MB"]) == need
+    assert admission.stats()["in_use_mb"] == 0 and admission.stats()["rejected"] == 1
+
+
+def indexed_files():
+    with sqlite3.connect(server.PARCEL_INDEX.path) as conn:
+        return conn.execute("SELECT filename, dep_parcels FROM files ORDER BY id").fetchall()
+
+
+def test_parcel_index_reports_repeats(client, workbook, tmp_path):
+    later = tmp_path / "later.xlsx"  # same generator seed: its DEP parcels are a subset of the first file's
+    make_workbook(later, 200, header_offset=3, dep_density=0.3, run_lengths=(1, 2, 3))
+    dep_parcels = client.post("/analyze", data=upload(workbook[0])).get_json()["dep_parcels"]
+    assert dep_parcels > 0
+
+    first = client.post("/process", data=upload(workbook[0], "January.xlsx"))
+    assert json.loads(first.headers["X-DEP-Repeat-DEP"])["count"] == 0
+    second = client.post("/process", data=upload(later, "February.xlsx"))
+    repeats = json.loads(second.headers["X-DEP-Repeat-DEP"])
+    assert repeats["count"] > 0
+    assert all(p["files"] == ["January.xlsx"] for p in repeats["parcels"])
+    assert indexed_files()[0] == ("January.xlsx", dep_parcels)
+    history = client.get(f"/parcels/{repeats['parcels'][0]['parcel']}").get_json()
+    assert [f["filename"] for f in history["files"]] == ["January.xlsx", "February.xlsx"]
+
+
+def test_cache_hit_indexes_unknown_file(client, workbook, tmp_path, monkeypatch):
+    """A cached result for a file the index has never seen still records its DEP parcels."""
+    dep_parcels = client.post("/analyze", data=upload(workbook[0])).get_json()["dep_parcels"]
+    assert client.post("/process", data=upload(workbook[0])).headers["X-DEP-Cache"] == "miss"
+    monkeypatch.setattr(server, "PARCEL_INDEX", server._ParcelIndex(str(tmp_path / "new_index.sqlite3"), 1000))
+    hit = client.post("/process", data=upload(workbook[0]))
+    assert hit.headers["X-DEP-Cache"] == "hit"
+    assert indexed_files() == [("rdm.xlsx", dep_parcels)]
+
+
+def test_chunked_upload_resumes_and_finalizes(client, workbook, monkeypatch):
+    """Chunks at the wrong offset get 409 with the server's offset; the client resumes from there.
+    finalize gives the same file as /process, keeps the upload after a 503 and removes it afterwards."""
+    monkeypatch.setattr(server, "CACHE_MAX_BYTES", 0)
+    data = workbook[0].read_bytes()
+    created = client.post("/uploads", json={"filename": "rdm.xlsx", "size": len(data)})
+    assert created.status_code == 201
+    url, finalize_url = created.get_json()["upload_url"], created.get_json()["finalize_url"]
+
+    assert client.put(f"{url}?offset=0", data=data[:1000]).get_json()["offset"] == 1000
+    repeat = client.put(f"{url}?offset=0", data=data[:1000])  # response was lost, client sends it again
+    assert repeat.status_code == 409 and repeat.get_json()["offset"] == 1000
+    assert client.post(finalize_url).status_code == 409
+    offset = client.get(url).get_json()["offset"]
+    while offset < len(data):
+        offset = client.put(f"{url}?offset={offset}", data=data[offset:offset + 777]).get_json()["offset"]
+    assert client.get(url).get_json()["complete"]
+
+    monkeypatch.setattr(server, "ADMISSION", server._Admission(1000, 0, 0, 0.1, 8))  # every request heavy, no slot
+    assert client.post(finalize_url).status_code == 503
+    assert client.get(url).status_code == 200  # kept for a retry
+    monkeypatch.setattr(server, "ADMISSION", server._Admission(1000, 1000, 1, 0.1, 8))
+    finalized = client.post(finalize_url, data={"fill_mode": "row"})
+    assert finalized.status_code == 200 and int(finalized.headers["X-DEP-Highlighted"]) == workbook[1]
+    assert client.get(url).status_code == 404
+    direct = client.post("/process", data=upload(workbook[0], fill_mode="row"))
+    assert finalized.data == direct.data
+
+
+
+def table_rows(n=60, seed=7):
+    """Title line, header, then n data rows in parcel runs of 1-5 rows, some noted DEP. Every third row is
+    short (ragged CSV). Returns (rows, 0-based data rows the highlighter must flag)."""
+    rng = random.Random(seed)
+    rows = [["County RDM export"], ["Tax ID", "Bill ID", "Owner", "Parcel Number", "Address", "Amount", "Status", "Parcel Notes", "Zip"]]
+    flagged, run = set(), 0
+    while len(rows) - 2 < n:
+        length, dep = rng.randint(1, 5), rng.random() < 0.5
+        start = len(rows) - 2
+        for _ in range(min(length, n - start)):
+            i = len(rows) - 2
+            row = [str(1000 + i), f"B{i}", "Müller", f"100-{run:04d}", "1 Main St", f"{i * 2.5:.2f}", "Open", "DEP" if dep else "", "01234"]
+            rows.append(row if i % 3 else row[:8])
+        if dep and len(rows) - 2 - start >= 2:
+            flagged.update(range(start, len(rows) - 2))
+        run += 1
+    return rows, flagged
+
+
+def write_csv(path, rows, encoding="utf-8", delimiter=","):
+    with open(path, "w", encoding=encoding, newline="") as f:
+        csv.writer(f, delimiter=delimiter).writerows(rows)
+    return path
+
+
+def test_csv_run_across_chunks_to_xlsx(client, tmp_path, monkeypatch):
+    """DEP runs that cross TABLE_CHUNK_ROWS boundaries are highlighted whole; numbers are written as numbers."""
+    monkeypatch.setattr(server, "TABLE_CHUNK_ROWS", 7)
+    rows, flagged = table_rows()
+    assert any((first + 2) // 7 != (first + 3) // 7 for first in flagged if first + 1 in flagged)
+    response = client.post("/process", data=upload(write_csv(tmp_path / "rdm.csv", rows)))
+    assert response.status_code == 200 and response.mimetype == server.XLSX_MIMETYPE
+    assert int(response.headers["X-DEP-Highlighted"]) == len(flagged)
+    assert int(response.headers["X-DEP-Header-Row"]) == 2
+    assert yellow_rows(response.data) == {i + 3 for i in flagged}
+    ws = openpyxl.load_workbook(io.BytesIO(response.data)).worksheets[0]
+    assert [c.value for c in ws[2]][:3] == ["Tax ID", "Bill ID", "Owner"]
+    assert (ws["A3"].value, ws["F4"].value, ws["D3"].value, ws["I4"].value) == (1000, 2.5, "100-0000", "01234")
+
+
+def test_csv_same_format(client, tmp_path, monkeypatch):
+    """output_format=same: the CSV back with a DEP Highlight column, header flagged, short rows padded."""
+    monkeypatch.setattr(server, "TABLE_CHUNK_ROWS", 7)
+    rows, flagged = table_rows()
+    response = client.post("/process", data=upload(write_csv(tmp_path / "rdm.csv", rows), output_format="same"))
+    assert response.status_code == 200 and response.mimetype == "text/csv"
+    assert response.headers["Content-Disposition"].endswith("rdm_Highlighted.csv")
+    out = list(csv.reader(io.StringIO(response.data.decode("utf-8"))))
+    assert out[0] == ["County RDM export"] + [""] * 8 + [""]
+    assert out[1] == rows[1] + [server.HIGHLIGHT_COLUMN]
+    assert all(len(row) == 10 for row in out)
+    assert [row[-1] for row in out[2:]] == ["TRUE" if i in flagged else "FALSE" for i in range(len(rows) - 2)]
+    assert [row[:len(orig)] for row, orig in zip(out, rows)] == rows
+
+
+def test_csv_encoding_and_delimiter_sniffed(client, tmp_path):
+    """A Windows-1252, semicolon-separated export is read and returned in the same encoding and delimiter."""
+    rows, flagged = table_rows(30)
+    path = write_csv(tmp_path / "rdm.csv", rows, encoding="cp1252", delimiter=";")
+    assert server._csv_format(path) == ("cp1252", ";")
+    response = client.post("/process", data=upload(path, output_format="same"))
+    assert response.status_code == 200 and int(response.headers["X-DEP-Highlighted"]) == len(flagged)
+    out = list(csv.reader(io.StringIO(response.data.decode("cp1252")), delimiter=";"))
+    assert out[2][2] == "Müller" and [row[-1] == "TRUE" for row in out[2:]] == [i in flagged for i in range(30)]
+    xlsx = client.post("/process", data=upload(path))
+    assert openpyxl.load_workbook(io.BytesIO(xlsx.data)).worksheets[0]["C3"].value == "Müller"
+
+
+def test_parquet_both_outputs(client, tmp_path, monkeypatch):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(server, "TABLE_CHUNK_ROWS", 7)
+    rows, flagged = table_rows()
+    header, data = rows[1], [row + [""] * (9 - len(row)) for row in rows[2:]]
+    table = pa.table({name: [row[c] for row in data] for c, name in enumerate(header)})
+    path = tmp_path / "rdm.parquet"
+    pq.write_table(table, path, row_group_size=10)
+    same = client.post("/process", data=upload(path, output_format="same"))
+    assert same.status_code == 200 and int(same.headers["X-DEP-Highlighted"]) == len(flagged)
+    result = pq.read_table(io.BytesIO(same.data))
+    assert result.column_names == header + [server.HIGHLIGHT_COLUMN]
+    assert result.column(server.HIGHLIGHT_COLUMN).to_pylist() == [i in flagged for i in range(len(data))]
+    xlsx = client.post("/process", data=upload(path))
+    assert xlsx.status_code == 200 and yellow_rows(xlsx.data) == {i + 2 for i in flagged}
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
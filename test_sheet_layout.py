@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Checks for the sheet layout heuristics: which row is the header (score_header_rows / detect_header_row)
+and which columns hold the parcel number and the notes (parse_column_spec grammar, _ColumnResolver).
+Run directly (python test_sheet_layout.py) or via pytest.
+"""
+import sys
+from pathlib import Path
+
+DEPLOY_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(DEPLOY_DIR))
+
+import openpyxl
+import pytest
+
+import dep_highlighter_server as server
+from benchmark import make_workbook
+
+
+def save_rows(path, rows):
+    wb = openpyxl.Workbook()
+    for row in rows:
+        wb.active.append(list(row))
+    wb.save(path)
+    return path
+
+
+def plain_sheet(dep_runs=((2, 4), (7, 8), (11, 12))):
+    """A header of 8 labels none of which is a known token, then text-heavy data rows 10 cells wide.
+    dep_runs are (first, last) data row indexes of the DEP runs; returns (rows, number of DEP rows)."""
+    header = ["Ref", "Town", "Holder", "Lot", "Street", "Value", "State", "Remarks"]
+    dep = {i for first, last in dep_runs for i in range(first, last + 1)}
+    data = []
+    for i in range(14):
+        lot = next((f"L-{first}" for first, last in dep_runs if first <= i <= last), f"L-x{i}")
+        data.append([f"r{i}", "Albany", f"Holder {i}", lot, f"{i} Main St", f"v{i}", "open",
+                     "DEP review" if i in dep else "none", f"memo {i}", f"tag {i}"])
+    return [header] + data, len(dep)
+
+
+def test_tokenless_header_is_not_outscored_by_wider_data():
+    rows, _ = plain_sheet()
+    offset, info = server.score_header_rows(rows)
+    assert offset == 0 and info["tokens"] == [] and "no header tokens" in info["reason"]
+
+
+def test_title_row_above_header():
+    rows, _ = plain_sheet()
+    assert server.score_header_rows([["Albany County DEP report", None, "2026"]] + rows)[0] == 1
+    assert server.score_header_rows([["Albany County DEP report"], [], []] + rows)[0] == 3
+
+
+def test_header_tokens_win_over_wider_rows():
+    header = ["Tax ID", "Bill ID", "Owner", "Parcel Number", "Address", "Amount", "Status", "Parcel Notes"]
+    rows = [["NY RDM report", "page 1"], header] + [[f"x{i}"] * 10 for i in range(5)]
+    offset, info = server.score_header_rows(rows)
+    assert offset == 1 and {"tax id", "parcel", "notes"} <= set(info["tokens"])
+
+
+def test_repeated_notes_are_not_tokens():
+    rows = [["a", "b", "c"]] + [["1", "2", "DEP"] for _ in range(5)]
+    assert server.score_header_rows(rows)[1]["tokens"] == []
+
+
+def test_no_wide_row_falls_back_to_first_row():
+    offset, info = server.score_header_rows([["title"], [None, "x"], []])
+    assert offset == 0 and "using row 1" in info["reason"]
+
+
+@pytest.mark.parametrize("header_offset", [0, 1, 5, 7])
+def test_detect_header_offset(tmp_path, header_offset):
+    path = tmp_path / "rdm.xlsx"
+    make_workbook(path, 40, header_offset=header_offset)
+    offset, info = server.detect_header_row(path)
+    assert offset == header_offset and info["header_row"] == header_offset + 1
+
+
+def test_tokenless_header_highlights_every_dep_row(tmp_path):
+    rows, dep_rows = plain_sheet()
+    path = save_rows(tmp_path / "plain.xlsx", rows)
+    assert server.detect_header_row(path)[0] == 0
+    _, _, highlighted, data_rows, _ = server.process_excel_file(path, "plain.xlsx")
+    assert (highlighted, data_rows) == (dep_rows, len(rows) - 1)
+
+
+
+@pytest.mark.parametrize("spec, parsed", [
+    ("D", ("index", 3)), ("d", ("index", 3)), (" col:h ", ("index", 7)), ("AA", ("index", 26)),
+    ("4", ("index", 3)), ("col: 12", ("index", 11)), ("XFD", ("index", 16383)),
+    ("Parcel Number", ("name", "parcel number")), ("  PARCEL   number ", ("name", "parcel number")),
+    ("name:DEP", ("name", "dep")), ("*parcel*notes*", ("name", "*parcel*notes*")),
+])
+def test_parse_column_spec(spec, parsed):
+    assert server.parse_column_spec(spec) == parsed
+
+
+@pytest.mark.parametrize("spec", ["0", "col:0", "16385", "XFE", "name:", "col:", "", "col:Parcel"])
+def test_parse_column_spec_rejects(spec):
+    with pytest.raises(ValueError, match="Invalid column"):
+        server.parse_column_spec(spec)
+
+
+HEADER_ROW = ["Tax ID", "Bill ID", "Owner", "Parcel Number", "Address", "Amount", "Status", "Parcel Notes"]
+
+
+@pytest.mark.parametrize("columns, resolved", [
+    (None, (3, 7)),
+    ({"parcel": "parcel number", "notes": "name:Parcel   Notes"}, (3, 7)),
+    ({"parcel": "*number", "notes": "Status"}, (3, 6)),
+    ({"parcel": "b", "notes": "?wner"}, (1, 2)),
+])
+def test_column_resolver(columns, resolved):
+    sample = [["RDM report"], HEADER_ROW, ["1", "B1", "x", "P1", "a", 1, "Open", "DEP"]]
+    resolver = server._ColumnResolver(columns)
+    assert resolver(sample) == resolved and resolver.header_row == (1 if resolver.by_name else None)
+
+
+@pytest.mark.parametrize("columns, message", [
+    ({"parcel": "Parcel Code"}, "No Parcel Number column: no header in row 2 matches 'parcel code'"),
+    ({"notes": "*parcel*"}, "Ambiguous Parcel Notes column: '*parcel*' matches 2 headers in row 2: "
+                            "parcel number (D), parcel notes (H)"),
+    ({"parcel": "name:Parcel Notes"}, "Parcel Number and Parcel Notes must be different columns (both are H)"),
+])
+def test_column_resolver_errors(columns, message):
+    resolver = server._ColumnResolver(columns)
+    assert resolver([["RDM report"], HEADER_ROW, ["1"] * 8]) is None
+    assert str(resolver.error).startswith(message)
+
+
+def test_column_specs_errors():
+    with pytest.raises(ValueError, match=r"must be different columns \(both are D\)"):
+        server.column_specs({"parcel": "4", "notes": "col:d"})
+    with pytest.raises(ValueError, match="Unknown column role: owner"):
+        server.column_specs({"owner": "C"})
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))